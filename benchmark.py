@@ -0,0 +1,329 @@
+# shunyatax/benchmark.py
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+import config
+import main
+import parser
+import raw_store
+import utils
+from ledger_store import LedgerStore
+
+# Phase 2 benchmarks over the saved pages in config.DATA_DIR:
+#
+#   extraction     - documents/second through parser.extract_judgment_data, in
+#                    this process, from HTML already in memory
+#   stages         - milliseconds per document spent in each of
+#                    parser.EXTRACTION_STAGES (title, table fields, summary, the
+#                    Full_Text walk, comments, related judgments, ...)
+#   worker_memory  - how far each Phase 2 worker's peak RSS grows over one
+#                    pass, above the RSS it started with (forked workers start
+#                    with the pages they inherit from this process)
+#   phase2         - end-to-end main.run_phase2_data_extraction throughput for
+#                    each worker count, into a scratch output folder
+#
+# A run can be saved as the baseline (config.BENCHMARK_BASELINE_FILE); later
+# runs are compared against it and any metric more than
+# config.BENCHMARK_REGRESSION_THRESHOLD worse is reported as a regression, which
+# makes the script exit with status 1. Baselines only mean something on the
+# machine they were recorded on.
+
+# Stages cheaper than this (ms per document) are too noisy to gate on
+_MIN_GATED_STAGE_MS = 0.1
+
+
+def load_corpus(data_dir=None):
+    """
+    Returns the saved detail pages under data_dir (default: config.DATA_DIR) as
+    ledger-style entries: unique_id, file_path, post_url, category and page.
+    post_url is read from each page's canonical link.
+    """
+    data_dir = data_dir or config.DATA_DIR
+    entries = []
+    for category_page in sorted(glob.glob(os.path.join(data_dir, '*', 'page_*', 'category_response.html'))):
+        page_folder = os.path.dirname(category_page)
+        category_name = os.path.basename(os.path.dirname(page_folder))
+        page = int(os.path.basename(page_folder)[len('page_'):])
+        for detail_page in sorted(glob.glob(os.path.join(page_folder, '*.html'))):
+            if detail_page == category_page:
+                continue
+            post_url = parser.extract_judgment_data(detail_page).get('Post_URL', '')
+            entries.append({
+                'unique_id': os.path.splitext(os.path.basename(detail_page))[0],
+                'file_path': os.path.abspath(detail_page),
+                'post_url': post_url,
+                'category': category_name,
+                'page': page,
+            })
+    return entries
+
+
+def benchmark_extraction(entries, repeat=3):
+    """
+    Extracts every entry repeat times from HTML held in memory, with the
+    category fallbacks worked out beforehand, so only extraction is timed.
+
+    Returns:
+        dict: 'docs_per_second' (median over the passes) and 'stages_ms_per_doc'
+              (mean milliseconds per document in each parser stage).
+    """
+    pages = []
+    fallbacks_by_listing = {}
+    for entry in entries:
+        listing_path = os.path.join(os.path.dirname(entry['file_path']), 'category_response.html')
+        if listing_path not in fallbacks_by_listing:
+            with open(listing_path, 'r', encoding='utf-8') as f:
+                fallbacks_by_listing[listing_path] = parser.extract_category_fallbacks(f.read())
+        with open(entry['file_path'], 'r', encoding='utf-8') as f:
+            detail_html = f.read()
+        category_fallback = fallbacks_by_listing[listing_path].get(utils.generate_unique_id(entry['post_url']))
+        pages.append((entry['file_path'], detail_html, category_fallback))
+
+    rates = []
+    timings = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for file_path, detail_html, category_fallback in pages:
+            parser.extract_judgment_data(file_path, category_fallback=category_fallback, detail_html=detail_html, timings=timings)
+        rates.append(len(pages) / (time.perf_counter() - start))
+
+    documents = len(pages) * repeat
+    return {
+        'docs_per_second': round(statistics.median(rates), 2),
+        'stages_ms_per_doc': {stage: round(timings.get(stage, 0.0) * 1000 / documents, 4) for stage in parser.EXTRACTION_STAGES},
+    }
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where the resource module is missing."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+_worker_start_rss_mb = None
+
+
+def _init_memory_worker():
+    """Pool initializer for measure_worker_memory: notes the RSS the worker starts with, then initializes it as Phase 2 does."""
+    global _worker_start_rss_mb
+    _worker_start_rss_mb = _peak_rss_mb()
+    main._init_extraction_worker()
+
+
+def _extract_chunk_with_rss(page_tasks):
+    """Worker task for measure_worker_memory: one Phase 2 chunk, then how far this worker's peak RSS has grown."""
+    main._process_extraction_chunk(page_tasks)
+    return os.getpid(), _peak_rss_mb() - _worker_start_rss_mb
+
+
+def measure_worker_memory(entries, workers):
+    """
+    Runs one Phase 2 pass over entries in a fresh pool of workers processes,
+    chunked as Phase 2 chunks them, and reports how much each worker's peak RSS
+    grew above its RSS at start. ru_maxrss in a forked worker already counts the
+    memory it shares with this process, so the peak alone would mostly measure us.
+
+    Returns:
+        dict or None: 'workers', 'rss_growth_mb_max' and 'rss_growth_mb_mean', or
+                      None if peak RSS can't be read on this platform.
+    """
+    if resource is None:
+        return None
+    chunks = main._chunk_page_tasks(main._group_entries_by_listing_page(entries), config.PHASE2_CHUNK_SIZE)
+    growth = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_memory_worker) as executor:
+        for pid, grown in executor.map(_extract_chunk_with_rss, chunks):
+            growth[pid] = max(grown, growth.get(pid, 0.0))
+    return {
+        'workers': len(growth),
+        'rss_growth_mb_max': round(max(growth.values()), 1),
+        'rss_growth_mb_mean': round(statistics.mean(growth.values()), 1),
+    }
+
+
+def benchmark_phase2(entries, worker_counts, repeat=1, work_dir=None):
+    """
+    Runs main.run_phase2_data_extraction over entries once per repeat for each
+    worker count, each time into an empty output folder in a scratch work_dir (a
+    temporary folder by default, removed afterwards). Index updates and the
+    metrics snapshot are off.
+
+    Returns:
+        dict: {worker count (str): {'seconds', 'docs_per_second'}}, the median run of each.
+    """
+    own_work_dir = work_dir is None
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix='shunyatax-bench-'))
+    os.makedirs(work_dir, exist_ok=True)
+    saved = {name: getattr(config, name) for name in (
+        'LEDGER_FILE', 'LEDGER_DB_FILE', 'OUTPUT_DIR', 'PHASE2_WORKERS', 'UPDATE_INDEXES_AFTER_EXTRACTION', 'METRICS_FILE')}
+    saved_stores = (utils._ledger_store, raw_store._pack_store)
+    results = {}
+    try:
+        config.LEDGER_FILE = os.path.join(work_dir, 'ledger.csv') # Never created, so nothing is imported
+        config.LEDGER_DB_FILE = os.path.join(work_dir, 'ledger.db')
+        config.UPDATE_INDEXES_AFTER_EXTRACTION = False
+        config.METRICS_FILE = None
+        ledger = LedgerStore(config.LEDGER_DB_FILE)
+        for entry in entries:
+            ledger.add(entry['unique_id'], entry['file_path'], entry['post_url'], entry['category'], entry['page'])
+        ledger.close()
+
+        for workers in worker_counts:
+            config.PHASE2_WORKERS = workers
+            runs = []
+            for run in range(repeat):
+                config.OUTPUT_DIR = os.path.join(work_dir, f"extracted_{workers}_{run}")
+                start = time.perf_counter()
+                main.run_phase2_data_extraction()
+                runs.append(time.perf_counter() - start)
+            seconds = statistics.median(runs)
+            results[str(workers)] = {'seconds': round(seconds, 3), 'docs_per_second': round(len(entries) / seconds, 2)}
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+        # Phase 2 opened the process-wide stores on the scratch folder; put back the
+        # ones from before, so later calls don't use a folder that is about to go.
+        if utils._ledger_store is not saved_stores[0]:
+            utils._ledger_store.close()
+            utils._ledger_store = saved_stores[0]
+        if raw_store._pack_store is not saved_stores[1]:
+            raw_store._pack_store.close()
+            raw_store._pack_store = saved_stores[1]
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def run_benchmarks(data_dir=None, repeat=3, worker_counts=None):
+    """Runs every benchmark over the pages in data_dir and returns the report dict."""
+    entries = load_corpus(data_dir)
+    if not entries:
+        raise ValueError(f"No saved detail pages under {data_dir or config.DATA_DIR}.")
+    cpu_count = multiprocessing.cpu_count()
+    worker_counts = worker_counts or sorted({1, 2, cpu_count})
+
+    # Phase 2 finds each post's listing page under config.DATA_DIR
+    saved_data_dir = config.DATA_DIR
+    config.DATA_DIR = data_dir or config.DATA_DIR
+    try:
+        extraction = benchmark_extraction(entries, repeat)
+        worker_memory = measure_worker_memory(entries, max(worker_counts))
+        phase2 = benchmark_phase2(entries, worker_counts, repeat)
+    finally:
+        config.DATA_DIR = saved_data_dir
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': cpu_count,
+            'parser_backend': config.PARSER_BACKEND,
+            'scoped_parse': config.SCOPED_PARSE,
+            'parser_version': parser.PARSER_VERSION,
+        },
+        'documents': len(entries),
+        'repeat': repeat,
+        'docs_per_second': extraction['docs_per_second'],
+        'stages_ms_per_doc': extraction['stages_ms_per_doc'],
+        'worker_memory': worker_memory,
+        'phase2': phase2,
+    }
+
+
+def _gated_metrics(report):
+    """Yields (name, value, higher_is_better) for every metric a regression check looks at."""
+    yield 'docs_per_second', report['docs_per_second'], True
+    for stage, milliseconds in report['stages_ms_per_doc'].items():
+        yield f"stages_ms_per_doc.{stage}", milliseconds, False
+    if report.get('worker_memory') and 'rss_growth_mb_max' in report['worker_memory']:
+        yield 'worker_memory.rss_growth_mb_max', report['worker_memory']['rss_growth_mb_max'], False
+    for workers, run in report['phase2'].items():
+        yield f"phase2.{workers}.docs_per_second", run['docs_per_second'], True
+
+
+def compare_to_baseline(report, baseline, threshold=None):
+    """
+    Compares a report with a baseline report.
+
+    Returns:
+        list: One message per metric that got worse by more than threshold
+              (default config.BENCHMARK_REGRESSION_THRESHOLD, as a fraction).
+              Metrics missing from either report are skipped.
+    """
+    threshold = config.BENCHMARK_REGRESSION_THRESHOLD if threshold is None else threshold
+    baseline_values = {name: value for name, value, _ in _gated_metrics(baseline)}
+    regressions = []
+    for name, value, higher_is_better in _gated_metrics(report):
+        expected = baseline_values.get(name)
+        if not expected or value is None:
+            continue
+        if name.startswith('stages_ms_per_doc.') and expected < _MIN_GATED_STAGE_MS:
+            continue
+        change = (value - expected) / expected
+        if (-change if higher_is_better else change) > threshold:
+            regressions.append(f"{name}: {value} vs baseline {expected} ({change:+.1%})")
+    return regressions
+
+
+def main_cli():
+    argument_parser = argparse.ArgumentParser(description="Benchmark Phase 2 extraction and check it against a saved baseline.")
+    argument_parser.add_argument('--data-dir', help="Saved pages to benchmark on (default: config.DATA_DIR).")
+    argument_parser.add_argument('--repeat', type=int, default=3, help="Passes per benchmark; the median is reported.")
+    argument_parser.add_argument('--workers', type=int, nargs='+', help="Phase 2 worker counts to run (default: 1, 2 and the CPU count).")
+    argument_parser.add_argument('--baseline', default=config.BENCHMARK_BASELINE_FILE, help="Baseline file to compare with or save to.")
+    argument_parser.add_argument('--save-baseline', action='store_true', help="Save this run as the baseline instead of comparing.")
+    argument_parser.add_argument('--threshold', type=float, help="Allowed fraction of slowdown (default: config.BENCHMARK_REGRESSION_THRESHOLD).")
+    argument_parser.add_argument('--json', help="Also write the report to this file.")
+    args = argument_parser.parse_args()
+
+    # Phase 2 logs every category and its progress bars; only problems matter here.
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    report = run_benchmarks(args.data_dir, args.repeat, args.workers)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}.")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one.")
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('environment') != report['environment']:
+        print(f"WARNING: baseline was recorded with {baseline.get('environment')}; comparisons may not be meaningful.")
+    regressions = compare_to_baseline(report, baseline, args.threshold)
+    if regressions:
+        print("FAIL: regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main_cli()
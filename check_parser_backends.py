@@ -0,0 +1,54 @@
+import os
+import glob
+import time
+
+import config
+import parser
+
+def check_parser_backends(data_dir=None, backends=('bs4', 'lxml')):
+    """
+    Runs every saved detail and category page under data_dir through each parser
+    backend, parsing detail pages both whole and scoped to parser.DETAIL_REGIONS,
+    and reports any field that differs from the first (reference) backend's
+    whole-page output. Returns the number of mismatches.
+    """
+    data_dir = data_dir or config.DATA_DIR
+    reference, others = backends[0], backends[1:]
+    category_pages = sorted(glob.glob(os.path.join(data_dir, '*', 'page_*', 'category_response.html')))
+    mismatches = 0
+    modes = [(backend, scoped) for backend in backends for scoped in (False, True)]
+    timings = dict.fromkeys(modes, 0.0)
+
+    for category_page in category_pages:
+        with open(category_page, 'r', encoding='utf-8') as f:
+            category_html = f.read()
+        for function in (parser.extract_post_urls, parser.extract_post_entries,
+                         parser.extract_last_page_number, parser.extract_category_fallbacks):
+            expected = function(category_html, reference)
+            for backend in others:
+                if function(category_html, backend) != expected:
+                    print(f"MISMATCH {category_page}: {function.__name__} ({backend} vs {reference})")
+                    mismatches += 1
+
+        page_folder = os.path.dirname(category_page)
+        for detail_page in sorted(glob.glob(os.path.join(page_folder, '*.html'))):
+            if detail_page == category_page:
+                continue
+            results = {}
+            for backend, scoped in modes:
+                start = time.perf_counter()
+                results[(backend, scoped)] = parser.extract_judgment_data(detail_page, category_page, backend=backend, scoped=scoped)
+                timings[(backend, scoped)] += time.perf_counter() - start
+            for mode in modes[1:]:
+                for field, value in results[modes[0]].items():
+                    if results[mode].get(field) != value:
+                        print(f"MISMATCH {detail_page}: {field} ({mode[0]}{' scoped' if mode[1] else ''} vs {reference})")
+                        mismatches += 1
+
+    for (backend, scoped), seconds in timings.items():
+        print(f"{backend}{' scoped' if scoped else ''}: {seconds:.2f}s extracting detail pages")
+    print(f"Checked {len(category_pages)} category pages: {mismatches} mismatches.")
+    return mismatches
+
+if __name__ == "__main__":
+    check_parser_backends()
@@ -29,11 +29,36 @@ MAX_RETRIES = 3
 # Timeout in seconds for HTTP requests
 REQUEST_TIMEOUT = 15
 
-# Minimum and maximum delay in seconds between fetching pages for rate limiting
-MIN_RATE_LIMIT_DELAY = 2
-MAX_RATE_LIMIT_DELAY = 8
+# Base delay in seconds for the exponential retry backoff
+RETRY_DELAY_SECONDS = 2
 
-# Maximum number of concurrent workers for Phase 1
+# Connection pool limits for the shared async fetch engine
+MAX_CONNECTIONS = 10
+MAX_CONNECTIONS_PER_HOST = 5
+
+# Seconds an idle keep-alive connection is kept open in the pool
+KEEPALIVE_TIMEOUT = 30
+
+# -- Rate Limiting (token bucket with AIMD tuning) --
+# Requests per second the shared limiter starts at, and the bounds it may tune within
+RATE_LIMIT_INITIAL_RPS = 1.0
+RATE_LIMIT_MIN_RPS = 0.1
+RATE_LIMIT_MAX_RPS = 5.0
+
+# Maximum number of tokens the bucket can hold (size of a permitted burst)
+RATE_LIMIT_BURST = 5
+
+# Additive increase per successful request, multiplicative decrease on 429/timeout
+RATE_LIMIT_INCREASE_STEP = 0.05
+RATE_LIMIT_DECREASE_FACTOR = 0.5
+
+# Minimum seconds between two decreases, so one congestion event is counted once
+RATE_LIMIT_DECREASE_COOLDOWN = 2
+
+# Responses slower than this many seconds are treated as a congestion signal
+RATE_LIMIT_LATENCY_TARGET = 5
+
+# Maximum number of detail pages fetched concurrently in Phase 1
 MAX_WORKERS = 5
 
 # -- File and Folder Configuration --
@@ -42,19 +67,110 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 OUTPUT_DIR = os.path.join(BASE_DIR, 'extracted_data')
 
-# Name of the CSV file to track all scraped posts
+# Raw detail pages, stored once per unique_id regardless of category/page
+RAW_STORE_DIR = os.path.join(DATA_DIR, 'posts')
+
+# How new raw detail pages are stored: 'files' (one .html per post under RAW_STORE_DIR)
+# or 'pack' (compressed into large append-only pack files under PACK_DIR)
+RAW_STORAGE_MODE = 'files'
+PACK_DIR = os.path.join(DATA_DIR, 'packs')
+
+# Size at which a new pack file is started, and zlib level used for pack records
+PACK_MAX_BYTES = 256 * 1024 * 1024
+PACK_COMPRESSION_LEVEL = 6
+
+# Name of the CSV file to track all scraped posts (imported into LEDGER_DB_FILE on first run)
 LEDGER_FILE = "ledger.csv"
 
+# SQLite database holding the indexed ledger
+LEDGER_DB_FILE = "ledger.db"
+
+# Number of new ledger entries committed together in one transaction
+LEDGER_COMMIT_BATCH_SIZE = 100
+
 # Name of the CSV file to track scraping progress for each category
 PROGRESS_FILE = "progress_tracker.csv"
 
+# SQLite database holding the Phase 1 crawl frontier: every listing page and post URL with its crawl state (see frontier.py)
+FRONTIER_DB_FILE = "frontier.db"
+# JSON-lines file recording URLs the crawl has given up on
+DEAD_LETTER_FILE = "dead_letters.jsonl"
+# Failed crawls of one URL (each a full MAX_RETRIES request cycle) before it is dead-lettered
+FRONTIER_MAX_ATTEMPTS = 5
+# Wait before a failed URL is eligible again; doubles with every further failure, up to the maximum
+FRONTIER_RETRY_BASE_SECONDS = 300
+FRONTIER_RETRY_MAX_SECONDS = 24 * 60 * 60
+# Frontier items (listing pages with their new posts, or retried posts) crawled at once; the rate limiter sets the actual pace
+FRONTIER_CONCURRENCY = 16
+# Seconds a claimed frontier item stays leased to its crawler without a heartbeat; a dead crawler's items are reclaimed after this
+FRONTIER_LEASE_SECONDS = 120
+# Seconds between a crawler's lease renewals; keep well under FRONTIER_LEASE_SECONDS
+FRONTIER_HEARTBEAT_SECONDS = 30
+# Seconds an idle crawler waits before looking again while other crawlers still hold leases (and may queue more work)
+FRONTIER_POLL_SECONDS = 2
+
 # Name of the file to log errors
 ERROR_LOG_FILE = "error_log.txt"
 
 # Folder to store the raw HTML responses
 DATA_FOLDER = "data"
 
+# -- Parsing --
+# HTML parser backend for Phase 2 and listing pages: 'lxml' (fast, libxml2) or
+# 'bs4' (BeautifulSoup + html.parser, the reference implementation)
+PARSER_BACKEND = 'lxml'
+# Build trees only for the parts of a detail page that are extracted (see parser.DETAIL_REGIONS)
+SCOPED_PARSE = True
+
 # Define extracted data file name
 EXTRACTED_DATA_FILE = 'extracted_judgments.csv'
 
-MAX_ENTRIES_PER_CSV = 100
\ No newline at end of file
+MAX_ENTRIES_PER_CSV = 100
+
+# Phase 2 output layout: 'csv' (extracted_N.csv) or 'jsonl' (metadata_N.jsonl with
+# typed list fields, plus Full_Text in fulltext_N.jsonl.gz); see output_writers.py
+OUTPUT_FORMAT = 'csv'
+TEXT_COMPRESSION_LEVEL = 6 # gzip level of the jsonl Full_Text shards
+
+# Rows each Phase 2 category writer buffers before a bulk write
+OUTPUT_BUFFER_ROWS = 50
+
+# Listing pages the streaming pipeline may queue ahead of extraction before the crawl waits
+STREAM_QUEUE_SIZE = 20
+
+# Posts per Phase 2 worker task; each chunk's results come back as one batch
+PHASE2_CHUNK_SIZE = 25
+
+# Phase 2 worker processes (also used by the streaming pipeline); 0 means one per CPU
+PHASE2_WORKERS = 0
+
+# -- Indexes --
+# SQLite file holding the full-text search index over the Phase 2 output (see search_index.py)
+SEARCH_INDEX_FILE = "search_index.db"
+# SQLite file holding the facet lookup index (Section_Involved, Coram, ...; see facet_index.py)
+FACET_INDEX_FILE = "facet_index.db"
+# Judgment link graph built from Related_Judgements and Comments (see judgment_graph.py)
+GRAPH_FILE = "judgment_graph.bin"
+# Bring the indexes up to date at the end of every Phase 2 / stream run
+UPDATE_INDEXES_AFTER_EXTRACTION = True
+# BM25 ranking: term-frequency saturation and document-length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Results printed by 'main.py query' unless --limit is given
+SEARCH_RESULTS_LIMIT = 10
+
+# -- Benchmarks --
+# Phase 2 benchmark results that benchmark.py compares new runs against
+BENCHMARK_BASELINE_FILE = "benchmark_baseline.json"
+# Fraction a metric may get worse than the baseline before benchmark.py reports a regression
+BENCHMARK_REGRESSION_THRESHOLD = 0.2
+
+# -- Metrics --
+# Snapshot of the crawl and extraction metrics (see metrics.py), rewritten while a run goes; None disables it
+METRICS_FILE = "metrics.prom"
+# 'prometheus' (text exposition format) or 'json'
+METRICS_FORMAT = 'prometheus'
+# Seconds between snapshot writes during a run
+METRICS_EXPORT_INTERVAL = 15
+# Fraction of documents whose per-stage parse times are recorded
+METRICS_SAMPLE_RATE = 0.1
\ No newline at end of file
@@ -0,0 +1,326 @@
+# shunyatax/facet_index.py
+
+import os
+import re
+import sqlite3
+import logging
+from array import array
+from bisect import bisect_left
+
+import config
+import output_writers
+
+# Lookup indexes for filtering judgments by FACETS, kept in one SQLite file
+# (config.FACET_INDEX_FILE):
+#
+#   docs        - doc_id <-> unique_id and category
+#   postings    - (facet, normalized value) -> how the value was first written,
+#                 its document count and the sorted doc_ids holding it, packed
+#                 as an array of 32-bit ints
+#   doc_values  - (doc_id, facet, value), so a re-extracted post can be taken out
+#                 of the lists it was in
+#   sources     - per category, how much of manifest.ids has been indexed
+#
+# Filters and counts only ever read postings, never the extracted rows. Like the
+# search index, update() catches up from manifest.ids and reads only the shards
+# holding new or re-extracted posts.
+
+_MISSING_VALUES = {'', '-', 'na', 'n/a', 'nil'}
+_SECTION_PREFIX = re.compile(r'^(?:u/s\.?|sections?|sec\.?|s\.)\s*', re.IGNORECASE)
+_TAX_YEAR_RANGE = re.compile(r'^(\d{4})-(\d{2})\s+to\s+(\d{4})-(\d{2})$')
+
+
+def normalize_name(value):
+    """Case-, dot- and spacing-insensitive form: 'V. S. Sirpurkar J' and 'v s sirpurkar j' match."""
+    value = re.sub(r'[.,]+', ' ', value.lower())
+    return ' '.join(value.split())
+
+
+def normalize_section(value):
+    """'Section 14A', 'sec. 14 A' and '14a' all become '14a'."""
+    value = _SECTION_PREFIX.sub('', value.strip())
+    return re.sub(r'\s+', '', value.lower())
+
+
+def normalize_tax_years(value):
+    """Splits a Tax_Year cell into assessment years; '2004-05 to 2006-07' gives all three."""
+    years = []
+    for part in re.split(r'[,;&]|\band\b', value):
+        part = ' '.join(part.split()).lower()
+        match = _TAX_YEAR_RANGE.match(part)
+        if match and int(match.group(1)) <= int(match.group(3)) <= int(match.group(1)) + 50:
+            years.extend(f"{year}-{(year + 1) % 100:02d}" for year in range(int(match.group(1)), int(match.group(3)) + 1))
+        elif part:
+            years.append(part)
+    return years
+
+
+# Facet -> normalizer; each facet is named after the extracted field it indexes.
+FACETS = {
+    'Section_Involved': normalize_section,
+    'Coram': normalize_name,
+    'Counsel': normalize_name,
+    'Tribunal_Bench': normalize_name,
+    'Tax_Year': normalize_tax_years,
+}
+
+
+def facet_values(row):
+    """Returns {facet: {normalized value: value as written}} for one extracted row."""
+    values = {}
+    for facet, normalize in FACETS.items():
+        cell = row.get(facet) or []
+        found = {}
+        for raw in cell if isinstance(cell, list) else [cell]:
+            raw = ' '.join(str(raw).split())
+            if raw.lower() in _MISSING_VALUES:
+                continue
+            normalized = normalize(raw)
+            if isinstance(normalized, list): # Split into several values; each labels itself
+                found.update((value, value) for value in normalized if value not in _MISSING_VALUES)
+            elif normalized and normalized not in _MISSING_VALUES:
+                found.setdefault(normalized, raw)
+        values[facet] = found
+    return values
+
+
+def intersect(a, b):
+    """Intersection of two sorted doc_id arrays; each element of the shorter one is found by bisection in the longer."""
+    if len(a) > len(b):
+        a, b = b, a
+    result = array('I')
+    low = 0
+    for doc_id in a:
+        low = bisect_left(b, doc_id, low)
+        if low == len(b):
+            break
+        if b[low] == doc_id:
+            result.append(doc_id)
+    return result
+
+
+def union(lists):
+    """Union of sorted doc_id arrays, sorted."""
+    return array('I', sorted(set().union(*lists)))
+
+
+class FacetIndex:
+    """
+    Sorted posting lists per facet value, for multi-facet filters and counts.
+
+    Args:
+        db_path (str, optional): Defaults to config.FACET_INDEX_FILE.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or config.FACET_INDEX_FILE
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id INTEGER PRIMARY KEY,
+                unique_id TEXT NOT NULL UNIQUE,
+                category TEXT
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                facet TEXT NOT NULL,
+                value TEXT NOT NULL,
+                label TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                doc_ids BLOB NOT NULL,
+                PRIMARY KEY (facet, value)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS doc_values (
+                doc_id INTEGER NOT NULL,
+                facet TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (doc_id, facet, value)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sources (
+                category TEXT PRIMARY KEY,
+                format TEXT NOT NULL,
+                ids_bytes INTEGER NOT NULL
+            );
+        """)
+
+    def __len__(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()
+        return count
+
+    # -- Building --
+
+    def update(self, output_dir=None, rebuild=False):
+        """
+        Indexes every post written to output_dir (default: config.OUTPUT_DIR) since
+        the last update; see SearchIndex.update(). Returns the number of posts (re-)indexed.
+        """
+        output_dir = output_dir or config.OUTPUT_DIR
+        if rebuild:
+            with self._conn:
+                self._conn.executescript("DELETE FROM postings; DELETE FROM doc_values; DELETE FROM docs; DELETE FROM sources;")
+        if not os.path.isdir(output_dir):
+            return 0
+        indexed = 0
+        for category_name in sorted(os.listdir(output_dir)):
+            category_dir = os.path.join(output_dir, category_name)
+            if os.path.isdir(category_dir):
+                indexed += self._update_category(category_name, category_dir)
+        if indexed:
+            logging.info(f"Facet index updated: {indexed} posts indexed, {len(self)} in total.")
+        return indexed
+
+    def _update_category(self, category_name, category_dir):
+        manifest = output_writers.read_manifest(category_dir)
+        if manifest is None:
+            return 0
+        source = self._conn.execute("SELECT format, ids_bytes FROM sources WHERE category = ?", (category_name,)).fetchone()
+        start = 0
+        if source and source[0] == manifest['format'] and source[1] <= manifest['ids_bytes']:
+            start = source[1]
+        elif source:
+            logging.info(f"Output of {category_name} was reset since it was indexed; re-indexing the whole category.")
+            self._delete_category(category_name)
+        if start == manifest['ids_bytes']:
+            return 0
+
+        rows = output_writers.read_rows_since(category_dir, manifest, start, with_text=False)
+        with self._conn:
+            additions = {}
+            removals = {}
+            labels = {}
+            for unique_id, row in rows.items():
+                doc_id = self._doc_id(unique_id, category_name)
+                old = set(self._conn.execute("SELECT facet, value FROM doc_values WHERE doc_id = ?", (doc_id,)))
+                new = set()
+                for facet, values in facet_values(row).items():
+                    for value, label in values.items():
+                        new.add((facet, value))
+                        labels.setdefault((facet, value), label)
+                for key in old - new:
+                    removals.setdefault(key, set()).add(doc_id)
+                for key in new - old:
+                    additions.setdefault(key, set()).add(doc_id)
+                self._conn.execute("DELETE FROM doc_values WHERE doc_id = ?", (doc_id,))
+                self._conn.executemany("INSERT INTO doc_values (doc_id, facet, value) VALUES (?, ?, ?)",
+                                       [(doc_id, facet, value) for facet, value in new])
+            self._apply(additions, removals, labels)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (category, format, ids_bytes) VALUES (?, ?, ?)",
+                (category_name, manifest['format'], manifest['ids_bytes']),
+            )
+        logging.debug(f"Indexed facets of {len(rows)} posts from {category_name}.")
+        return len(rows)
+
+    def _doc_id(self, unique_id, category_name):
+        existing = self._conn.execute("SELECT doc_id FROM docs WHERE unique_id = ?", (unique_id,)).fetchone()
+        if existing:
+            self._conn.execute("UPDATE docs SET category = ? WHERE doc_id = ?", (category_name, existing[0]))
+            return existing[0]
+        return self._conn.execute("INSERT INTO docs (unique_id, category) VALUES (?, ?)", (unique_id, category_name)).lastrowid
+
+    def _apply(self, additions, removals, labels):
+        """Rewrites each touched posting list once, with its additions and removals applied."""
+        for facet, value in set(additions) | set(removals):
+            existing = self._conn.execute("SELECT label, doc_ids FROM postings WHERE facet = ? AND value = ?", (facet, value)).fetchone()
+            doc_ids = set(_unpack(existing[1])) if existing else set()
+            doc_ids -= removals.get((facet, value), set())
+            doc_ids |= additions.get((facet, value), set())
+            if not doc_ids:
+                self._conn.execute("DELETE FROM postings WHERE facet = ? AND value = ?", (facet, value))
+                continue
+            label = existing[0] if existing else labels[(facet, value)]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO postings (facet, value, label, count, doc_ids) VALUES (?, ?, ?, ?, ?)",
+                (facet, value, label, len(doc_ids), array('I', sorted(doc_ids)).tobytes()),
+            )
+
+    def _delete_category(self, category_name):
+        with self._conn:
+            doc_ids = {row[0] for row in self._conn.execute("SELECT doc_id FROM docs WHERE category = ?", (category_name,))}
+            removals = {}
+            for doc_id in doc_ids:
+                for facet, value in self._conn.execute("SELECT facet, value FROM doc_values WHERE doc_id = ?", (doc_id,)):
+                    removals.setdefault((facet, value), set()).add(doc_id)
+            self._apply({}, removals, {})
+            self._conn.executemany("DELETE FROM doc_values WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+            self._conn.execute("DELETE FROM docs WHERE category = ?", (category_name,))
+            self._conn.execute("DELETE FROM sources WHERE category = ?", (category_name,))
+
+    # -- Querying --
+
+    def _check_facet(self, facet):
+        if facet not in FACETS:
+            raise ValueError(f"Unknown facet '{facet}'. Choose from: {', '.join(FACETS)}")
+
+    def postings(self, facet, value):
+        """Sorted doc_ids of the posts with value (as written or normalized) under facet."""
+        self._check_facet(facet)
+        normalized = FACETS[facet](value)
+        values = normalized if isinstance(normalized, list) else [normalized]
+        lists = []
+        for normalized_value in values:
+            row = self._conn.execute("SELECT doc_ids FROM postings WHERE facet = ? AND value = ?", (facet, normalized_value)).fetchone()
+            lists.append(_unpack(row[0]) if row else array('I'))
+        return lists[0] if len(lists) == 1 else union(lists)
+
+    def filter(self, filters):
+        """
+        Returns the sorted doc_ids matching every facet in filters.
+
+        Args:
+            filters (dict): facet -> a value, or a list of values any of which may match.
+                            'Tax_Year': '2004-05 to 2006-07' matches any year in the range.
+        """
+        lists = []
+        for facet, values in filters.items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            lists.append(union([self.postings(facet, value) for value in values]) if len(values) > 1 else self.postings(facet, values[0]))
+        # Intersect the shortest lists first, so later steps bisect with a short result.
+        result = None
+        for doc_ids in sorted(lists, key=len):
+            result = doc_ids if result is None else intersect(result, doc_ids)
+            if not result:
+                break
+        return result if result is not None else array('I')
+
+    def counts(self, facet, doc_ids=None, limit=None):
+        """
+        Returns [(value as written, count)] for facet, most common first. With
+        doc_ids (e.g. the result of filter()), only those posts are counted.
+        """
+        self._check_facet(facet)
+        if doc_ids is None:
+            query = "SELECT label, count FROM postings WHERE facet = ? ORDER BY count DESC, value"
+            rows = self._conn.execute(query + (" LIMIT ?" if limit else ""), (facet, limit) if limit else (facet,)).fetchall()
+            return [tuple(row) for row in rows]
+        if not len(doc_ids):
+            return []
+        doc_ids = doc_ids if isinstance(doc_ids, array) else array('I', sorted(doc_ids))
+        counts = []
+        for label, packed in self._conn.execute("SELECT label, doc_ids FROM postings WHERE facet = ?", (facet,)):
+            count = len(intersect(doc_ids, _unpack(packed)))
+            if count:
+                counts.append((label, count))
+        counts.sort(key=lambda item: -item[1])
+        return counts[:limit] if limit else counts
+
+    def unique_ids(self, doc_ids):
+        """Maps doc_ids back to [(unique_id, category)], in doc_id order."""
+        results = []
+        doc_ids = list(doc_ids)
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            rows = dict((row[0], (row[1], row[2])) for row in self._conn.execute(
+                f"SELECT doc_id, unique_id, category FROM docs WHERE doc_id IN ({','.join('?' * len(batch))})", batch))
+            results.extend(rows[doc_id] for doc_id in batch if doc_id in rows)
+        return results
+
+    def close(self):
+        self._conn.close()
+
+
+def _unpack(packed):
+    doc_ids = array('I')
+    doc_ids.frombytes(packed)
+    return doc_ids
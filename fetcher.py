@@ -1,81 +1,267 @@
 # shunyatax/fetcher.py
 
-import requests
+import asyncio
 import os
+import random
 import time
 import logging # Import logging
+from urllib.parse import urlsplit
+
+import aiohttp
 
 # Assuming config.py is in the same directory or accessible via PYTHONPATH
 import config
+import metrics
+import raw_store
+from rate_limiter import AdaptiveRateLimiter, parse_retry_after
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# HTTP status codes that are worth another attempt; any other error status is final.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Status codes that mean the server wants us to slow down.
+THROTTLE_STATUS_CODES = {429, 503}
+
+# Crawl-wide metrics (see metrics.py); per-status counters are looked up as statuses appear.
+_REQUESTS = metrics.counter('fetch_requests_total', 'HTTP requests sent, retries included.')
+_RETRIES = metrics.counter('fetch_retries_total', 'Requests that were a second or later attempt at a URL.')
+_FAILURES = metrics.counter('fetch_failures_total', 'URLs given up on after every attempt.')
+_LATENCY = metrics.histogram('fetch_latency_seconds', 'Seconds from sending a request to reading its response.', metrics.LATENCY_BUCKETS)
+_RESPONSE_BYTES = metrics.histogram('fetch_response_bytes', 'Characters in each successful response body.', metrics.SIZE_BUCKETS)
+
+
+def _backoff_delay(attempt):
+    """Exponential backoff with jitter for the given (0-based) attempt."""
+    delay = config.RETRY_DELAY_SECONDS * (2 ** attempt)
+    return delay + random.uniform(0, config.RETRY_DELAY_SECONDS)
+
 
-def fetch_html(url, save_path):
+def _write_file(save_path, text):
+    with open(save_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+class FetchStats:
     """
-    Fetches HTML content from a URL and saves it to a file.
-    Includes retry logic.
+    Per-engine counters: every attempt is a request; an attempt after the first
+    for the same URL is a retry. latencies holds the seconds each response took
+    (headers and body), in the order they arrived. Responses and errors are also
+    recorded in the crawl-wide metrics (metrics.py).
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    for attempt in range(config.MAX_RETRIES):
-        try:
-            logging.info(f"Attempt {attempt + 1}: Fetching {url}")
-            response = requests.get(url, headers=headers, timeout=config.RETRY_DELAY_SECONDS * 2) # Set a reasonable timeout
-            response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-            
-            with open(save_path, 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            logging.info(f"Successfully fetched and saved: {save_path}")
-            return response.text # Return content for parsing links in main.py
-        except requests.exceptions.HTTPError as e:
-            logging.warning(f"HTTP error fetching {url}: {e}")
-            if response.status_code == 404:
-                logging.info(f"Page not found (404) for {url}. Assuming end of pagination.")
-                return None # Return None for 404 to signal end of pages
-            elif response.status_code == 429:
-                logging.warning(f"Too many requests (429) for {url}. Retrying with delay.")
-                time.sleep(config.RETRY_DELAY_SECONDS * (attempt + 1)) # Exponential backoff
-            else:
-                logging.error(f"Non-retryable HTTP error for {url}: {e}", exc_info=True)
-                break # Break for other HTTP errors
-        except requests.exceptions.ConnectionError as e:
-            logging.warning(f"Connection error fetching {url}: {e}. Retrying.")
-            time.sleep(config.RETRY_DELAY_SECONDS * (attempt + 1))
-        except requests.exceptions.Timeout as e:
-            logging.warning(f"Timeout error fetching {url}: {e}. Retrying.")
-            time.sleep(config.RETRY_DELAY_SECONDS * (attempt + 1))
-        except Exception as e:
-            logging.error(f"An unexpected error occurred while fetching {url}: {e}", exc_info=True)
-            break # Break for unexpected errors
-    logging.error(f"Failed to fetch {url} after {config.MAX_RETRIES} attempts.")
-    return None
-
-def fetch_read_more_page(url, category_folder, unique_id):
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.errors = 0 # Timeouts and connection errors
+        self.bytes = 0
+        self.statuses = {}
+        self.latencies = []
+
+    def record_response(self, status, latency, size=0):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latencies.append(latency)
+        self.bytes += size
+        metrics.counter('fetch_responses_total', 'Responses received, by HTTP status.', status=str(status)).inc()
+        _LATENCY.observe(latency)
+        if size:
+            _RESPONSE_BYTES.observe(size)
+        if status in THROTTLE_STATUS_CODES:
+            metrics.counter('fetch_throttled_total', 'Responses asking the crawler to slow down, by HTTP status.', status=str(status)).inc()
+        metrics.maybe_write_snapshot()
+
+    def record_error(self, kind):
+        self.errors += 1
+        metrics.counter('fetch_errors_total', 'Requests that got no response, by error kind.', kind=kind).inc()
+
+    def merge(self, other):
+        """Adds another engine's counts (e.g. a crawler process's) to these."""
+        self.requests += other.requests
+        self.retries += other.retries
+        self.failures += other.failures
+        self.errors += other.errors
+        self.bytes += other.bytes
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.latencies.extend(other.latencies)
+
+    def percentile(self, percent):
+        """The latency below which percent% of responses fell (nearest rank), or None."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))]
+
+    def summary(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'latency_p50': self.percentile(50),
+            'latency_p99': self.percentile(99),
+        }
+
+
+class FetchEngine:
     """
-    Fetches a single 'read more' page and saves it.
+    Shared asyncio HTTP client used by Phase 1.
+
+    One pooled keep-alive session is opened for the whole crawl, so every
+    request to itatonline.org reuses an existing TCP/TLS connection instead of
+    paying for a new handshake. In-flight requests are capped per host, every
+    attempt takes a token from the shared AdaptiveRateLimiter, and all fetches go
+    through the same retry and backoff policy.
+
+    Usage:
+        async with fetcher.FetchEngine() as engine:
+            html = await engine.fetch_html(url, save_path)
     """
-    save_path = os.path.join(category_folder, f'{unique_id}.html')
-    if os.path.exists(save_path):
-        logging.info(f"File already exists: {save_path}. Skipping fetch.")
-        return {'unique_id': unique_id, 'file_path': save_path, 'url': url} # Return existing info
-        
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    for attempt in range(config.MAX_RETRIES):
-        try:
-            logging.info(f"Attempt {attempt + 1}: Fetching read more page {url}")
-            response = requests.get(url, headers=headers, timeout=config.RETRY_DELAY_SECONDS * 2)
-            response.raise_for_status()
-            
-            with open(save_path, 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            logging.info(f"Successfully fetched and saved: {save_path}")
-            return {'unique_id': unique_id, 'file_path': save_path, 'url': url}
-        except requests.exceptions.RequestException as e: # Catch all requests exceptions
-            logging.warning(f"Error fetching {url}: {e}. Retrying.")
-            time.sleep(config.RETRY_DELAY_SECONDS * (attempt + 1))
-        except Exception as e:
-            logging.error(f"An unexpected error occurred while fetching read more page {url}: {e}", exc_info=True)
-            break # Break for unexpected errors
-    logging.error(f"Failed to fetch read more page {url} after {config.MAX_RETRIES} attempts.")
-    return None
\ No newline at end of file
+
+    def __init__(self, max_connections=None, max_connections_per_host=None, rate_limiter=None):
+        self.max_connections = max_connections or config.MAX_CONNECTIONS
+        self.max_connections_per_host = max_connections_per_host or config.MAX_CONNECTIONS_PER_HOST
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.stats = FetchStats()
+        self._session = None
+        self._host_semaphores = {}
+        self._in_flight = {}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            keepalive_timeout=config.KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(total=config.REQUEST_TIMEOUT)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+        self._session = None
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._host_semaphores[host]
+
+    async def get(self, url):
+        """
+        Fetches a URL with the shared retry policy.
+
+        Returns:
+            tuple: (status, text). text is None when the page does not exist (404)
+                   or every attempt failed; status is None if no response was received.
+        """
+        status = None
+        for attempt in range(config.MAX_RETRIES):
+            retry_after = None
+            limiter_paused = False
+            try:
+                logging.debug(f"Attempt {attempt + 1}: Fetching {url}")
+                await self.rate_limiter.acquire()
+                self.stats.requests += 1
+                self.stats.retries += attempt > 0
+                _REQUESTS.inc()
+                if attempt:
+                    _RETRIES.inc()
+                async with self._host_semaphore(url):
+                    started = time.monotonic()
+                    async with self._session.get(url) as response:
+                        status = response.status
+                        if status == 200:
+                            text = await response.text()
+                            latency = time.monotonic() - started
+                            self.rate_limiter.record_success(latency)
+                            self.stats.record_response(status, latency, len(text))
+                            return status, text
+                        self.stats.record_response(status, time.monotonic() - started)
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if status == 404:
+                    logging.info(f"Page not found (404) for {url}.")
+                    return status, None
+                if status not in RETRYABLE_STATUS_CODES:
+                    logging.error(f"Non-retryable HTTP error {status} for {url}.")
+                    return status, None
+                if status in THROTTLE_STATUS_CODES:
+                    self.rate_limiter.record_throttle(retry_after)
+                    limiter_paused = bool(retry_after)
+                logging.warning(f"HTTP {status} for {url}. Retrying.")
+            except asyncio.TimeoutError:
+                self.stats.record_error('timeout')
+                self.rate_limiter.record_timeout()
+                logging.warning(f"Timeout fetching {url}. Retrying.")
+            except aiohttp.ClientError as e:
+                self.stats.record_error('connection')
+                logging.warning(f"Error fetching {url}: {e!r}. Retrying.")
+            # When a throttling response sent Retry-After the limiter is already
+            # paused for that long, so the per-request backoff would only double
+            # the wait. Any other Retry-After is honoured here, but never shortens
+            # the backoff.
+            if attempt + 1 < config.MAX_RETRIES and not limiter_paused:
+                await asyncio.sleep(max(retry_after or 0, _backoff_delay(attempt)))
+        self.stats.failures += 1
+        _FAILURES.inc()
+        logging.error(f"Failed to fetch {url} after {config.MAX_RETRIES} attempts.")
+        return status, None
+
+    async def fetch_html(self, url, save_path):
+        """
+        Fetches HTML content from a URL and saves it to a file.
+        Returns the content, or None on 404 (end of pagination) or failure.
+        """
+        _, text = await self.fetch_page(url, save_path)
+        return text # Return content for parsing links in main.py
+
+    async def fetch_page(self, url, save_path):
+        """
+        Like fetch_html, but returns (status, text) so a missing page (404) can be
+        told apart from a failed fetch.
+        """
+        status, text = await self.get(url)
+        if text is None:
+            return status, None
+        await asyncio.to_thread(_write_file, save_path, text)
+        logging.debug(f"Successfully fetched and saved: {save_path}")
+        return status, text
+
+    async def fetch_read_more_page(self, url, category_folder, unique_id):
+        """
+        Fetches a single 'read more' page into the raw store.
+
+        A post is downloaded at most once: if it is already in the raw store (or
+        saved under category_folder by an older crawl) the existing copy is
+        returned, and concurrent requests for the same unique_id share one fetch.
+        """
+        existing_path = raw_store.locate(unique_id)
+        legacy_path = os.path.join(category_folder, f'{unique_id}.html')
+        if existing_path is None and os.path.exists(legacy_path):
+            existing_path = legacy_path
+        if existing_path is not None:
+            logging.debug(f"Already stored: {existing_path}. Skipping fetch.")
+            return {'unique_id': unique_id, 'file_path': existing_path, 'url': url} # Return existing info
+
+        download = self._in_flight.get(unique_id)
+        if download is None:
+            download = asyncio.ensure_future(self._download_post(url, unique_id))
+            self._in_flight[unique_id] = download
+            download.add_done_callback(lambda _: self._in_flight.pop(unique_id, None))
+        save_path = await asyncio.shield(download)
+        if save_path is None:
+            return None
+        return {'unique_id': unique_id, 'file_path': save_path, 'url': url}
+
+    async def _download_post(self, url, unique_id):
+        _, text = await self.get(url)
+        if text is None:
+            logging.error(f"Failed to fetch read more page {url}.")
+            return None
+        return await asyncio.to_thread(raw_store.save, unique_id, text)
@@ -0,0 +1,300 @@
+# shunyatax/frontier.py
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+
+import config
+
+# The Phase 1 crawl frontier: every listing page and post URL the crawl has to
+# fetch, with its state, kept in SQLite (config.FRONTIER_DB_FILE) so it
+# survives restarts.
+#
+#   pending    - waiting to be crawled
+#   in_flight  - leased by one crawler (lease_owner) until lease_expires_at
+#   done       - fetched (a listing page past the end of its category counts too)
+#   failed     - the last attempt failed; eligible again from next_attempt_at,
+#                which backs off exponentially (config.FRONTIER_RETRY_BASE_SECONDS,
+#                doubling per attempt up to config.FRONTIER_RETRY_MAX_SECONDS)
+#   dead       - failed config.FRONTIER_MAX_ATTEMPTS times; also appended to the
+#                dead-letter file (config.DEAD_LETTER_FILE) and never retried
+#
+# Items are claimed lowest priority value first, which is the listing page
+# number, so the newest pages of every category (and the posts listed on them)
+# go before older ones; ties go in the order items were added. An attempt is one
+# FetchEngine request cycle, which already retries transient errors itself, so
+# a failure here means the URL stayed unreachable for the whole of it.
+#
+# Several crawler processes, on this machine or on others sharing the file, can
+# work through one frontier. A claim leases its items to the claiming crawler for
+# config.FRONTIER_LEASE_SECONDS; the crawler renews its leases with heartbeat()
+# while it works on them, and only the lease holder can complete or fail an item.
+# When a crawler dies its leases run out and the next claim by any crawler
+# returns the items to pending, without counting an attempt against them. Claims
+# are single UPDATE statements, so two crawlers never lease the same item.
+#
+# Ledger rows are committed before the lease is released and the ledger ignores
+# IDs it already has, so an item reclaimed after its crawler committed the
+# ledger but died before completing it is fetched (or found in the raw store)
+# again without a duplicate row. SQLite locking across machines needs a shared
+# filesystem with working POSIX locks; NFS without them is not safe.
+
+KINDS = ['listing', 'post']
+STATES = ['pending', 'in_flight', 'done', 'failed', 'dead']
+
+_BUSY_TIMEOUT = 60 # Seconds to wait for another crawler's write transaction
+_LEASE_COLUMNS = {'lease_owner': 'TEXT', 'lease_expires_at': 'REAL NOT NULL DEFAULT 0'}
+
+
+def crawler_id():
+    """A name for this crawler process that is unique across machines and restarts."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class CrawlFrontier:
+    """
+    Persistent, prioritised crawl queue with per-URL retry state.
+
+    Args:
+        db_path (str, optional): Defaults to config.FRONTIER_DB_FILE.
+        owner (str, optional): This crawler's name on its leases; defaults to crawler_id().
+    """
+
+    def __init__(self, db_path=None, owner=None):
+        self.db_path = db_path or config.FRONTIER_DB_FILE
+        self.owner = owner or crawler_id()
+        self._conn = sqlite3.connect(self.db_path, timeout=_BUSY_TIMEOUT)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                seq INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                category TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                unique_id TEXT,
+                priority INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS frontier_ready ON frontier (state, priority, seq);
+            CREATE INDEX IF NOT EXISTS frontier_listing ON frontier (category, kind, page);
+        """)
+        # Frontiers created before leases were added lack their columns.
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(frontier)")}
+        with self._conn:
+            for column, definition in _LEASE_COLUMNS.items():
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE frontier ADD COLUMN {column} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS frontier_lease ON frontier (lease_owner, state)")
+
+    def __contains__(self, url):
+        return self._conn.execute("SELECT 1 FROM frontier WHERE url = ?", (url,)).fetchone() is not None
+
+    def get(self, url):
+        """Returns the item for url as a dict, or None."""
+        row = self._conn.execute("SELECT * FROM frontier WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def states(self, urls):
+        """Returns {url: state} for the given URLs the frontier knows."""
+        urls = list(urls)
+        states = {}
+        for start in range(0, len(urls), 500): # Stay under SQLite's bound-parameter limit
+            batch = urls[start:start + 500]
+            states.update(self._conn.execute(
+                f"SELECT url, state FROM frontier WHERE url IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return states
+
+    # -- Adding --
+
+    def add(self, url, kind, category, page, unique_id=None, reset_done=False):
+        """
+        Adds a URL unless it is already known. With reset_done=True a known URL
+        that is done is made pending again (to re-read a category's last
+        listing page for pages added since). Returns True if the URL was queued.
+        """
+        return self.add_many([(url, kind, category, page, unique_id)], reset_done) > 0
+
+    def add_many(self, items, reset_done=False):
+        """Adds (url, kind, category, page, unique_id) tuples in one transaction; returns how many were queued."""
+        now = time.time()
+        queued = 0
+        with self._conn:
+            for url, kind, category, page, unique_id in items:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO frontier (url, kind, category, page, unique_id, priority, state, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)",
+                    (url, kind, category, page, unique_id, page, now),
+                )
+                if not cursor.rowcount and reset_done:
+                    cursor = self._conn.execute(
+                        "UPDATE frontier SET state = 'pending', updated_at = ? WHERE url = ? AND state = 'done'", (now, url)
+                    )
+                queued += cursor.rowcount
+        return queued
+
+    def lease_many(self, items):
+        """
+        Adds (url, kind, category, page, unique_id) tuples leased to this crawler,
+        for posts a listing page is about to fetch itself. A known URL is leased
+        only if no one is working on it and it isn't done or dead (a failed one is
+        taken whatever its backoff, since it was listed again). Returns the set of
+        URLs leased.
+        """
+        now = time.time()
+        expires = now + config.FRONTIER_LEASE_SECONDS
+        leased = set()
+        with self._conn:
+            for url, kind, category, page, unique_id in items:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO frontier (url, kind, category, page, unique_id, priority, state, updated_at, lease_owner, lease_expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 'in_flight', ?, ?, ?)",
+                    (url, kind, category, page, unique_id, page, now, self.owner, expires),
+                )
+                if not cursor.rowcount:
+                    cursor = self._conn.execute(
+                        "UPDATE frontier SET state = 'in_flight', lease_owner = ?, lease_expires_at = ?, updated_at = ? "
+                        "WHERE url = ? AND (state IN ('pending', 'failed') OR (state = 'in_flight' AND lease_expires_at <= ?))",
+                        (self.owner, expires, now, url, now),
+                    )
+                if cursor.rowcount:
+                    leased.add(url)
+        return leased
+
+    # -- Crawling --
+
+    def reclaim_expired(self):
+        """Returns items whose lease ran out (their crawler died or hung) to pending; returns how many."""
+        now = time.time()
+        with self._conn:
+            count = self._conn.execute(
+                "UPDATE frontier SET state = 'pending', lease_owner = NULL, updated_at = ? "
+                "WHERE state = 'in_flight' AND lease_expires_at <= ?", (now, now)
+            ).rowcount
+        if count:
+            logging.info(f"Crawl frontier: reclaimed {count} URLs whose crawler stopped renewing its lease.")
+        return count
+
+    def claim(self, limit=1, kinds=None):
+        """
+        Leases up to limit items that are eligible now (pending, or failed and past
+        their next_attempt_at) to this crawler and returns them as dicts, best
+        priority first. Expired leases are reclaimed first.
+        """
+        kinds = kinds or KINDS
+        self.reclaim_expired()
+        now = time.time()
+        with self._conn:
+            rows = self._conn.execute(
+                "UPDATE frontier SET state = 'in_flight', lease_owner = ?, lease_expires_at = ?, updated_at = ? "
+                "WHERE seq IN (SELECT seq FROM frontier WHERE (state = 'pending' OR (state = 'failed' AND next_attempt_at <= ?)) "
+                f"AND kind IN ({','.join('?' * len(kinds))}) ORDER BY priority, seq LIMIT ?) RETURNING *",
+                (self.owner, now + config.FRONTIER_LEASE_SECONDS, now, now, *kinds, limit),
+            ).fetchall()
+        return sorted((dict(row) for row in rows), key=lambda item: (item['priority'], item['seq']))
+
+    def heartbeat(self):
+        """Renews the lease on every item this crawler holds; returns how many."""
+        now = time.time()
+        with self._conn:
+            return self._conn.execute(
+                "UPDATE frontier SET lease_expires_at = ? WHERE lease_owner = ? AND state = 'in_flight'",
+                (now + config.FRONTIER_LEASE_SECONDS, self.owner),
+            ).rowcount
+
+    def active_leases(self):
+        """Items in flight under a live lease, this crawler's or another's."""
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM frontier WHERE state = 'in_flight' AND lease_expires_at > ?", (time.time(),)
+        ).fetchone()
+        return count
+
+    def complete(self, url):
+        """Marks an item this crawler holds done. Returns False if its lease was lost to another crawler."""
+        with self._conn:
+            updated = self._conn.execute(
+                "UPDATE frontier SET state = 'done', last_error = NULL, lease_owner = NULL, updated_at = ? "
+                "WHERE url = ? AND lease_owner = ? AND state = 'in_flight'", (time.time(), url, self.owner)
+            ).rowcount
+        if not updated:
+            logging.warning(f"Lease on {url} expired before it was completed; another crawler has it.")
+        return bool(updated)
+
+    def fail(self, url, error):
+        """
+        Records a failed attempt on an item this crawler holds: it is retried after
+        a backoff, or after config.FRONTIER_MAX_ATTEMPTS attempts goes to the
+        dead-letter file. Returns the item's new state, or None if its lease was lost.
+        """
+        item = self.get(url)
+        if item is None or item['lease_owner'] != self.owner or item['state'] != 'in_flight':
+            logging.warning(f"Lease on {url} expired before its failure was recorded; another crawler has it.")
+            return None
+        attempts = item['attempts'] + 1
+        now = time.time()
+        if attempts >= config.FRONTIER_MAX_ATTEMPTS:
+            state, next_attempt_at = 'dead', 0
+        else:
+            state = 'failed'
+            next_attempt_at = now + min(config.FRONTIER_RETRY_MAX_SECONDS, config.FRONTIER_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+        with self._conn:
+            updated = self._conn.execute(
+                "UPDATE frontier SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, lease_owner = NULL, updated_at = ? "
+                "WHERE url = ? AND lease_owner = ? AND state = 'in_flight'",
+                (state, attempts, next_attempt_at, error, now, url, self.owner),
+            ).rowcount
+        if not updated:
+            logging.warning(f"Lease on {url} expired before its failure was recorded; another crawler has it.")
+            return None
+        if state == 'dead':
+            self._write_dead_letter(dict(item, state=state, attempts=attempts, last_error=error, updated_at=now))
+            logging.error(f"Giving up on {url} after {attempts} failed attempts; recorded in {config.DEAD_LETTER_FILE}.")
+        else:
+            logging.warning(f"Crawl of {url} failed ({error}); attempt {attempts} of {config.FRONTIER_MAX_ATTEMPTS}, retrying after {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_attempt_at))}.")
+        return state
+
+    @staticmethod
+    def _write_dead_letter(item):
+        record = {field: item[field] for field in ('url', 'kind', 'category', 'page', 'unique_id', 'attempts', 'last_error')}
+        record['failed_at'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(item['updated_at']))
+        with open(config.DEAD_LETTER_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    # -- Reporting --
+
+    def listing_watermark(self, category_name):
+        """
+        The highest listing page of a category such that it and every page before
+        it (that the frontier knows of) is done or dead, or 0 if there is none.
+        """
+        (open_page,) = self._conn.execute(
+            "SELECT MIN(page) FROM frontier WHERE category = ? AND kind = 'listing' AND state NOT IN ('done', 'dead')", (category_name,)
+        ).fetchone()
+        if open_page is not None:
+            return open_page - 1
+        (last_page,) = self._conn.execute(
+            "SELECT MAX(page) FROM frontier WHERE category = ? AND kind = 'listing'", (category_name,)
+        ).fetchone()
+        return last_page or 0
+
+    def counts(self):
+        """Returns {state: item count}."""
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self._conn.execute("SELECT state, COUNT(*) FROM frontier GROUP BY state").fetchall())
+        return counts
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,342 @@
+# shunyatax/html_backends.py
+
+import re
+import logging
+
+from bs4 import BeautifulSoup
+
+import config
+
+# parser.py extracts every field through a small, BeautifulSoup-shaped API:
+#
+#     find / find_all(name, attrs, class_=..., string=..., **attrs)
+#     find_next_sibling(name), next_siblings, next_sibling
+#     get(attr, default), has_attr(attr), node[attr], name
+#     text, string, get_text(separator, strip)
+#
+# The 'bs4' backend is BeautifulSoup with Python's html.parser and is the
+# reference implementation. The 'lxml' backend parses with libxml2 and wraps
+# the resulting elements in LxmlNode, which implements the same API with
+# BeautifulSoup's matching and text rules (comments, <script>, <style> and
+# <template> contents are not text; class matches any single class or the
+# whole attribute). Text nodes are plain str in both backends.
+
+_MULTI_VALUED_ATTRIBUTES = {'class', 'rel', 'rev', 'accept-charset', 'headers', 'accesskey', 'dropzone'}
+
+# Tags whose contents BeautifulSoup does not count as text of their ancestors.
+_NON_TEXT_CONTAINERS = {'script', 'style', 'template'}
+
+
+class Bs4Backend:
+    """Reference backend: BeautifulSoup on top of Python's html.parser."""
+
+    name = 'bs4'
+
+    def parse(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        # html.parser splits a text run wherever it drops a stray end tag (e.g. an </em>
+        # whose <em> was closed by an earlier </p>); libxml2 keeps it as one string.
+        # Merging adjacent strings makes get_text(separator=...) agree between backends.
+        soup.smooth()
+        return soup
+
+
+class LxmlBackend:
+    """Fast backend: libxml2's HTML parser (via lxml) behind the BeautifulSoup-shaped LxmlNode API."""
+
+    name = 'lxml'
+
+    def __init__(self):
+        from lxml import etree # Imported here so lxml stays an optional dependency
+        self._etree = etree
+        self._parser = etree.HTMLParser(remove_comments=False, remove_pis=False, huge_tree=True)
+
+    def parse(self, html):
+        root = self._etree.fromstring(html, self._parser)
+        if root is None: # Empty document
+            root = self._etree.fromstring('<html></html>', self._parser)
+        return LxmlNode(root)
+
+
+def _matches_value(actual, expected, multi_valued):
+    """BeautifulSoup's rule for comparing one attribute value against a filter."""
+    if expected is True:
+        return actual is not None
+    if expected is None:
+        return actual is None
+    if actual is None:
+        return False
+    if callable(expected):
+        if multi_valued and any(expected(token) for token in actual.split()):
+            return True
+        return bool(expected(actual))
+    if isinstance(expected, (list, tuple, set)):
+        return any(_matches_value(actual, value, multi_valued) for value in expected)
+    if multi_valued and expected in actual.split():
+        return True
+    return actual == expected
+
+
+class LxmlNode:
+    """A libxml2 element exposing the subset of the BeautifulSoup Tag API parser.py uses."""
+
+    __slots__ = ('_el',)
+
+    def __init__(self, element):
+        self._el = element
+
+    def __eq__(self, other):
+        return isinstance(other, LxmlNode) and other._el is self._el
+
+    def __hash__(self):
+        return hash(self._el)
+
+    def __repr__(self):
+        return f"<LxmlNode {self.name}>"
+
+    # -- Attributes --
+
+    @property
+    def name(self):
+        return self._el.tag
+
+    def get(self, key, default=None):
+        value = self._el.get(key)
+        if value is None:
+            return default
+        if key in _MULTI_VALUED_ATTRIBUTES:
+            return value.split()
+        return value
+
+    def has_attr(self, key):
+        return key in self._el.attrib
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    # -- Text --
+
+    def _strings(self):
+        """Yields every text string under this element, in document order, like Tag._all_strings."""
+        el = self._el
+        if el.tag in _NON_TEXT_CONTAINERS:
+            if el.text:
+                yield el.text
+            return
+        stack = [(el, False)]
+        while stack:
+            node, emit_tail = stack.pop()
+            if emit_tail:
+                if node.tail:
+                    yield node.tail
+                continue
+            if node is not el:
+                stack.append((node, True))
+            if not isinstance(node.tag, str) or node.tag in _NON_TEXT_CONTAINERS:
+                continue
+            if node.text:
+                yield node.text
+            stack.extend((child, False) for child in reversed(node))
+
+    def get_text(self, separator='', strip=False):
+        if strip:
+            return separator.join(s.strip() for s in self._strings() if s.strip())
+        return separator.join(self._strings())
+
+    @property
+    def text(self):
+        return self.get_text()
+
+    @property
+    def string(self):
+        """The single string inside this element (looking through lone child tags), else None."""
+        el = self._el
+        while True:
+            contents = [el.text] if el.text else []
+            for child in el:
+                contents.append(child)
+                if child.tail:
+                    contents.append(child.tail)
+            if len(contents) != 1:
+                return None
+            child = contents[0]
+            if isinstance(child, str):
+                return child
+            if not isinstance(child.tag, str): # A lone comment is a string to BeautifulSoup too
+                return child.text
+            el = child
+
+    # -- Searching --
+
+    def _matches(self, el, name, attrs, string):
+        if name is not None:
+            if isinstance(name, (list, tuple, set)):
+                if el.tag not in name:
+                    return False
+            elif el.tag != name:
+                return False
+        for key, expected in attrs.items():
+            if not _matches_value(el.get(key), expected, key in _MULTI_VALUED_ATTRIBUTES):
+                return False
+        if string is not None:
+            value = LxmlNode(el).string
+            if callable(string):
+                return bool(string(value))
+            return value == string
+        return True
+
+    def _iter_matches(self, name, attrs, class_, string, kwargs):
+        attrs = dict(attrs or {})
+        attrs.update(kwargs)
+        if class_ is not None:
+            attrs['class'] = class_
+        tag_filter = name if isinstance(name, str) else None
+        for el in self._el.iterdescendants(tag_filter) if tag_filter else self._el.iterdescendants():
+            if isinstance(el.tag, str) and self._matches(el, name, attrs, string):
+                yield LxmlNode(el)
+
+    def find(self, name=None, attrs=None, class_=None, string=None, **kwargs):
+        return next(self._iter_matches(name, attrs, class_, string, kwargs), None)
+
+    def find_all(self, name=None, attrs=None, class_=None, string=None, **kwargs):
+        return list(self._iter_matches(name, attrs, class_, string, kwargs))
+
+    # -- Siblings --
+
+    @property
+    def next_siblings(self):
+        """Yields following siblings in document order: LxmlNode for tags, str for text and comments."""
+        el = self._el
+        while el is not None:
+            if el.tail:
+                yield el.tail
+            el = el.getnext()
+            if el is None:
+                break
+            if isinstance(el.tag, str):
+                yield LxmlNode(el)
+            elif el.text is not None:
+                yield el.text
+
+    @property
+    def next_sibling(self):
+        return next(self.next_siblings, None)
+
+    def find_next_sibling(self, name=None, attrs=None, class_=None, **kwargs):
+        attrs = dict(attrs or {})
+        attrs.update(kwargs)
+        if class_ is not None:
+            attrs['class'] = class_
+        el = self._el.getnext()
+        while el is not None:
+            if isinstance(el.tag, str) and self._matches(el, name, attrs, None):
+                return LxmlNode(el)
+            el = el.getnext()
+        return None
+
+
+# -- Region slicing --
+#
+# Detail pages are mostly theme chrome. slice_regions() cuts the elements we
+# extract out of the raw HTML, by scanning tags with regexes, so the tree
+# builder only ever sees a few KB. Comments, <script> and <style> bodies are
+# skipped while matching end tags, so markup inside them can't unbalance a region.
+
+_VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+_ATTRIBUTE_PATTERN = re.compile(r'''([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?''')
+_SKIPPED_PATTERN = r'<!--.*?-->|<(?:script|style)\b.*?</(?:script|style)\s*>'
+_pattern_cache = {}
+
+
+def _tag_patterns(tag):
+    """(opening tag pattern, open/close scanner) for tag, compiled once."""
+    if tag not in _pattern_cache:
+        _pattern_cache[tag] = (
+            re.compile(rf'<{tag}\b([^>]*)>', re.IGNORECASE),
+            re.compile(rf'{_SKIPPED_PATTERN}|<(/?){tag}\b[^>]*>', re.IGNORECASE | re.DOTALL),
+        )
+    return _pattern_cache[tag]
+
+
+def _attribute_matches(attribute_text, attr, value):
+    for key, raw in _ATTRIBUTE_PATTERN.findall(attribute_text):
+        if key.lower() == attr:
+            actual = raw[1:-1] if raw[:1] in ('"', "'") else raw
+            return _matches_value(actual, value, attr in _MULTI_VALUED_ATTRIBUTES)
+    return False
+
+
+def _find_region(html, tag, attr, value):
+    """(start, end) of the first tag element whose attr matches value, or None if there is none."""
+    opener, scanner = _tag_patterns(tag)
+    for match in opener.finditer(html):
+        if not _attribute_matches(match.group(1), attr, value):
+            continue
+        if tag in _VOID_ELEMENTS or match.group(0).endswith('/>'):
+            return match.start(), match.end()
+        depth = 1
+        for token in scanner.finditer(html, match.end()):
+            if token.group(1) is None: # A comment, script or style body
+                continue
+            depth += -1 if token.group(1) else 1
+            if depth == 0:
+                return match.start(), token.end()
+        raise ValueError(f"<{tag} {attr}=\"{value}\"> is never closed")
+    return None
+
+
+def slice_regions(html, regions):
+    """
+    Returns the HTML of just the elements described by regions, in document order.
+
+    Args:
+        html (str): A full HTML document.
+        regions (list): (tag, attribute, value) tuples; for each, the first element
+                        matching like soup.find(tag, attrs={attribute: value}) is kept.
+                        An element nested inside another kept element is not repeated.
+
+    Returns:
+        str or None: The concatenated elements, or None if one of them couldn't be
+                     delimited (the caller should then parse the whole document).
+    """
+    spans = []
+    try:
+        for tag, attr, value in regions:
+            span = _find_region(html, tag, attr, value)
+            if span:
+                spans.append(span)
+    except ValueError as e:
+        logging.debug(f"Falling back to a full parse: {e}")
+        return None
+    parts = []
+    covered_until = -1
+    for start, end in sorted(spans):
+        if start < covered_until:
+            continue
+        parts.append(html[start:end])
+        covered_until = end
+    return '\n'.join(parts)
+
+
+_BACKENDS = {'bs4': Bs4Backend, 'lxml': LxmlBackend}
+_instances = {}
+
+
+def get_backend(name=None):
+    """
+    Returns the parser backend called name (default: config.PARSER_BACKEND).
+    Falls back to the 'bs4' reference backend if lxml isn't installed.
+    """
+    name = name or config.PARSER_BACKEND
+    if name not in _instances:
+        if name not in _BACKENDS:
+            raise ValueError(f"Unknown parser backend '{name}'. Choose from: {', '.join(_BACKENDS)}")
+        try:
+            _instances[name] = _BACKENDS[name]()
+        except ImportError as e:
+            logging.warning(f"Parser backend '{name}' is unavailable ({e}); using 'bs4'.")
+            _instances[name] = get_backend('bs4')
+    return _instances[name]
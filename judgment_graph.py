@@ -0,0 +1,262 @@
+# shunyatax/judgment_graph.py
+
+import os
+import json
+import logging
+from array import array
+from collections import deque
+from urllib.parse import urldefrag
+
+import config
+import output_writers
+import utils
+
+# Links between judgments, from each extracted post's Related_Judgements
+# (YARPP) and Comments (target_judgment_url) fields. Every post and linked URL
+# becomes a node keyed by link_id(), utils.generate_unique_id() of the URL
+# without its #fragment, so a link reaches the same node whether or not its post
+# has been extracted yet. An extracted post's own unique_id (which for posts
+# from the legacy ledger is not derived from its URL) is kept on the node and
+# also finds it. Comment links come from the page's recent-comments widget, so
+# they record what was being discussed when the page was fetched rather than a
+# citation; they are kept as their own edge kind to be filtered on.
+#
+# The graph is held in CSR form, as flat arrays:
+#   offsets[n] .. offsets[n + 1]     - the slice of targets/kinds holding node n's out-links
+#   in_offsets / sources / in_kinds  - the same for in-links (who links to node n)
+# and saved to config.GRAPH_FILE as one JSON line (nodes, array sizes and
+# indexing progress) followed by the arrays' raw bytes.
+
+EDGE_KINDS = ['related', 'comment']
+# Bumped when nodes are keyed differently; a graph file of another version is rebuilt.
+_FORMAT_VERSION = 2
+_ARRAYS = ['offsets', 'targets', 'kinds', 'in_offsets', 'sources', 'in_kinds']
+
+
+def link_id(url):
+    """The unique_id a linked URL resolves to."""
+    return utils.generate_unique_id(urldefrag(url)[0])
+
+
+def row_links(row):
+    """Returns [(target unique_id, edge kind, url, title)] for the links in one extracted row."""
+    links = []
+    for related in row.get('Related_Judgements') or []:
+        if related.get('url'):
+            links.append((link_id(related['url']), 'related', urldefrag(related['url'])[0], related.get('title', '')))
+    for comment in row.get('Comments') or []:
+        if comment.get('target_judgment_url'):
+            url = urldefrag(comment['target_judgment_url'])[0]
+            links.append((link_id(url), 'comment', url, comment.get('target_judgment_title', '')))
+    return links
+
+
+class JudgmentGraph:
+    """
+    Directed judgment-to-judgment links with neighbour, k-hop and most-referenced queries.
+
+    Args:
+        path (str, optional): Graph file; defaults to config.GRAPH_FILE. Loaded if it exists.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.GRAPH_FILE
+        self.nodes = [] # node -> {'unique_id', 'url', 'title', 'category'}; category is None until the post is extracted
+        self._node_ids = {}
+        self._sources = {} # category -> {'format', 'ids_bytes'} indexed so far
+        for name in _ARRAYS:
+            setattr(self, name, array('I') if 'kinds' not in name else array('B'))
+        self.offsets.append(0)
+        self.in_offsets.append(0)
+        if os.path.exists(self.path):
+            self._load()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    # -- Storage --
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != _FORMAT_VERSION:
+                logging.info(f"{self.path} was built by an older version; it will be rebuilt on the next update.")
+                return
+            for name in _ARRAYS:
+                values = array('I') if 'kinds' not in name else array('B')
+                values.frombytes(f.read(header['sizes'][name] * values.itemsize))
+                setattr(self, name, values)
+        self.nodes = header['nodes']
+        self._sources = header['sources']
+        self._node_ids = {}
+        for index, node in enumerate(self.nodes):
+            self._node_ids[node['unique_id']] = index
+            if node['url']:
+                self._node_ids[link_id(node['url'])] = index
+
+    def save(self):
+        header = {
+            'version': _FORMAT_VERSION,
+            'nodes': self.nodes,
+            'sources': self._sources,
+            'sizes': {name: len(getattr(self, name)) for name in _ARRAYS},
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n')
+            for name in _ARRAYS:
+                getattr(self, name).tofile(f)
+        os.replace(temp_path, self.path)
+
+    # -- Building --
+
+    def _node(self, unique_id, url='', title=''):
+        if unique_id not in self._node_ids:
+            self._node_ids[unique_id] = len(self.nodes)
+            self.nodes.append({'unique_id': unique_id, 'url': url, 'title': title, 'category': None})
+        node = self.nodes[self._node_ids[unique_id]]
+        if not node['title'] and title:
+            node['title'] = title
+        if not node['url'] and url:
+            node['url'] = url
+        return self._node_ids[unique_id]
+
+    def _out_links(self):
+        """Current out-links as {node: [(target, kind)]}, for editing before the arrays are rebuilt."""
+        return {
+            node: list(zip(self.targets[self.offsets[node]:self.offsets[node + 1]], self.kinds[self.offsets[node]:self.offsets[node + 1]]))
+            for node in range(len(self.offsets) - 1)
+            if self.offsets[node + 1] > self.offsets[node]
+        }
+
+    def update(self, output_dir=None, rebuild=False):
+        """
+        Adds the links of every post written to output_dir (default:
+        config.OUTPUT_DIR) since the last update, replacing the links of posts that
+        were re-extracted, then rebuilds the arrays and saves the graph.
+        Returns the number of posts read.
+        """
+        output_dir = output_dir or config.OUTPUT_DIR
+        if rebuild:
+            self.nodes, self._node_ids, self._sources = [], {}, {}
+            out_links = {}
+        else:
+            out_links = self._out_links()
+
+        updated = 0
+        for category_name in sorted(os.listdir(output_dir)) if os.path.isdir(output_dir) else []:
+            category_dir = os.path.join(output_dir, category_name)
+            manifest = output_writers.read_manifest(category_dir) if os.path.isdir(category_dir) else None
+            if manifest is None:
+                continue
+            source = self._sources.get(category_name)
+            start = 0
+            if source and source['format'] == manifest['format'] and source['ids_bytes'] <= manifest['ids_bytes']:
+                start = source['ids_bytes']
+            elif source:
+                logging.info(f"Output of {category_name} was reset since the graph was built; re-reading the whole category.")
+                for node in [node for node, info in enumerate(self.nodes) if info['category'] == category_name]:
+                    out_links.pop(node, None)
+            if start == manifest['ids_bytes']:
+                continue
+            rows = output_writers.read_rows_since(category_dir, manifest, start, with_text=False)
+            for unique_id, row in rows.items():
+                url = urldefrag(row.get('Post_URL') or '')[0]
+                node = self._node(link_id(url) if url else unique_id, url, row.get('Title', ''))
+                self.nodes[node].update(unique_id=unique_id, category=category_name, title=row.get('Title') or self.nodes[node]['title'])
+                self._node_ids[unique_id] = node
+                links = set()
+                for target_id, kind, url, title in row_links(row):
+                    target = self._node(target_id, url, title)
+                    if target != node:
+                        links.add((target, EDGE_KINDS.index(kind)))
+                out_links[node] = sorted(links)
+            self._sources[category_name] = {'format': manifest['format'], 'ids_bytes': manifest['ids_bytes']}
+            updated += len(rows)
+
+        if updated or rebuild:
+            self._build_arrays(out_links)
+            self.save()
+            logging.info(f"Judgment graph updated from {updated} posts: {len(self.nodes)} nodes, {self.edge_count} links.")
+        return updated
+
+    def _build_arrays(self, out_links):
+        node_count = len(self.nodes)
+        self.offsets, self.targets, self.kinds = array('I', [0]), array('I'), array('B')
+        in_links = [[] for _ in range(node_count)]
+        for node in range(node_count):
+            for target, kind in out_links.get(node, []):
+                self.targets.append(target)
+                self.kinds.append(kind)
+                in_links[target].append((node, kind))
+            self.offsets.append(len(self.targets))
+        self.in_offsets, self.sources, self.in_kinds = array('I', [0]), array('I'), array('B')
+        for links in in_links:
+            for source, kind in links:
+                self.sources.append(source)
+                self.in_kinds.append(kind)
+            self.in_offsets.append(len(self.sources))
+
+    # -- Querying --
+
+    def node_id(self, post):
+        """The node for a unique_id or a post URL, or None if the graph doesn't know it."""
+        if post in self._node_ids:
+            return self._node_ids[post]
+        return self._node_ids.get(link_id(post))
+
+    def _adjacent(self, node, direction, kinds):
+        """Yields the nodes linked from (out), to (in) or either way (both) node, over edges of kinds."""
+        allowed = None if kinds is None else {EDGE_KINDS.index(kind) for kind in kinds}
+        if direction in ('out', 'both'):
+            for position in range(self.offsets[node], self.offsets[node + 1]):
+                if allowed is None or self.kinds[position] in allowed:
+                    yield self.targets[position]
+        if direction in ('in', 'both'):
+            for position in range(self.in_offsets[node], self.in_offsets[node + 1]):
+                if allowed is None or self.in_kinds[position] in allowed:
+                    yield self.sources[position]
+
+    def neighbours(self, post, direction='out', kinds=None):
+        """
+        Returns the node dicts linked from post (direction 'out'), linking to it
+        ('in') or either ('both'), optionally only over edges of kinds (see EDGE_KINDS).
+        """
+        node = self.node_id(post)
+        if node is None:
+            return []
+        return [self.nodes[neighbour] for neighbour in dict.fromkeys(self._adjacent(node, direction, kinds))]
+
+    def k_hop(self, post, k=2, direction='out', kinds=None):
+        """Returns [(node dict, hops)] for every node within k links of post, nearest first."""
+        start = self.node_id(post)
+        if start is None:
+            return []
+        distances = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if distances[node] == k:
+                continue
+            for neighbour in self._adjacent(node, direction, kinds):
+                if neighbour not in distances:
+                    distances[neighbour] = distances[node] + 1
+                    queue.append(neighbour)
+        del distances[start]
+        return [(self.nodes[node], hops) for node, hops in distances.items()]
+
+    def most_referenced(self, limit=10, kinds=None):
+        """Returns [(node dict, in-link count)] for the limit most linked-to nodes."""
+        allowed = None if kinds is None else {EDGE_KINDS.index(kind) for kind in kinds}
+        counts = []
+        for node in range(len(self.nodes)):
+            start, end = self.in_offsets[node], self.in_offsets[node + 1]
+            count = end - start if allowed is None else sum(1 for kind in self.in_kinds[start:end] if kind in allowed)
+            if count:
+                counts.append((count, node))
+        counts.sort(key=lambda item: (-item[0], item[1]))
+        return [(self.nodes[node], count) for count, node in counts[:limit]]
@@ -0,0 +1,238 @@
+# shunyatax/ledger_store.py
+
+import os
+import re
+import csv
+import sqlite3
+import hashlib
+import logging
+
+import config
+
+LEDGER_FIELDS = ['unique_id', 'file_path', 'post_url']
+
+_PAGE_FOLDER_PATTERN = re.compile(r'^page_(\d+)$')
+
+
+def split_ledger_path(file_path):
+    """
+    Derives (category, page) from a saved post path such as
+    'data/aar/page_1/<unique_id>.html'. Both '/' and '\\' separators are accepted,
+    since older ledgers were written on Windows.
+    Returns (None, None) if the path doesn't follow the data/<category>/page_N layout.
+    """
+    parts = [part for part in re.split(r'[\\/]', file_path) if part]
+    for i in range(len(parts) - 1, 0, -1):
+        match = _PAGE_FOLDER_PATTERN.match(parts[i])
+        if match:
+            return parts[i - 1], int(match.group(1))
+    return None, None
+
+
+def url_id(post_url):
+    """Same hash as utils.generate_unique_id; duplicated here to keep the store free of utils imports."""
+    return hashlib.md5(post_url.encode('utf-8')).hexdigest()
+
+
+def normalize_ledger_path(file_path):
+    """Rewrites a ledger path with the separators of the current platform."""
+    parts = re.split(r'[\\/]', file_path)
+    if file_path.startswith(('/', '\\')):
+        return os.sep + os.path.join(*[part for part in parts if part])
+    return os.path.join(*[part for part in parts if part])
+
+
+class LedgerStore:
+    """
+    SQLite-backed ledger of fetched posts.
+
+    unique_id is the primary key, so duplicates are rejected and lookups use
+    the index instead of a scan. Writes are buffered and committed in groups of
+    LEDGER_COMMIT_BATCH_SIZE rows (call flush() or close() to commit the rest).
+    Every row also carries the category and page number the post was first
+    fetched from, indexed so one category (or one listing page) can be read
+    without touching the others. A post that is listed under several
+    categories is stored once; each listing it appears on is recorded in the
+    membership table.
+    """
+
+    def __init__(self, db_path=None, batch_size=None):
+        self.db_path = db_path or config.LEDGER_DB_FILE
+        self.batch_size = batch_size or config.LEDGER_COMMIT_BATCH_SIZE
+        self._pending = {}
+        self._pending_memberships = {}
+        self._ids = None
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ledger (
+                unique_id TEXT PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                post_url TEXT NOT NULL,
+                category TEXT,
+                page INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS ledger_category_page ON ledger (category, page);
+            CREATE TABLE IF NOT EXISTS membership (
+                unique_id TEXT NOT NULL,
+                category TEXT NOT NULL,
+                page INTEGER,
+                PRIMARY KEY (unique_id, category)
+            );
+            CREATE INDEX IF NOT EXISTS membership_category_page ON membership (category, page);
+        """)
+
+    def __len__(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM ledger").fetchone()
+        return count + len(self._pending)
+
+    def __contains__(self, unique_id):
+        return unique_id in self.ids()
+
+    def ids(self):
+        """
+        Returns the in-memory set of known post IDs (loaded once, then kept current).
+
+        Rows imported from older ledgers may carry a unique_id that isn't the hash
+        of their post_url, so the set holds both the stored unique_id and the
+        generate_unique_id() of the URL; checking a freshly listed post's ID is
+        then correct for every row.
+        """
+        if self._ids is None:
+            self._ids = set()
+            rows = list(self._conn.execute("SELECT unique_id, post_url FROM ledger"))
+            rows += [(row[0], row[2]) for row in self._pending.values()]
+            for unique_id, post_url in rows:
+                self._ids.add(unique_id)
+                self._ids.add(url_id(post_url))
+        return self._ids
+
+    def add(self, unique_id, file_path, post_url, category=None, page=None):
+        """
+        Queues an entry; it is committed with the next batch. Known IDs are ignored.
+        category/page default to the ones in file_path's data/<category>/page_N layout.
+        """
+        if unique_id in self._pending:
+            return
+        if category is None:
+            category, page = split_ledger_path(file_path)
+        self._pending[unique_id] = (unique_id, file_path, post_url, category, page)
+        if self._ids is not None:
+            self._ids.update((unique_id, url_id(post_url)))
+        if category is not None:
+            self._pending_memberships[(unique_id, category)] = (unique_id, category, page)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def add_membership(self, unique_id, category, page):
+        """Records that a post is listed on a category page (the latest page wins)."""
+        self._pending_memberships[(unique_id, category)] = (unique_id, category, page)
+        if len(self._pending_memberships) >= self.batch_size:
+            self.flush()
+
+    def memberships(self, unique_id):
+        """Returns {category: page} for every category listing the post."""
+        self.flush()
+        rows = self._conn.execute("SELECT category, page FROM membership WHERE unique_id = ?", (unique_id,))
+        return {row[0]: row[1] for row in rows}
+
+    def add_many(self, rows):
+        """Queues (unique_id, file_path, post_url) tuples and commits them in one transaction."""
+        for unique_id, file_path, post_url in rows:
+            category, page = split_ledger_path(file_path)
+            self._pending.setdefault(unique_id, (unique_id, file_path, post_url, category, page))
+            if self._ids is not None:
+                self._ids.update((unique_id, url_id(post_url)))
+            if category is not None:
+                self._pending_memberships.setdefault((unique_id, category), (unique_id, category, page))
+        self.flush()
+
+    def flush(self):
+        """Commits every queued entry and membership as a single transaction."""
+        if not self._pending and not self._pending_memberships:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO ledger (unique_id, file_path, post_url, category, page) VALUES (?, ?, ?, ?, ?)",
+                list(self._pending.values()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO membership (unique_id, category, page) VALUES (?, ?, ?)",
+                list(self._pending_memberships.values()),
+            )
+        logging.debug(f"Committed {len(self._pending)} ledger entries.")
+        self._pending.clear()
+        self._pending_memberships.clear()
+
+    def get(self, unique_id):
+        """Returns the entry for unique_id as a dict, or None."""
+        if unique_id in self._pending:
+            return dict(zip(['unique_id', 'file_path', 'post_url', 'category', 'page'], self._pending[unique_id]))
+        row = self._conn.execute("SELECT * FROM ledger WHERE unique_id = ?", (unique_id,)).fetchone()
+        return dict(row) if row else None
+
+    def entries(self, category=None, page=None):
+        """
+        Returns ledger entries as dicts, optionally restricted to one category
+        (and one listing page within it), ordered by category and page.
+        """
+        self.flush()
+        query = "SELECT * FROM ledger"
+        params = []
+        if category is not None:
+            query += " WHERE category = ?"
+            params.append(category)
+            if page is not None:
+                query += " AND page = ?"
+                params.append(page)
+        query += " ORDER BY category, page"
+        return [dict(row) for row in self._conn.execute(query, params)]
+
+    def scan_prefix(self, category_prefix):
+        """Returns entries whose category starts with category_prefix (an index range scan)."""
+        if not category_prefix:
+            return self.entries()
+        self.flush()
+        upper = category_prefix[:-1] + chr(ord(category_prefix[-1]) + 1)
+        rows = self._conn.execute(
+            "SELECT * FROM ledger WHERE category >= ? AND category < ? ORDER BY category, page",
+            (category_prefix, upper),
+        )
+        return [dict(row) for row in rows]
+
+    def categories(self):
+        """Returns {category: entry count}."""
+        self.flush()
+        return {row[0]: row[1] for row in self._conn.execute("SELECT category, COUNT(*) FROM ledger GROUP BY category")}
+
+    def import_csv(self, csv_path=None):
+        """
+        Bulk-loads an existing ledger.csv. Paths are rewritten with native
+        separators and duplicate unique_ids keep their first row.
+        Returns the number of rows read.
+        """
+        csv_path = csv_path or config.LEDGER_FILE
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            if not reader.fieldnames or 'unique_id' not in reader.fieldnames:
+                logging.error(f"Ledger file '{csv_path}' is missing 'unique_id' column in header. Run fix_ledger.py first.")
+                return 0
+            rows = [(row['unique_id'], normalize_ledger_path(row['file_path']), row['post_url']) for row in reader]
+        self.add_many(rows)
+        logging.info(f"Imported {len(rows)} rows from {csv_path} into {self.db_path}.")
+        return len(rows)
+
+    def export_csv(self, csv_path=None):
+        """Writes the ledger back out in the classic ledger.csv layout."""
+        csv_path = csv_path or config.LEDGER_FILE
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(LEDGER_FIELDS)
+            for entry in self.entries():
+                writer.writerow([entry[field] for field in LEDGER_FIELDS])
+
+    def close(self):
+        self.flush()
+        self._conn.close()
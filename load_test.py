@@ -0,0 +1,147 @@
+# shunyatax/load_test.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import config
+import main
+import raw_store
+import standin_server
+import utils
+
+
+def run_load_test(server, categories=None, work_dir=None, crawlers=1):
+    """
+    Crawls the stand-in server with Phase 1, as configured in config, into a
+    scratch work_dir (a temporary folder by default, removed afterwards), with
+    crawlers crawler processes sharing the frontier.
+
+    Returns:
+        dict: Crawl throughput, fetch latency percentiles, retry and failure
+              counts, and the status codes seen by the crawler and sent by the server.
+    """
+    own_work_dir = work_dir is None
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix='shunyatax-load-'))
+    os.makedirs(work_dir, exist_ok=True)
+    previous_dir = os.getcwd()
+    live_templates = (config.BASE_URL, config.CATEGORY_URL_TEMPLATE, config.CATEGORY_PAGINATION_URL_TEMPLATE)
+    saved = {name: getattr(config, name) for name in (
+        'BASE_URL', 'CATEGORY_URL_TEMPLATE', 'CATEGORY_PAGINATION_URL_TEMPLATE', 'CATEGORIES', 'DATA_DIR',
+        'RAW_STORE_DIR', 'PACK_DIR', 'LEDGER_FILE', 'LEDGER_DB_FILE', 'PROGRESS_FILE', 'FRONTIER_DB_FILE', 'DEAD_LETTER_FILE')}
+    saved_stores = (utils._ledger_store, raw_store._pack_store)
+    try:
+        config.BASE_URL, config.CATEGORY_URL_TEMPLATE, config.CATEGORY_PAGINATION_URL_TEMPLATE = (server.url_for(url) for url in live_templates)
+        config.CATEGORIES = categories or sorted(server.site.categories)
+        config.DATA_DIR = os.path.join(work_dir, 'data')
+        config.RAW_STORE_DIR = os.path.join(config.DATA_DIR, 'posts')
+        config.PACK_DIR = os.path.join(config.DATA_DIR, 'packs')
+        config.LEDGER_FILE = os.path.join(work_dir, 'ledger.csv')
+        config.LEDGER_DB_FILE = os.path.join(work_dir, 'ledger.db')
+        config.PROGRESS_FILE = os.path.join(work_dir, 'progress_tracker.csv')
+        config.FRONTIER_DB_FILE = os.path.join(work_dir, 'frontier.db')
+        config.DEAD_LETTER_FILE = os.path.join(work_dir, 'dead_letters.jsonl')
+        os.chdir(work_dir) # utils keeps progress_tracker.csv in the working directory
+
+        start = time.perf_counter()
+        stats = main.run_phase1_data_collection(crawlers=crawlers)
+        elapsed = time.perf_counter() - start
+        posts = len(utils.get_ledger_store())
+    finally:
+        os.chdir(previous_dir)
+        for name, value in saved.items():
+            setattr(config, name, value)
+        # Phase 1 opened the process-wide stores on the scratch folder; put back the
+        # ones from before, so later calls don't use a folder that is about to go.
+        if utils._ledger_store is not saved_stores[0]:
+            utils._ledger_store.close()
+            utils._ledger_store = saved_stores[0]
+        if raw_store._pack_store is not saved_stores[1]:
+            raw_store._pack_store.close()
+            raw_store._pack_store = saved_stores[1]
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = stats.summary()
+    return {
+        'seconds': round(elapsed, 3),
+        'posts': posts,
+        'posts_per_second': round(posts / elapsed, 2) if elapsed else None,
+        'requests_per_second': round(stats.requests / elapsed, 2) if elapsed else None,
+        'latency_p50_ms': round(summary['latency_p50'] * 1000, 1) if summary['latency_p50'] is not None else None,
+        'latency_p99_ms': round(summary['latency_p99'] * 1000, 1) if summary['latency_p99'] is not None else None,
+        'requests': summary['requests'],
+        'retries': summary['retries'],
+        'failures': summary['failures'],
+        'errors': summary['errors'],
+        'bytes': summary['bytes'],
+        'client_statuses': summary['statuses'],
+        'server_statuses': {str(status): count for status, count in sorted(server.statuses.items())},
+        'settings': {
+            'crawlers': crawlers,
+            'max_connections_per_host': config.MAX_CONNECTIONS_PER_HOST,
+            'rate_limit_initial_rps': config.RATE_LIMIT_INITIAL_RPS,
+            'rate_limit_max_rps': config.RATE_LIMIT_MAX_RPS,
+            'rate_limit_burst': config.RATE_LIMIT_BURST,
+            'max_retries': config.MAX_RETRIES,
+            'retry_delay_seconds': config.RETRY_DELAY_SECONDS,
+            'latency': server.latency,
+            'jitter': server.jitter,
+            'throttle_rate': server.throttle_rate,
+            'error_rate': server.error_rate,
+            'bandwidth': server.bandwidth,
+            'seed': server.seed,
+        },
+    }
+
+
+def main_cli():
+    argument_parser = argparse.ArgumentParser(description="Load-test the Phase 1 crawler against a local stand-in server.")
+    standin_server.add_fault_arguments(argument_parser)
+    argument_parser.add_argument('--categories', nargs='+', help="Categories to crawl (default: every category in the data folder).")
+    argument_parser.add_argument('--crawlers', type=int, default=1, help="Crawler processes sharing the frontier (each with its own connections and rate limiter).")
+    argument_parser.add_argument('--connections', type=int, help="config.MAX_CONNECTIONS_PER_HOST for the run.")
+    argument_parser.add_argument('--rps', type=float, help="Initial and maximum requests per second of the rate limiter.")
+    argument_parser.add_argument('--burst', type=int, help="config.RATE_LIMIT_BURST for the run.")
+    argument_parser.add_argument('--retries', type=int, help="config.MAX_RETRIES for the run.")
+    argument_parser.add_argument('--retry-delay', type=float, help="config.RETRY_DELAY_SECONDS for the run.")
+    argument_parser.add_argument('--json', help="Also write the report to this file.")
+    argument_parser.add_argument('--max-failures', type=int, help="Exit with status 1 if more URLs than this are given up on.")
+    argument_parser.add_argument('--verbose', action='store_true', help="Log the crawl at INFO level.")
+    args = argument_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.connections:
+        config.MAX_CONNECTIONS_PER_HOST = args.connections
+        config.MAX_CONNECTIONS = max(config.MAX_CONNECTIONS, args.connections)
+    if args.rps:
+        config.RATE_LIMIT_INITIAL_RPS = config.RATE_LIMIT_MAX_RPS = args.rps
+    if args.burst:
+        config.RATE_LIMIT_BURST = args.burst
+    if args.retries:
+        config.MAX_RETRIES = args.retries
+    if args.retry_delay is not None:
+        config.RETRY_DELAY_SECONDS = args.retry_delay
+
+    server = standin_server.server_from_arguments(args).start_in_thread()
+    try:
+        report = run_load_test(server, categories=args.categories, crawlers=args.crawlers)
+    finally:
+        server.stop_thread()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.max_failures is not None and report['failures'] > args.max_failures:
+        print(f"FAIL: {report['failures']} URLs failed (allowed: {args.max_failures}).")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
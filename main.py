@@ -1,111 +1,599 @@
 import argparse
+import asyncio
 import os
-import csv
 import json
 import time
 import logging
+import queue
+import sqlite3
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import multiprocessing
 
 # Import project modules
 import config
+import facet_index
 import fetcher
+import frontier
+import html_backends
+import judgment_graph
+import ledger_store
+import metrics
+import output_writers
+import raw_store
+import search_index
 import utils
 import parser
 
-# Define a new constant for the extracted data file base name
-EXTRACTED_CSV_BASENAME = 'extracted' # Will become extracted_1.csv, extracted_2.csv etc.
+# CSV header of the extracted data, based on all required fields
+EXTRACTED_FIELDNAMES = [
+    'unique_id', 'Case_Number', 'Title', 'Post_URL', 'Date_Pronouncement', 'Date_Publication',
+    'Tribunal_Bench', 'Coram', 'Assessee_Name', 'Tax_Year', 'Section_Involved', 'Genre',
+    'Catch_Words', 'Counsel', 'File_Link', 'Citation', 'Issue_Summary',
+    'Tribunal_Decision', 'Tax_Amount', 'Legal_Principle',
+    'Full_Text', 'Comments', 'Related_Judgements', 'parser_version', 'html_hash'
+]
+
+# Result placeholder for a post whose page and parser version match its existing row
+UNCHANGED = 'unchanged'
 
 # Helper function to encapsulate parsing for multiprocessing
-def _process_single_entry_for_extraction(entry_data):
+def _init_extraction_worker():
     """
-    Worker function for ProcessPoolExecutor in Phase 2.
-    Parses a single HTML file and returns its extracted data.
+    ProcessPoolExecutor initializer for Phase 2: runs once per worker process, so
+    the parser backend (and its imports) is set up once, not once per task.
     """
-    unique_id = entry_data['unique_id']
-    html_file_path = entry_data['file_path']
-    # Reconstruct category_response_path for parser
-    category_folder = os.path.dirname(html_file_path)
-    category_response_path = os.path.join(category_folder, 'category_response.html')
-    
-    try:
-        extracted_data = parser.extract_judgment_data(html_file_path, category_response_path)
-        extracted_data['unique_id'] = unique_id
-        # logging.debug(f"Successfully extracted data for {unique_id}") # Logged by main process
-        return extracted_data
-    except Exception as e:
-        logging.error(f"Error extracting data from {html_file_path} (unique_id: {unique_id}): {e}", exc_info=True)
-        return None # Return None if extraction fails
+    html_backends.get_backend()
+
+def _process_extraction_chunk(page_tasks):
+    """
+    Worker function for ProcessPoolExecutor in Phase 2: extracts a chunk of
+    listing-page tasks and returns all of their results in one batch, so each
+    chunk costs a single round-trip between processes.
+
+    Returns:
+        tuple: (results, sampled stage timings) - the results of every page (see
+               _process_listing_page_for_extraction) and the per-stage timings of
+               the documents metrics.sampled() picked, for the main process to record.
+    """
+    sampled_timings = []
+    results = [result for page_task in page_tasks for result in _process_listing_page_for_extraction(page_task, sampled_timings)]
+    return results, sampled_timings
 
-def run_phase1_data_collection():
+def _process_listing_page_for_extraction(page_task, sampled_timings=None):
+    """
+    Extracts one listing page's posts (called by _process_extraction_chunk).
+
+    Handles every post found on one category listing page: the page's
+    category_response.html is parsed once into per-post fallback records, and
+    each post's detail HTML is then extracted with its own record.
+
+    An entry carrying an 'html_hash' was extracted before by the current parser
+    version; it is only re-extracted if its page no longer has that hash.
+
+    When sampled_timings is a list, the parser stage timings of the documents
+    metrics.sampled() picks are appended to it.
+
+    Returns:
+        list: (unique_id, extracted data, None if extraction failed, or UNCHANGED)
+              for each entry of the page.
+    """
+    category_response_path = page_task['category_response_path']
+    category_fallbacks = {}
+    if category_response_path and os.path.exists(category_response_path):
+        try:
+            with open(category_response_path, 'r', encoding='utf-8') as f:
+                category_fallbacks = parser.extract_category_fallbacks(f.read())
+        except Exception as e:
+            logging.warning(f"Could not read category HTML file {category_response_path} for fallback: {e}")
+
+    results = []
+    for entry_data in page_task['entries']:
+        unique_id = entry_data['unique_id']
+        html_file_path = entry_data['file_path']
+        try:
+            detail_html = None
+            if entry_data.get('html_hash'):
+                # Re-extract mode: the row is from the current parser, so only a changed page needs work
+                detail_html = raw_store.read_html(html_file_path)
+                if utils.hash_html(detail_html) == entry_data['html_hash']:
+                    results.append((unique_id, UNCHANGED))
+                    continue
+            # Fallbacks are keyed by the hash of the listed URL, which older ledger rows don't use as unique_id
+            category_fallback = category_fallbacks.get(utils.generate_unique_id(entry_data['post_url']))
+            timings = {} if sampled_timings is not None and metrics.sampled() else None
+            extracted_data = parser.extract_judgment_data(html_file_path, category_fallback=category_fallback, detail_html=detail_html, timings=timings)
+            if timings:
+                sampled_timings.append(timings)
+            extracted_data['unique_id'] = unique_id
+            # logging.debug(f"Successfully extracted data for {unique_id}") # Logged by main process
+            results.append((unique_id, extracted_data))
+        except Exception as e:
+            logging.error(f"Error extracting data from {html_file_path} (unique_id: {unique_id}): {e}", exc_info=True)
+            results.append((unique_id, None)) # None if extraction fails
+    return results
+
+def _record_chunk_metrics(results, sampled_timings):
+    """Counts a finished chunk's documents by outcome and records its sampled parse timings."""
+    for _, extracted_data in results:
+        outcome = 'unchanged' if extracted_data == UNCHANGED else ('extracted' if extracted_data else 'failed')
+        metrics.counter('extract_documents_total', 'Phase 2 documents, by outcome.', outcome=outcome).inc()
+    metrics.record_parse_timings(sampled_timings)
+    metrics.maybe_write_snapshot()
+
+def _listing_page(entry, ledger):
+    """
+    The page of the entry's category that lists the post now. A re-crawl rewrites
+    each page's category_response.html, so the page the ledger row first saw the
+    post on may list other posts by now; the latest membership is used if there is one.
+    """
+    # Crawls record memberships under the hash of the listed URL; an older ledger
+    # row's own unique_id only has the membership it was imported with.
+    for unique_id in (ledger_store.url_id(entry.get('post_url') or ''), entry['unique_id']):
+        page = ledger.memberships(unique_id).get(entry['category'])
+        if page:
+            return page
+    return entry.get('page')
+
+def _group_entries_by_listing_page(entries, ledger=None):
+    """
+    Groups ledger entries into one task per category listing page they are
+    listed on: the page of their latest membership in ledger (a LedgerStore),
+    or without one the page the ledger row was found on.
+    """
+    page_tasks = {}
+    for entry in entries:
+        page = entry.get('page')
+        if ledger is not None and entry.get('category'):
+            page = _listing_page(entry, ledger)
+        if entry.get('category') and page:
+            category_folder = os.path.join(config.DATA_DIR, entry['category'], f"page_{page}")
+        else:
+            category_folder = os.path.dirname(entry['file_path'])
+        category_response_path = os.path.join(category_folder, 'category_response.html')
+        if category_response_path not in page_tasks:
+            page_tasks[category_response_path] = {'category_response_path': category_response_path, 'entries': []}
+        page_tasks[category_response_path]['entries'].append(entry)
+    return list(page_tasks.values())
+
+def _chunk_page_tasks(page_tasks, chunk_size):
+    """Packs listing-page tasks into chunks of at least chunk_size posts (the last may be smaller)."""
+    chunks = []
+    chunk, chunk_entries = [], 0
+    for page_task in page_tasks:
+        chunk.append(page_task)
+        chunk_entries += len(page_task['entries'])
+        if chunk_entries >= chunk_size:
+            chunks.append(chunk)
+            chunk, chunk_entries = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def run_phase1_data_collection(incremental=False, crawlers=1, join=False):
     """
     Orchestrates the data collection phase (Phase 1).
+
+    With incremental=True only the newest posts are fetched: each category is
+    walked from page 1 until a page lists nothing that isn't already in the ledger.
+
+    With crawlers > 1 the frontier is seeded here and then crawled by that many
+    crawler processes, which share it through leases (see frontier.py). With
+    join=True nothing is seeded: this process (or these processes) join a crawl
+    another node started on the same frontier, ledger and data folder.
+
+    Returns the crawl's fetcher.FetchStats (summed over every crawler process).
     """
     logging.info("Starting Phase 1: Data Collection...")
-    
+    if crawlers <= 1:
+        return asyncio.run(_run_phase1_async(incremental, seed=not join))
+
     progress = utils.load_progress()
+    crawl_frontier = frontier.CrawlFrontier()
+    try:
+        if not join:
+            _seed_frontier(crawl_frontier, progress)
+        # Create (and import ledger.csv into) the ledger once, before the crawlers race to.
+        utils.get_ledger_store().flush()
+        # Spawned, not forked: each crawler opens its own SQLite connections and
+        # event loop. Settings changed at runtime (as load_test.py does) are passed on.
+        context = multiprocessing.get_context('spawn')
+        settings = {name: value for name, value in vars(config).items() if name.isupper()}
+        results = context.Queue()
+        processes = [context.Process(target=_run_crawler_process, args=(index, settings, results), name=f"crawler-{index}")
+                     for index in range(1, crawlers + 1)]
+        for process in processes:
+            process.start()
+        logging.info(f"Started {crawlers} crawler processes.")
+        stats = fetcher.FetchStats()
+        for _ in processes:
+            # A crawler that dies sends nothing, so wait on the results only while crawlers are alive.
+            while True:
+                try:
+                    stats.merge(results.get(timeout=1))
+                    break
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes) and results.empty():
+                        break
+        for process in processes:
+            process.join()
+            if process.exitcode:
+                logging.error(f"{process.name} exited with code {process.exitcode}; any leases it held are reclaimed once they expire.")
+        for category_name in config.CATEGORIES:
+            _advance_progress(crawl_frontier, progress, category_name)
+        counts = crawl_frontier.counts()
+    finally:
+        crawl_frontier.close()
+    summary = stats.summary()
+    logging.info(f"Phase 1 fetches: {summary['requests']} requests, {summary['retries']} retries, {summary['failures']} failed URLs.")
+    logging.info(f"Crawl frontier: {counts['done']} URLs done, {counts['failed']} waiting to be retried, {counts['dead']} given up on.")
+    return stats
+
+
+def _run_crawler_process(index, settings, results):
+    """Entry point of one crawler process started by run_phase1_data_collection(crawlers=...)."""
+    for name, value in settings.items():
+        setattr(config, name, value)
+    if config.METRICS_FILE:
+        # One snapshot per crawler, so they don't overwrite each other's.
+        root, extension = os.path.splitext(config.METRICS_FILE)
+        config.METRICS_FILE = f"{root}.crawler{index}{extension}"
+    utils.setup_logging(clear=False)
+    results.put(asyncio.run(_run_phase1_async(seed=False)))
+
+
+def _seed_frontier(crawl_frontier, progress):
+    """Queues each category's progress page, which is read again for pages added since."""
+    seeds = [(category_name, progress.get(category_name, 1)) for category_name in config.CATEGORIES]
+    crawl_frontier.add_many([(utils.category_page_url(category_name, page), 'listing', category_name, page, None)
+                             for category_name, page in seeds], reset_done=True)
+    for category_name, page in seeds:
+        logging.info(f"{category_name}: crawling from listing page {page}.")
+
+
+async def _run_phase1_async(incremental=False, stream=None, seed=True):
+    progress = utils.load_progress()
+    crawl_frontier = frontier.CrawlFrontier()
+    logging.info(f"Crawler {crawl_frontier.owner} starting.")
 
-    for category_name, base_url in config.CATEGORIES.items():
-        logging.info(f"\nProcessing category: {category_name}")
-        current_page = progress.get(category_name, 1)
-        
+    try:
+        # A single engine (and connection pool) is shared by every category.
+        async with fetcher.FetchEngine() as engine:
+            if incremental:
+                for category_name in config.CATEGORIES:
+                    logging.info(f"\nRefreshing category: {category_name}")
+                    await _refresh_category(engine, crawl_frontier, category_name, stream)
+                # Posts that failed in earlier runs and are due for another attempt
+                await _crawl_frontier(engine, crawl_frontier, progress, stream, kinds=['post'])
+            else:
+                if seed:
+                    _seed_frontier(crawl_frontier, progress)
+                await _crawl_frontier(engine, crawl_frontier, progress, stream)
+        counts = crawl_frontier.counts()
+    finally:
+        crawl_frontier.close()
+    stats = engine.stats.summary()
+    logging.info(f"Phase 1 fetches: {stats['requests']} requests, {stats['retries']} retries, {stats['failures']} failed URLs.")
+    logging.info(f"Crawl frontier: {counts['done']} URLs done, {counts['failed']} waiting to be retried, {counts['dead']} given up on.")
+    metrics.write_snapshot()
+    return engine.stats
+
+
+def run_streaming_pipeline(incremental=False):
+    """
+    Runs Phase 1 and Phase 2 together: every listing page's newly saved posts are
+    handed to the Phase 2 worker pool as soon as the page is done, so extraction
+    runs on the otherwise idle cores while the crawl waits on the network, and
+    rows are written (and checkpointed) as each page finishes.
+
+    Posts that were fetched by an earlier Phase 1 run but never extracted are left
+    to a regular Phase 2 run.
+    """
+    logging.info("Starting streaming pipeline: Phase 1 crawl feeding Phase 2 extraction...")
+    num_processes = config.PHASE2_WORKERS or multiprocessing.cpu_count()
+    with ProcessPoolExecutor(max_workers=num_processes, initializer=_init_extraction_worker) as executor:
+        # Start the workers now: forking once the crawl's threads are running isn't safe.
+        executor.submit(_init_extraction_worker).result()
+        asyncio.run(_run_streaming_pipeline_async(executor, num_processes, incremental))
+    logging.info("Streaming pipeline complete.")
+    metrics.write_snapshot()
+    if config.UPDATE_INDEXES_AFTER_EXTRACTION:
+        update_indexes()
+
+
+async def _run_streaming_pipeline_async(executor, num_processes, incremental):
+    stream = StreamingExtraction(executor, EXTRACTED_FIELDNAMES)
+    consumers = [asyncio.create_task(stream.consume()) for _ in range(num_processes)]
+    try:
+        await _run_phase1_async(incremental, stream)
+    finally:
+        await stream.finish(consumers)
+
+
+class StreamingExtraction:
+    """
+    Bounded hand-off from the Phase 1 crawl to the Phase 2 worker pool.
+
+    The crawl puts one task per listing page; consumers send each to a worker and
+    write its rows straight to that category's writer. When extraction falls
+    behind, the queue (config.STREAM_QUEUE_SIZE pages) fills up and put_page()
+    waits, which slows the crawl down instead of piling up work in memory.
+    """
+
+    def __init__(self, executor, fieldnames):
+        self.executor = executor
+        self.fieldnames = fieldnames
+        self.queue = asyncio.Queue(maxsize=config.STREAM_QUEUE_SIZE)
+        self.writers = {}
+        self.rows_written = 0
+        self.queue_depth = metrics.gauge('stream_queue_depth', 'Listing pages waiting for extraction in the streaming pipeline.')
+
+    async def put_page(self, category_name, page, entries):
+        """Queues the posts just saved from one listing page for extraction."""
+        if entries:
+            for page_task in _group_entries_by_listing_page(entries):
+                await self.queue.put((category_name, page_task))
+                self.queue_depth.set(self.queue.qsize())
+
+    def _writer(self, category_name):
+        if category_name not in self.writers:
+            # Flushing every page keeps fresh rows on disk within seconds of extraction.
+            self.writers[category_name] = output_writers.get_writer(
+                category_name, os.path.join(config.OUTPUT_DIR, category_name), self.fieldnames, buffer_size=1
+            )
+        return self.writers[category_name]
+
+    async def consume(self):
+        loop = asyncio.get_running_loop()
         while True:
-            category_url = f"{base_url}/page/{current_page}/" if current_page > 1 else base_url
-            category_folder = os.path.join(config.DATA_DIR, category_name, f"page_{current_page}")
-            
-            os.makedirs(category_folder, exist_ok=True)
-            
-            category_file_path = os.path.join(category_folder, 'category_response.html')
-
-            logging.info(f"Fetching category page {current_page} for {category_name} from {category_url}")
+            item = await self.queue.get()
+            self.queue_depth.set(self.queue.qsize())
             try:
-                category_html_content = fetcher.fetch_html(category_url, category_file_path)
-                
-                if not category_html_content or "404 Not Found" in category_html_content:
-                    logging.info(f"No more pages for {category_name} or error fetching page {current_page}. Stopping.")
-                    break
+                if item is None:
+                    return
+                category_name, page_task = item
+                try:
+                    results, sampled_timings = await loop.run_in_executor(self.executor, _process_extraction_chunk, [page_task])
+                except Exception as e:
+                    logging.error(f"Extraction failed for {page_task['category_response_path']}: {e}", exc_info=True)
+                    continue
+                _record_chunk_metrics(results, sampled_timings)
+                rows = []
+                for original_unique_id, extracted_data in results:
+                    if extracted_data:
+                        rows.append(extracted_data)
+                    else:
+                        logging.warning(f"Skipping writing data for {original_unique_id} due to extraction errors.")
+                self._writer(category_name).write_many(rows)
+                self.rows_written += len(rows)
+            finally:
+                self.queue.task_done()
+
+    async def finish(self, consumers):
+        """Waits for queued pages to be extracted, stops the consumers and closes the writers."""
+        for _ in consumers:
+            await self.queue.put(None)
+        await asyncio.gather(*consumers, return_exceptions=True)
+        for writer in self.writers.values():
+            writer.close()
+        logging.info(f"Streaming extraction wrote {self.rows_written} rows.")
+
+
+async def _refresh_category(engine, crawl_frontier, category_name, stream=None):
+    """
+    Incremental crawl of one category: walks listing pages from page 1 and stops
+    at the first page whose posts are all already in the ledger index.
+    progress_tracker.csv is left untouched.
+    """
+    page = 1
+    new_posts = 0
+    while True:
+        _, html = await _fetch_listing_page(engine, category_name, page)
+        if html is None:
+            break
+        found, fetched = await _crawl_listing_page(engine, category_name, page, html, stream, crawl_frontier)
+        new_posts += fetched
+        if found == 0 or fetched == 0:
+            break
+        page += 1
+    logging.info(f"{category_name}: {new_posts} new posts fetched from {page} listing page(s).")
+
+
+async def _crawl_frontier(engine, crawl_frontier, progress, stream=None, kinds=None):
+    """
+    Crawls frontier items (of kinds, default all) until none is eligible, up to
+    config.FRONTIER_CONCURRENCY at a time, best priority first; the shared rate
+    limiter decides the actual pace. A listing page queues the pages after it
+    and fetches its new posts; a post item retries a post whose fetch failed.
+
+    Every item ends done, failed (retried after a backoff, on a later run if
+    need be) or dead, so an error costs only that URL, never the rest of its category.
+
+    Other crawlers may share the frontier: while they hold leases (and so may
+    queue more pages) an idle crawler polls for work instead of stopping, and a
+    heartbeat task keeps this crawler's own leases alive.
+    """
+    active = set()
+    heartbeat = asyncio.create_task(_renew_leases(crawl_frontier))
+    try:
+        with tqdm(desc="Crawling", unit="url") as pbar:
+            while True:
+                if len(active) < config.FRONTIER_CONCURRENCY:
+                    for item in crawl_frontier.claim(config.FRONTIER_CONCURRENCY - len(active), kinds):
+                        active.add(asyncio.create_task(_crawl_frontier_item(engine, crawl_frontier, item, progress, stream)))
+                if not active:
+                    if not crawl_frontier.active_leases():
+                        break
+                    await asyncio.sleep(config.FRONTIER_POLL_SECONDS)
+                    continue
+                finished, active = await asyncio.wait(active, return_when=asyncio.FIRST_COMPLETED)
+                pbar.update(len(finished))
+    finally:
+        heartbeat.cancel()
+
+
+async def _renew_leases(crawl_frontier):
+    """Renews this crawler's frontier leases every config.FRONTIER_HEARTBEAT_SECONDS until cancelled."""
+    while True:
+        await asyncio.sleep(config.FRONTIER_HEARTBEAT_SECONDS)
+        try:
+            crawl_frontier.heartbeat()
+        except sqlite3.Error as e:
+            # A missed renewal is retried on the next beat, well before the lease runs out.
+            logging.warning(f"Could not renew frontier leases: {e}")
 
-                read_more_links = []
-                soup = BeautifulSoup(category_html_content, 'html.parser')
-                post_entries = soup.find_all('div', class_=lambda c: c and 'post-' in c and 'type-post' in c)
 
-                for entry_div in post_entries:
-                    title_link_tag = entry_div.find('h2', class_='entry-title').find('a')
-                    if title_link_tag and title_link_tag.has_attr('href'):
-                        post_url = title_link_tag['href']
-                        unique_id = utils.generate_unique_id(post_url)
-                        read_more_links.append({'title': title_link_tag.text.strip(), 'url': post_url, 'unique_id': unique_id})
+async def _crawl_frontier_item(engine, crawl_frontier, item, progress, stream=None):
+    """Crawls one claimed frontier item and records how it went."""
+    try:
+        if item['kind'] == 'listing':
+            error = await _crawl_frontier_listing(engine, crawl_frontier, item, stream)
+        else:
+            error = await _crawl_frontier_post(engine, item, stream)
+    except Exception as e:
+        logging.error(f"Error in Phase 1 crawling {item['url']}: {e}", exc_info=True)
+        error = repr(e)
+    if error:
+        crawl_frontier.fail(item['url'], error)
+    else:
+        crawl_frontier.complete(item['url'])
 
-                if not read_more_links and current_page > 1:
-                    logging.info(f"No more posts found on page {current_page} for {category_name}. Stopping.")
-                    break
+    if item['kind'] == 'listing':
+        _advance_progress(crawl_frontier, progress, item['category'])
 
-                with tqdm(total=len(read_more_links), desc=f"Fetching posts for {category_name} Page {current_page}", unit="post") as pbar:
-                    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
-                        futures = []
-                        for item in read_more_links:
-                            futures.append(executor.submit(fetcher.fetch_read_more_page, item['url'], category_folder, item['unique_id']))
-                        
-                        for future in as_completed(futures):
-                            result = future.result()
-                            if result:
-                                utils.add_to_ledger(result['unique_id'], result['file_path'], result['url'])
-                            pbar.update(1)
-
-                utils.update_progress(category_name, current_page)
-                current_page += 1
-                time.sleep(utils.get_random_sleep_interval())
-                
-            except Exception as e:
-                logging.error(f"Error in Phase 1 for {category_url}: {e}", exc_info=True)
-                break
-
-
-def run_phase2_data_extraction():
+
+def _advance_progress(crawl_frontier, progress, category_name):
+    """
+    Moves a category's progress up to its frontier watermark. Progress only
+    advances over a contiguous run of finished pages, so a resumed run never
+    skips a page that is still to be retried.
+    """
+    watermark = crawl_frontier.listing_watermark(category_name)
+    if watermark > progress.get(category_name, 0):
+        progress[category_name] = watermark
+        utils.update_progress(category_name, watermark)
+
+
+async def _crawl_frontier_listing(engine, crawl_frontier, item, stream=None):
+    """Crawls one listing page item. Returns an error message, or None if it succeeded."""
+    category_name, page = item['category'], item['page']
+    status, html = await _fetch_listing_page(engine, category_name, page)
+    if html is None:
+        if status == 404:
+            logging.info(f"No more pages for {category_name} after page {page - 1}.")
+            return None
+        return f"HTTP {status}" if status else "no response"
+
+    # The first page read tells us the last page number, so the remaining pages
+    # are queued before this page's posts are fetched. Every page repeats the
+    # pagination block, so they are queued only once its last page is unknown.
+    last_page = parser.extract_last_page_number(html)
+    if last_page is not None and last_page > page and utils.category_page_url(category_name, last_page) not in crawl_frontier:
+        crawl_frontier.add_many([(utils.category_page_url(category_name, next_page), 'listing', category_name, next_page, None)
+                                 for next_page in range(page + 1, last_page + 1)])
+        logging.info(f"{category_name}: pages {page + 1}-{last_page} queued for fetching.")
+
+    found, _ = await _crawl_listing_page(engine, category_name, page, html, stream, crawl_frontier)
+    if last_page is None and found:
+        # No pagination block: walk on until a page comes back empty.
+        crawl_frontier.add(utils.category_page_url(category_name, page + 1), 'listing', category_name, page + 1)
+    return None
+
+
+async def _crawl_frontier_post(engine, item, stream=None):
+    """Retries one post whose fetch failed. Returns an error message, or None if it succeeded."""
+    category_name, page = item['category'], item['page']
+    category_folder = os.path.join(config.DATA_DIR, category_name, f"page_{page}")
+    result = await engine.fetch_read_more_page(item['url'], category_folder, item['unique_id'])
+    if result is None:
+        return "fetch failed"
+    utils.add_to_ledger(result['unique_id'], result['file_path'], result['url'], category_name, page)
+    utils.flush_ledger()
+    if stream is not None:
+        await stream.put_page(category_name, page, [{'unique_id': result['unique_id'], 'file_path': result['file_path'],
+                                                     'post_url': result['url'], 'category': category_name, 'page': page}])
+    return None
+
+
+async def _fetch_listing_page(engine, category_name, page):
+    """
+    Fetches and saves one listing page.
+
+    Returns:
+        tuple: (status, HTML). The HTML is None if the page doesn't exist (status
+               404) or could not be fetched (status of the last response, or None).
+    """
+    category_url = utils.category_page_url(category_name, page)
+    category_folder = os.path.join(config.DATA_DIR, category_name, f"page_{page}")
+    os.makedirs(category_folder, exist_ok=True)
+    category_file_path = os.path.join(category_folder, 'category_response.html')
+
+    logging.debug(f"Fetching category page {page} for {category_name} from {category_url}")
+    status, category_html_content = await engine.fetch_page(category_url, category_file_path)
+    if category_html_content is not None and (not category_html_content or "404 Not Found" in category_html_content):
+        return 404, None
+    return status, category_html_content
+
+
+async def _crawl_listing_page(engine, category_name, page, category_html_content, stream=None, crawl_frontier=None):
+    """
+    Fetches the posts listed on one category page that aren't in the ledger yet.
+
+    Every listed post gets a category/page membership record, but a post already
+    fetched through any category (or an earlier page) is never downloaded again.
+    With a crawl frontier, a post is only fetched if this crawler can lease it
+    (not done, dead, or being fetched by another crawler), and is recorded there
+    as done or failed once its ledger row is committed.
+    With a StreamingExtraction, the newly saved posts are then queued for extraction.
+
+    Returns:
+        tuple: (number of posts listed on the page, number of posts fetched)
+    """
+    category_folder = os.path.join(config.DATA_DIR, category_name, f"page_{page}")
+    ledger = utils.get_ledger_store()
+    known_ids = utils.load_ledger_index()
+
+    read_more_links = []
+    for post in parser.extract_post_entries(category_html_content):
+        unique_id = utils.generate_unique_id(post['url'])
+        read_more_links.append({'title': post['title'], 'url': post['url'], 'unique_id': unique_id})
+        ledger.add_membership(unique_id, category_name, page)
+
+    to_fetch = [item for item in read_more_links if item['unique_id'] not in known_ids]
+    if crawl_frontier is not None and to_fetch:
+        leased = crawl_frontier.lease_many([(item['url'], 'post', category_name, page, item['unique_id']) for item in to_fetch])
+        to_fetch = [item for item in to_fetch if item['url'] in leased]
+
+    results = await asyncio.gather(*[engine.fetch_read_more_page(item['url'], category_folder, item['unique_id']) for item in to_fetch])
+    saved = []
+    for item, result in zip(to_fetch, results):
+        if result:
+            utils.add_to_ledger(result['unique_id'], result['file_path'], result['url'], category_name, page)
+            saved.append({'unique_id': result['unique_id'], 'file_path': result['file_path'], 'post_url': result['url'],
+                          'category': category_name, 'page': page})
+    # Commit the page's ledger rows before progress can move past this page.
+    utils.flush_ledger()
+    if crawl_frontier is not None:
+        for item, result in zip(to_fetch, results):
+            if result:
+                crawl_frontier.complete(item['url'])
+            else:
+                crawl_frontier.fail(item['url'], "fetch failed")
+    if stream is not None:
+        await stream.put_page(category_name, page, saved)
+    return len(read_more_links), len(to_fetch)
+
+
+def run_phase2_data_extraction(reextract=False):
     """
     Orchestrates the data extraction and cleaning phase (Phase 2),
     processing each category separately and paginating output CSVs.
+
+    Args:
+        reextract (bool): Also redo posts that were already extracted, when the row
+                          is stamped with an older parser version than the fields
+                          now need, or its page's HTML has changed since. Redone
+                          rows replace the old ones.
     """
     logging.info("Starting Phase 2: Data Extraction and Cleaning...")
 
@@ -114,24 +602,14 @@ def run_phase2_data_extraction():
         logging.warning("Ledger is empty. No files to process for Phase 2. Please run Phase 1 first.")
         return
 
-    # Define CSV header based on all required fields
-    fieldnames = [
-        'unique_id', 'Case_Number', 'Title', 'Post_URL', 'Date_Pronouncement', 'Date_Publication',
-        'Tribunal_Bench', 'Coram', 'Assessee_Name', 'Tax_Year', 'Section_Involved', 'Genre',
-        'Catch_Words', 'Counsel', 'File_Link', 'Citation', 'Issue_Summary',
-        'Tribunal_Decision', 'Tax_Amount', 'Legal_Principle',
-        'Full_Text', 'Comments', 'Related_Judgements'
-    ]
+    fieldnames = EXTRACTED_FIELDNAMES
 
     # Group ledger entries by category
     categorized_entries = {}
     for entry in all_ledger_entries:
-        # Assuming category name can be derived from file_path, e.g., 'data/CATEGORY_NAME/page_N/...'
-        path_parts = entry['file_path'].split(os.sep)
-        # Find the category name, assuming structure: data/category_name/...
-        if len(path_parts) > 1 and path_parts[0] == 'data': # 'data' is the root data folder
-            category_name = path_parts[1]
-        else:
+        # The ledger derives the category from file_path ('data/CATEGORY_NAME/page_N/...')
+        category_name = entry['category']
+        if not category_name:
             category_name = "UnknownCategory" # Fallback if path structure is unexpected
             logging.warning(f"Could not determine category for {entry['file_path']}. Assigning to {category_name}.")
 
@@ -139,141 +617,229 @@ def run_phase2_data_extraction():
             categorized_entries[category_name] = []
         categorized_entries[category_name].append(entry)
 
-    num_processes = multiprocessing.cpu_count()
-    logging.info(f"Using {num_processes} processes for parallel extraction per category.")
+    num_processes = config.PHASE2_WORKERS or multiprocessing.cpu_count()
+    logging.info(f"Using {num_processes} processes for parallel extraction across all categories.")
 
+    # One pool serves the whole run. Every category's work is queued up front, in
+    # chunks, so workers move straight on from one category's pages to the next.
+    with ProcessPoolExecutor(max_workers=num_processes, initializer=_init_extraction_worker) as executor:
+        _extract_categories(executor, categorized_entries, fieldnames, reextract)
+
+    logging.info("Phase 2 complete: All categories processed.")
+    metrics.write_snapshot()
+    if config.UPDATE_INDEXES_AFTER_EXTRACTION:
+        update_indexes()
+
+def _select_entries_to_process(entries, processed, reextract):
+    """
+    Picks the entries Phase 2 has to (re)extract. New posts always qualify. In
+    re-extract mode, rows from an older parser are redone outright; rows from the
+    current one are sent with their html_hash, so the worker redoes them only if
+    the page changed.
+    """
+    required_version = parser.required_version()
+    selected = []
+    for entry in entries:
+        stamp = processed.get(entry['unique_id'])
+        if stamp is None:
+            selected.append(entry)
+        elif reextract:
+            _, parser_version, html_hash = stamp
+            if parser_version < required_version or not html_hash:
+                selected.append(entry)
+            else:
+                selected.append(dict(entry, html_hash=html_hash))
+    return selected
+
+def _extract_categories(executor, categorized_entries, fieldnames, reextract=False):
+    """Submits every category's pending entries to executor and streams the results into per-category writers."""
+    writers = {}
+    future_categories = {}
+    pending_count = 0
     for category_name, entries_in_category in categorized_entries.items():
         logging.info(f"\nProcessing category: {category_name} ({len(entries_in_category)} entries)")
         
         category_output_dir = os.path.join(config.OUTPUT_DIR, category_name)
-        os.makedirs(category_output_dir, exist_ok=True)
 
-        # Track processed IDs for this category for resume
-        processed_ids_in_category = set()
-        # Find the last processed file and entry count to resume pagination correctly
-        last_csv_index = 0
-        last_entry_count = 0
-        
-        # This part requires robust scanning of existing CSVs to resume correctly if needed
-        # For simplicity, if previous files exist, we will just append to the last one
-        # or create new ones if current count exceeds 100.
-        # A more robust solution would iterate through existing CSVs, count rows, and find last index.
-        # For now, let's just make sure we don't duplicate processing logic.
-        
-        # To avoid re-processing, we need to check all existing CSVs for this category.
-        existing_csv_files = sorted([f for f in os.listdir(category_output_dir) if f.startswith(EXTRACTED_CSV_BASENAME) and f.endswith('.csv')])
-        for existing_csv in existing_csv_files:
-            try:
-                full_path = os.path.join(category_output_dir, existing_csv)
-                with open(full_path, 'r', newline='', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    if reader.fieldnames and 'unique_id' in reader.fieldnames:
-                        for row in reader:
-                            if 'unique_id' in row:
-                                processed_ids_in_category.add(row['unique_id'])
-                        
-                        # Update last_csv_index and last_entry_count based on last file
-                        match = re.search(r'_(\d+)\.csv$', existing_csv)
-                        if match:
-                            idx = int(match.group(1))
-                            if idx > last_csv_index:
-                                last_csv_index = idx
-                                # Count rows in this file
-                                with open(full_path, 'r', newline='', encoding='utf-8') as temp_f:
-                                    last_entry_count = sum(1 for line in temp_f) - 1 # -1 for header
-                                if last_entry_count == 100: # If last file is full, next starts a new one
-                                    last_entry_count = 0
-                                    last_csv_index += 1
-                                    
-            except Exception as e:
-                logging.warning(f"Error reading existing CSV {full_path} for resume: {e}")
-        
-        logging.info(f"Resuming for {category_name}: Found {len(processed_ids_in_category)} already processed. Starting CSV index: {last_csv_index}, current entry count in last file: {last_entry_count}.")
-
-        entries_to_process = [entry for entry in entries_in_category if entry['unique_id'] not in processed_ids_in_category]
+        # The writer's checkpoint manifest says what an earlier run already wrote
+        writer = output_writers.get_writer(category_name, category_output_dir, fieldnames)
+        writers[category_name] = writer
+        entries_to_process = _select_entries_to_process(entries_in_category, writer.processed, reextract)
 
         if not entries_to_process:
             logging.info(f"All entries in {category_name} already processed. Skipping category.")
             continue
 
-        current_output_csv_index = last_csv_index
-        current_csv_entry_count = last_entry_count
-        current_outfile = None
-        current_writer = None
+        page_tasks = _group_entries_by_listing_page(entries_to_process, utils.get_ledger_store())
+        for chunk in _chunk_page_tasks(page_tasks, config.PHASE2_CHUNK_SIZE):
+            future_categories[executor.submit(_process_extraction_chunk, chunk)] = category_name
+        pending_count += len(entries_to_process)
 
+    # One pipeline for every category: results are routed to their category's
+    # writer as chunks finish, so a huge category doesn't hold up the others.
+    pending_chunks = metrics.gauge('phase2_pending_chunks', 'Phase 2 chunks submitted to the worker pool and not yet written.')
+    pending_chunks.set(len(future_categories))
+    try:
+        with tqdm(total=pending_count, desc="Extracting & Writing", unit="file") as pbar:
+            for future in as_completed(future_categories):
+                writer = writers[future_categories[future]]
+                rows = []
+                results, sampled_timings = future.result()
+                pending_chunks.inc(-1)
+                _record_chunk_metrics(results, sampled_timings)
+                for original_unique_id, extracted_data in results:
+                    if extracted_data == UNCHANGED:
+                        continue
+                    if extracted_data:
+                        rows.append(extracted_data)
+                    else:
+                        logging.warning(f"Skipping writing data for {original_unique_id} due to extraction errors.")
+                writer.write_many(rows)
+                pbar.update(len(results))
+    finally:
+        for writer in writers.values(): # Flush whatever is still buffered, even after an error
+            writer.close()
+
+
+def update_indexes(rebuild=False):
+    """Brings the search and facet indexes and the judgment graph up to date with the Phase 2 output (everything, with rebuild=True)."""
+    logging.info("Updating indexes over the extracted data...")
+    for index_class in (search_index.SearchIndex, facet_index.FacetIndex):
+        index = index_class()
         try:
-            with ProcessPoolExecutor(max_workers=num_processes) as executor:
-                # Use as_completed to process results as they become available
-                futures = {executor.submit(_process_single_entry_for_extraction, entry): entry['unique_id'] for entry in entries_to_process}
-                
-                with tqdm(total=len(entries_to_process), desc=f"Extracting & Writing {category_name}", unit="file") as pbar:
-                    for future in as_completed(futures):
-                        extracted_data = future.result() # This is the result from the worker process
-                        original_unique_id = futures[future] # Get original unique_id for logging
-
-                        if extracted_data:
-                            # Manage CSV file pagination
-                            if current_csv_entry_count == 0:
-                                # Close previous file if open
-                                if current_outfile:
-                                    current_outfile.close()
-                                logging.info(f"Starting new CSV file for {category_name}: {EXTRACTED_CSV_BASENAME}_{current_output_csv_index + 1}.csv")
-                                current_output_csv_index += 1
-                                output_file_name = f"{EXTRACTED_CSV_BASENAME}_{current_output_csv_index}.csv"
-                                current_file_path = os.path.join(category_output_dir, output_file_name)
-                                
-                                file_had_content = os.path.exists(current_file_path) and os.path.getsize(current_file_path) > 0
-                                
-                                current_outfile = open(current_file_path, 'a', newline='', encoding='utf-8')
-                                current_writer = csv.DictWriter(current_outfile, fieldnames=fieldnames)
-                                
-                                if not file_had_content:
-                                    current_writer.writeheader()
-                                logging.debug(f"Opened CSV {output_file_name} for writing.")
-                                current_csv_entry_count = 0 # Reset count for new file
-
-                            # Ensure all fieldnames are present in extracted_data before writing
-                            for field in fieldnames:
-                                if field not in extracted_data:
-                                    extracted_data[field] = ''
-                            
-                            current_writer.writerow(extracted_data)
-                            current_csv_entry_count += 1
-                            pbar.update(1)
-                            # logging.debug(f"Wrote {original_unique_id} to CSV. Count: {current_csv_entry_count}/{config.MAX_ENTRIES_PER_CSV}.")
-                            if current_csv_entry_count >= config.MAX_ENTRIES_PER_CSV: # Check if limit reached
-                                logging.info(f"CSV file {EXTRACTED_CSV_BASENAME}_{current_output_csv_index}.csv reached {config.MAX_ENTRIES_PER_CSV} entries.")
-                                current_outfile.close()
-                                current_outfile = None
-                                current_writer = None
-                                current_csv_entry_count = 0 # Prepare for next file
-                        else:
-                            logging.warning(f"Skipping writing data for {original_unique_id} due to extraction errors.")
-
+            index.update(rebuild=rebuild)
         finally:
-            if current_outfile: # Ensure the last opened file is closed
-                current_outfile.close()
-                logging.info(f"Last CSV file for {category_name} closed.")
-            
-    logging.info("Phase 2 complete: All categories processed.")
+            index.close()
+    judgment_graph.JudgmentGraph().update(rebuild=rebuild)
+
+
+def run_query(query, limit=None, category=None):
+    """Prints the posts best matching query, as ranked by the search index."""
+    index = search_index.SearchIndex()
+    try:
+        start = time.perf_counter()
+        results = index.search(query, limit=limit, category=category)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    finally:
+        index.close()
+    for rank, result in enumerate(results, 1):
+        print(f"{rank:>3}. {result['score']:>8.3f}  [{result['category']}] {result['title']}  ({result['unique_id']})")
+    print(f"{len(results)} results in {elapsed_ms:.1f} ms.")
+
+
+def run_facet_query(filters, counts_facet=None, limit=None):
+    """
+    Prints the posts matching every facet filter, or with counts_facet, how many
+    of them have each value of that facet.
+
+    Args:
+        filters (list): 'Facet=value' strings; repeating a facet matches any of its values.
+    """
+    conditions = {}
+    for condition in filters:
+        facet, separator, value = condition.partition('=')
+        if not separator:
+            raise ValueError(f"Facet filter '{condition}' should look like Facet=value.")
+        conditions.setdefault(facet.strip(), []).append(value.strip())
+
+    index = facet_index.FacetIndex()
+    try:
+        start = time.perf_counter()
+        doc_ids = index.filter(conditions) if conditions else None
+        if counts_facet:
+            counts = index.counts(counts_facet, doc_ids, limit=limit)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            for label, count in counts:
+                print(f"{count:>7}  {label}")
+            print(f"{len(counts)} values of {counts_facet} in {elapsed_ms:.1f} ms.")
+            return
+        if doc_ids is None:
+            raise ValueError("Give at least one --where filter, or --counts.")
+        matches = index.unique_ids(doc_ids[:limit] if limit else doc_ids)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    finally:
+        index.close()
+    for unique_id, category_name in matches:
+        print(f"[{category_name}] {unique_id}")
+    print(f"{len(doc_ids)} matching posts in {elapsed_ms:.1f} ms.")
+
+
+def run_graph_query(post=None, hops=1, direction='out', kinds=None, limit=None):
+    """
+    Prints the judgments within hops links of post (a unique_id or URL), or
+    without a post, the most referenced judgments.
+    """
+    graph = judgment_graph.JudgmentGraph()
+    start = time.perf_counter()
+    if post is None:
+        results = graph.most_referenced(limit=limit or config.SEARCH_RESULTS_LIMIT, kinds=kinds)
+        label = "links in"
+    else:
+        if graph.node_id(post) is None:
+            print(f"{post} is not in the judgment graph.")
+            return
+        results = graph.k_hop(post, k=hops, direction=direction, kinds=kinds)[:limit]
+        label = "hops"
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for node, value in results:
+        status = node['category'] or 'not extracted'
+        print(f"{value:>4} {label}  [{status}] {node['title'] or node['url']}  ({node['unique_id']})")
+    print(f"{len(results)} judgments in {elapsed_ms:.1f} ms ({len(graph)} nodes, {graph.edge_count} links in the graph).")
 
 
 def main():
     utils.setup_logging()
 
     parser_main = argparse.ArgumentParser(description="Run ITAT Judgment Scraper and Extractor.")
-    parser_main.add_argument('phase', choices=['1', '2'], help="Choose which phase to run: '1' for Data Collection, '2' for Data Extraction.")
+    parser_main.add_argument('phase', choices=['1', '2', 'stream', 'index', 'query', 'facets', 'graph'], help="Choose which phase to run: '1' for Data Collection, '2' for Data Extraction, 'stream' for both at once (posts are extracted as they are fetched), 'index' to update the indexes over extracted data, 'query' to search it, 'facets' to filter or count it by facet, 'graph' to explore links between judgments.")
+    parser_main.add_argument('query', nargs='?', help="query: words to rank posts by; wrap a \"phrase\" in quotes to require it. graph: the unique_id or URL of a post (leave out to list the most referenced judgments).")
+    parser_main.add_argument('--incremental', action='store_true', help="Phase 1 and stream: fetch just the posts that are newer than everything in the ledger.")
+    parser_main.add_argument('--crawlers', type=int, default=1, help="Phase 1 only: crawler processes to run on this machine, sharing the crawl frontier.")
+    parser_main.add_argument('--join', action='store_true', help="Phase 1 only: join a crawl another node seeded (shared frontier, ledger and data folder) instead of seeding one.")
+    parser_main.add_argument('--reextract', action='store_true', help="Phase 2 only: also redo rows from an older parser version or whose page HTML changed.")
+    parser_main.add_argument('--rebuild', action='store_true', help="index only: rebuild the indexes from scratch instead of updating them.")
+    parser_main.add_argument('--limit', type=int, help="query, facets and graph: number of results to print.")
+    parser_main.add_argument('--category', help="query only: restrict results to one category.")
+    parser_main.add_argument('--where', action='append', default=[], metavar='FACET=VALUE',
+                             help=f"facets only: keep posts with this value, e.g. Section_Involved=14A (facets: {', '.join(facet_index.FACETS)}). Repeat to combine; the same facet twice matches either value.")
+    parser_main.add_argument('--counts', metavar='FACET', help="facets only: count the matching posts per value of FACET instead of listing them.")
+    parser_main.add_argument('--hops', type=int, default=1, help="graph only: how many links away from the post to look.")
+    parser_main.add_argument('--direction', choices=['out', 'in', 'both'], default='out', help="graph only: follow links from the post (out), to it (in) or both.")
+    parser_main.add_argument('--kind', action='append', choices=judgment_graph.EDGE_KINDS, help="graph only: follow just this kind of link; repeat for several (default: all).")
     args = parser_main.parse_args()
 
     try:
         if args.phase == '1':
-            run_phase1_data_collection()
+            if args.crawlers > 1 and args.incremental:
+                parser_main.error("--crawlers is for full crawls; --incremental walks each category in order.")
+            run_phase1_data_collection(incremental=args.incremental, crawlers=args.crawlers, join=args.join)
         elif args.phase == '2':
             # Add a new constant for max entries per CSV
             if not hasattr(config, 'MAX_ENTRIES_PER_CSV'):
                 config.MAX_ENTRIES_PER_CSV = 100 # Default if not in config.py
                 logging.warning(f"MAX_ENTRIES_PER_CSV not found in config.py, defaulting to {config.MAX_ENTRIES_PER_CSV}")
-            run_phase2_data_extraction()
+            run_phase2_data_extraction(reextract=args.reextract)
+        elif args.phase == 'stream':
+            run_streaming_pipeline(incremental=args.incremental)
+        elif args.phase == 'index':
+            update_indexes(rebuild=args.rebuild)
+        elif args.phase == 'query':
+            if not args.query:
+                parser_main.error("query needs the text to search for, e.g. main.py query '\"section 14A\" disallowance'")
+            run_query(args.query, limit=args.limit, category=args.category)
+        elif args.phase == 'facets':
+            if not args.where and not args.counts:
+                parser_main.error("give at least one --where filter, or --counts")
+            malformed = [condition for condition in args.where if '=' not in condition]
+            if malformed:
+                parser_main.error(f"--where {malformed[0]!r} should look like FACET=VALUE")
+            facets = [condition.partition('=')[0].strip() for condition in args.where] + ([args.counts] if args.counts else [])
+            unknown = [facet for facet in facets if facet not in facet_index.FACETS]
+            if unknown:
+                parser_main.error(f"unknown facet {unknown[0]!r}; choose from: {', '.join(facet_index.FACETS)}")
+            run_facet_query(args.where, counts_facet=args.counts, limit=args.limit)
+        elif args.phase == 'graph':
+            run_graph_query(args.query, hops=args.hops, direction=args.direction, kinds=args.kind, limit=args.limit)
     except Exception as e:
         logging.critical(f"An unhandled error occurred in main execution: {e}", exc_info=True)
 
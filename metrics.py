@@ -0,0 +1,209 @@
+# shunyatax/metrics.py
+
+import os
+import json
+import time
+import random
+import logging
+from bisect import bisect_left
+
+import config
+
+# In-process counters, gauges and histograms for the crawl and extraction hot
+# paths, exported as a snapshot file (config.METRICS_FILE) in Prometheus text
+# format or as JSON (config.METRICS_FORMAT).
+#
+# Recording is a dict lookup and an addition, so the fetch and write paths record
+# every event. Per-stage parse timings cost a few clock reads per document and
+# are only taken for a config.METRICS_SAMPLE_RATE fraction of documents (see
+# sampled()). Phase 2 workers run in other processes: they send their sampled
+# timings back with each chunk's results and main records them here.
+#
+# A run calls maybe_write_snapshot() as it goes, which rewrites the file at most
+# every config.METRICS_EXPORT_INTERVAL seconds, and write_snapshot() when it ends.
+
+PREFIX = 'shunyatax_'
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PARSE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+WRITE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """Counts observations per bucket (upper bounds), plus their sum and count."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1) # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(upper bound, observations <= it)], ending with ('+Inf', count)."""
+        running = 0
+        buckets = []
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            running += count
+            buckets.append((bound, running))
+        return buckets
+
+
+class Registry:
+    """
+    Metric families by name. Each family has one metric per set of label values:
+    registry.counter('fetch_responses_total', 'Responses by status.', status='200').
+    """
+
+    def __init__(self):
+        self._families = {} # name -> {'type', 'help', 'buckets', 'metrics': {labels: metric}}
+        self.started = time.time()
+
+    def _metric(self, kind, name, help_text, labels, buckets=None):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = {'type': kind, 'help': help_text, 'buckets': buckets, 'metrics': {}}
+        elif family['type'] != kind:
+            raise ValueError(f"Metric {name} is a {family['type']}, not a {kind}.")
+        key = tuple(sorted(labels.items()))
+        metric = family['metrics'].get(key)
+        if metric is None:
+            metric = family['metrics'][key] = Histogram(family['buckets']) if kind == 'histogram' else (Counter() if kind == 'counter' else Gauge())
+        return metric
+
+    def counter(self, name, help_text='', **labels):
+        return self._metric('counter', name, help_text, labels)
+
+    def gauge(self, name, help_text='', **labels):
+        return self._metric('gauge', name, help_text, labels)
+
+    def histogram(self, name, help_text='', buckets=LATENCY_BUCKETS, **labels):
+        return self._metric('histogram', name, help_text, labels, buckets)
+
+    def snapshot(self):
+        """Every metric's current value as a JSON-serialisable dict."""
+        families = {}
+        for name, family in sorted(self._families.items()):
+            values = []
+            for labels, metric in sorted(family['metrics'].items()):
+                entry = {'labels': dict(labels)}
+                if family['type'] == 'histogram':
+                    entry.update(sum=metric.sum, count=metric.count,
+                                 buckets={str(bound): count for bound, count in metric.cumulative()})
+                else:
+                    entry['value'] = metric.value
+                values.append(entry)
+            families[PREFIX + name] = {'type': family['type'], 'help': family['help'], 'values': values}
+        return {'time': time.time(), 'uptime_seconds': round(time.time() - self.started, 3), 'metrics': families}
+
+    def to_prometheus(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, family in sorted(self._families.items()):
+            full_name = PREFIX + name
+            lines.append(f"# HELP {full_name} {family['help']}")
+            lines.append(f"# TYPE {full_name} {family['type']}")
+            for labels, metric in sorted(family['metrics'].items()):
+                if family['type'] != 'histogram':
+                    lines.append(f"{full_name}{_format_labels(labels)} {metric.value}")
+                    continue
+                for bound, count in metric.cumulative():
+                    lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {metric.sum}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {metric.count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+REGISTRY = Registry()
+_last_export = time.monotonic()
+
+
+def counter(name, help_text='', **labels):
+    return REGISTRY.counter(name, help_text, **labels)
+
+
+def gauge(name, help_text='', **labels):
+    return REGISTRY.gauge(name, help_text, **labels)
+
+
+def histogram(name, help_text='', buckets=LATENCY_BUCKETS, **labels):
+    return REGISTRY.histogram(name, help_text, buckets, **labels)
+
+
+def sampled():
+    """True for a config.METRICS_SAMPLE_RATE fraction of calls; decides which documents get timed."""
+    return config.METRICS_SAMPLE_RATE > 0 and random.random() < config.METRICS_SAMPLE_RATE
+
+
+def record_parse_timings(timings_list):
+    """Records per-document stage timings (dicts from parser.extract_judgment_data's timings)."""
+    for timings in timings_list:
+        for stage, seconds in timings.items():
+            REGISTRY.histogram('parse_stage_seconds', 'Seconds per sampled document in each extraction stage.',
+                               PARSE_BUCKETS, stage=stage).observe(seconds)
+
+
+def write_snapshot(path=None, output_format=None):
+    """Writes every metric to path (default config.METRICS_FILE); does nothing if that is None."""
+    global _last_export
+    path = path or config.METRICS_FILE
+    if not path:
+        return
+    output_format = output_format or config.METRICS_FORMAT
+    if output_format == 'json':
+        text = json.dumps(REGISTRY.snapshot(), indent=2)
+    elif output_format == 'prometheus':
+        text = REGISTRY.to_prometheus()
+    else:
+        raise ValueError(f"Unknown metrics format '{output_format}' (expected 'prometheus' or 'json').")
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, path) # Readers never see a half-written snapshot
+    except OSError as e:
+        logging.warning(f"Could not write metrics snapshot {path}: {e}")
+    _last_export = time.monotonic()
+
+
+def maybe_write_snapshot():
+    """Writes a snapshot if config.METRICS_EXPORT_INTERVAL seconds have passed since the last one."""
+    if time.monotonic() - _last_export >= config.METRICS_EXPORT_INTERVAL:
+        write_snapshot()
@@ -0,0 +1,532 @@
+# shunyatax/output_writers.py
+
+import os
+import re
+import csv
+import gzip
+import json
+import time
+import logging
+
+import config
+import metrics
+import parser
+
+# Phase 2 keeps one writer per category. Rows are buffered in memory and
+# written in bulk; each writer rolls its own shards over at
+# config.MAX_ENTRIES_PER_CSV rows, so categories never wait on one another.
+#
+# config.OUTPUT_FORMAT picks the layout of a category folder:
+#   'csv'   - extracted_N.csv, every field in one row (JSON-encoded list fields)
+#   'jsonl' - metadata_N.jsonl, one JSON object per row with list fields as real
+#             lists and no Full_Text, plus fulltext_N.jsonl.gz holding
+#             {unique_id, Full_Text} for the same rows; metadata readers never
+#             touch the text.
+# iter_rows() reads either layout back.
+
+EXTRACTED_CSV_BASENAME = 'extracted' # Files are extracted_1.csv, extracted_2.csv, ...
+
+# Resume state lives next to the shards, so a restart never re-reads extracted text:
+#   manifest.json - format, fieldnames, rows and file sizes of every shard, how much
+#                   of manifest.ids is committed, and rows waiting to be dropped
+#                   because they were re-extracted; replaced atomically after every flush
+#   manifest.ids  - one line per written row: unique_id, shard, parser_version and
+#                   html_hash, tab-separated and append-only (the last line for an ID wins)
+# Anything written after the last manifest (a crash mid-flush) is cut off on resume
+# and those posts are simply extracted again.
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_IDS_FILE = 'manifest.ids'
+
+# Fields the parser stores as JSON strings; the jsonl format writes them as lists.
+LIST_FIELDS = [field for _, field, kind in parser.TABLE_FIELD_SPECS if kind == 'list'] + ['Comments', 'Related_Judgements']
+# Fields kept out of jsonl metadata, in the compressed text shards.
+TEXT_FIELDS = ['Full_Text']
+
+
+class CategoryWriter:
+    """
+    Buffered, sharded output for one category, with a checkpoint manifest.
+    Subclasses define the shard files and how rows are written to them.
+
+    Args:
+        category_name (str): Used for log messages.
+        output_dir (str): The category's folder under config.OUTPUT_DIR.
+        fieldnames (list): Output columns; fields missing from a row are written empty.
+        buffer_size (int, optional): Rows held before a flush; defaults to config.OUTPUT_BUFFER_ROWS.
+
+    processed maps every unique_id already written (as of the last checkpoint) to
+    its (shard, parser_version, html_hash). Writing a row for an ID that is already
+    there replaces the old row; the old one is dropped from its shard on close().
+    """
+
+    format_name = None
+    shard_patterns = [] # Regexes matching this format's shard file names; group 1 is the shard number
+
+    def __init__(self, category_name, output_dir, fieldnames, buffer_size=None):
+        self.category_name = category_name
+        self.output_dir = output_dir
+        self.fieldnames = fieldnames
+        self.buffer_size = buffer_size or config.OUTPUT_BUFFER_ROWS
+        self.max_rows = config.MAX_ENTRIES_PER_CSV
+        self.rows_written = 0
+        self.processed = {}
+        self._shards = {} # Shard number -> {'rows': data rows, 'bytes': {file name: size}}
+        self._superseded = {} # Shard number -> unique_ids whose row there has been replaced
+        self._shard_fieldnames = None
+        self._ids_bytes = 0
+        self._buffer = []
+        os.makedirs(output_dir, exist_ok=True)
+        self._manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+        self._ids_path = os.path.join(output_dir, MANIFEST_IDS_FILE)
+        if os.path.exists(self._manifest_path):
+            self._load_checkpoint()
+        else:
+            self._rebuild_checkpoint()
+        self._shard_index = max(self._shards, default=0)
+        self._rows_in_shard = self._shards[self._shard_index]['rows'] if self._shards else 0
+        if self._shards and self._shard_fieldnames != fieldnames:
+            # Columns changed since the last shard was written; don't append to it.
+            self._rows_in_shard = self.max_rows
+        if self._superseded:
+            self._drop_superseded_rows()
+
+    # -- Format hooks --
+
+    def shard_files(self, index):
+        """File names making up shard index; the first holds the row metadata."""
+        raise NotImplementedError
+
+    def _append_rows(self, index, rows):
+        """Appends rows to shard index and returns {file name: size} afterwards."""
+        raise NotImplementedError
+
+    def _read_shard(self, index):
+        """Returns (fieldnames, rows as dicts) of a shard's metadata, for rebuilding a checkpoint."""
+        raise NotImplementedError
+
+    def _filter_shard(self, index, keep):
+        """
+        Rewrites shard index keeping only rows where keep(position, unique_id) is true.
+        Returns (rows kept, {file name: size}).
+        """
+        raise NotImplementedError
+
+    # -- Checkpoint --
+
+    def _existing_shards(self):
+        """{shard number: [file names]} of this format's shard files in output_dir."""
+        shards = {}
+        for file_name in os.listdir(self.output_dir):
+            for pattern in self.shard_patterns:
+                match = pattern.match(file_name)
+                if match:
+                    shards.setdefault(int(match.group(1)), []).append(file_name)
+        return shards
+
+    def _load_checkpoint(self):
+        with open(self._manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        output_format = manifest.get('format', 'csv')
+        if output_format != self.format_name:
+            raise ValueError(f"{self.output_dir} holds '{output_format}' output; set OUTPUT_FORMAT to match or use another OUTPUT_DIR.")
+        self._shards = {}
+        for index, shard in manifest['shards'].items():
+            sizes = shard['bytes']
+            if isinstance(sizes, int): # Manifests from before multi-file shards
+                sizes = {self.shard_files(int(index))[0]: sizes}
+            self._shards[int(index)] = {'rows': shard['rows'], 'bytes': sizes}
+        self._ids_bytes = manifest['ids_bytes']
+        self._shard_fieldnames = manifest.get('fieldnames')
+        self._superseded = {int(index): set(ids) for index, ids in manifest.get('superseded', {}).items()}
+
+        # Cut every file back to what the manifest vouches for.
+        for index, file_names in self._existing_shards().items():
+            for file_name in file_names:
+                path = os.path.join(self.output_dir, file_name)
+                if index not in self._shards:
+                    logging.warning(f"Removing {path}: it was started after the last checkpoint.")
+                    os.remove(path)
+                    continue
+                size = self._shards[index]['bytes'].get(file_name, 0)
+                if os.path.getsize(path) > size:
+                    logging.warning(f"Truncating {path} to its last checkpoint ({self._shards[index]['rows']} rows).")
+                    os.truncate(path, size)
+        if os.path.exists(self._ids_path):
+            if os.path.getsize(self._ids_path) > self._ids_bytes:
+                os.truncate(self._ids_path, self._ids_bytes)
+            for unique_id, stamp in read_id_log(self.output_dir):
+                self.processed[unique_id] = stamp
+        logging.info(f"Resuming {self.category_name} from checkpoint: {len(self.processed)} processed in {len(self._shards)} shards.")
+
+    def _rebuild_checkpoint(self):
+        """Builds the manifest from existing shards once (output from before manifests existed)."""
+        existing = self._existing_shards()
+        if not existing:
+            return
+        id_lines = []
+        for index in sorted(existing):
+            rows = []
+            try:
+                self._shard_fieldnames, rows = self._read_shard(index)
+            except Exception as e:
+                logging.warning(f"Error reading existing shard {index} in {self.output_dir} for resume: {e}")
+            for row in rows:
+                if row.get('unique_id'):
+                    stamp = (index, int(row.get('parser_version') or 0), row.get('html_hash') or '')
+                    self.processed[row['unique_id']] = stamp
+                    id_lines.append(self._id_line(row['unique_id'], stamp))
+            sizes = {file_name: os.path.getsize(os.path.join(self.output_dir, file_name)) for file_name in existing[index]}
+            self._shards[index] = {'rows': len(rows), 'bytes': sizes}
+        with open(self._ids_path, 'w', encoding='utf-8') as f:
+            f.writelines(id_lines)
+            self._ids_bytes = f.tell()
+        self._write_manifest()
+        logging.info(f"Built checkpoint manifest for {self.category_name} from {len(existing)} existing shards ({len(id_lines)} rows).")
+
+    @staticmethod
+    def _id_line(unique_id, stamp):
+        shard, parser_version, html_hash = stamp
+        return f"{unique_id}\t{shard}\t{parser_version}\t{html_hash or '-'}\n"
+
+    def _write_manifest(self):
+        manifest = {
+            'format': self.format_name,
+            'fieldnames': self._shard_fieldnames,
+            'shards': {str(index): shard for index, shard in sorted(self._shards.items())},
+            'ids_bytes': self._ids_bytes,
+            'superseded': {str(index): sorted(ids) for index, ids in self._superseded.items()},
+        }
+        temp_path = f"{self._manifest_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self._manifest_path)
+
+    def _drop_superseded_rows(self):
+        """
+        Rewrites each shard holding replaced rows without them. A row is kept only
+        if it is the latest copy of its unique_id (the last one in the shard the
+        manifest points to), so running this twice is harmless.
+        """
+        for index, unique_ids in sorted(self._superseded.items()):
+            if index not in self._shards:
+                continue
+            _, rows = self._read_shard(index)
+            last_position = {row['unique_id']: position for position, row in enumerate(rows)}
+
+            def keep(position, unique_id):
+                if unique_id not in unique_ids:
+                    return True
+                return self.processed.get(unique_id, (None,))[0] == index and last_position.get(unique_id) == position
+
+            kept, sizes = self._filter_shard(index, keep)
+            self._shards[index] = {'rows': kept, 'bytes': sizes}
+            if not kept and index != self._shard_index:
+                for file_name in self.shard_files(index):
+                    path = os.path.join(self.output_dir, file_name)
+                    if os.path.exists(path):
+                        os.remove(path)
+                del self._shards[index]
+            logging.info(f"Dropped {len(rows) - kept} re-extracted rows from shard {index} of {self.category_name}.")
+        self._superseded = {}
+        self._write_manifest()
+
+    # -- Writing --
+
+    def write(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_many(self, rows):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes every buffered row, starting a new shard whenever the current one is
+        full, then records the rows in the checkpoint manifest.
+        """
+        if not self._buffer:
+            return
+        started = time.perf_counter()
+        row_count = len(self._buffer)
+        id_lines = []
+        while self._buffer:
+            if self._shard_index == 0 or self._rows_in_shard >= self.max_rows:
+                self._shard_index += 1
+                self._rows_in_shard = 0
+                logging.info(f"Starting new shard for {self.category_name}: {self.shard_files(self._shard_index)[0]}")
+            room = self.max_rows - self._rows_in_shard
+            batch, self._buffer = self._buffer[:room], self._buffer[room:]
+            sizes = self._append_rows(self._shard_index, batch)
+            self._rows_in_shard += len(batch)
+            self.rows_written += len(batch)
+            self._shards[self._shard_index] = {'rows': self._rows_in_shard, 'bytes': sizes}
+            self._shard_fieldnames = self.fieldnames
+            logging.debug(f"Wrote {len(batch)} rows to shard {self._shard_index} of {self.category_name} ({self._rows_in_shard}/{self.max_rows}).")
+
+            for row in batch:
+                unique_id = row['unique_id']
+                previous = self.processed.get(unique_id)
+                if previous is not None:
+                    # Older output didn't record a row's shard; check all of them then.
+                    for shard in [previous[0]] if previous[0] is not None else list(self._shards):
+                        self._superseded.setdefault(shard, set()).add(unique_id)
+                stamp = (self._shard_index, row.get('parser_version') or 0, row.get('html_hash') or '')
+                self.processed[unique_id] = stamp
+                id_lines.append(self._id_line(unique_id, stamp))
+
+        with open(self._ids_path, 'a', encoding='utf-8') as f:
+            f.writelines(id_lines)
+            self._ids_bytes = f.tell()
+        self._write_manifest()
+        metrics.counter('output_rows_written_total', 'Rows written to the Phase 2 output, by category.', category=self.category_name).inc(row_count)
+        metrics.histogram('output_flush_seconds', 'Seconds per writer flush (shards, id log and manifest).',
+                          metrics.WRITE_BUCKETS, format=self.format_name).observe(time.perf_counter() - started)
+
+    def close(self):
+        self.flush()
+        if self._superseded:
+            self._drop_superseded_rows()
+        if self.rows_written:
+            logging.info(f"Wrote {self.rows_written} rows for {self.category_name}; last shard is {self.shard_files(self._shard_index)[0]}.")
+
+
+class CategoryCsvWriter(CategoryWriter):
+    """extracted_N.csv shards, one row per post with every field."""
+
+    format_name = 'csv'
+    shard_patterns = [re.compile(rf'^{EXTRACTED_CSV_BASENAME}_(\d+)\.csv$')]
+
+    def shard_files(self, index):
+        return [f"{EXTRACTED_CSV_BASENAME}_{index}.csv"]
+
+    def csv_path(self, index):
+        return os.path.join(self.output_dir, self.shard_files(index)[0])
+
+    def _append_rows(self, index, rows):
+        path = self.csv_path(index)
+        file_had_content = os.path.exists(path) and os.path.getsize(path) > 0
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames, restval='')
+            if not file_had_content:
+                writer.writeheader()
+            writer.writerows(rows)
+            return {self.shard_files(index)[0]: f.tell()}
+
+    def _read_shard(self, index):
+        with open(self.csv_path(index), 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+            return reader.fieldnames, rows
+
+    def _filter_shard(self, index, keep):
+        path = self.csv_path(index)
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            rows = list(reader)
+        if not header or 'unique_id' not in header:
+            return len(rows), {self.shard_files(index)[0]: os.path.getsize(path)}
+        id_column = header.index('unique_id')
+        kept = [row for position, row in enumerate(rows) if keep(position, row[id_column])]
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(kept)
+            file_size = f.tell()
+        os.replace(temp_path, path)
+        return len(kept), {self.shard_files(index)[0]: file_size}
+
+
+class CategoryJsonlWriter(CategoryWriter):
+    """
+    metadata_N.jsonl shards with typed list fields, and the matching
+    fulltext_N.jsonl.gz shards holding the TEXT_FIELDS. Each flush appends one
+    gzip member, so a text shard can be cut back to any checkpoint.
+    """
+
+    format_name = 'jsonl'
+    shard_patterns = [re.compile(r'^metadata_(\d+)\.jsonl$'), re.compile(r'^fulltext_(\d+)\.jsonl\.gz$')]
+
+    def shard_files(self, index):
+        return [f"metadata_{index}.jsonl", f"fulltext_{index}.jsonl.gz"]
+
+    def _paths(self, index):
+        return [os.path.join(self.output_dir, file_name) for file_name in self.shard_files(index)]
+
+    def _split_row(self, row):
+        """Returns (metadata record, text record) for one extracted row."""
+        metadata = {}
+        for field in self.fieldnames:
+            if field in TEXT_FIELDS:
+                continue
+            value = row.get(field, '')
+            if field in LIST_FIELDS:
+                value = json.loads(value) if value else []
+            metadata[field] = value
+        text = {'unique_id': row['unique_id']}
+        text.update((field, row.get(field, '')) for field in TEXT_FIELDS)
+        return metadata, text
+
+    def _append_rows(self, index, rows):
+        metadata_path, text_path = self._paths(index)
+        records = [self._split_row(row) for row in rows]
+        with open(metadata_path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(metadata, ensure_ascii=False) + '\n' for metadata, _ in records)
+            metadata_size = f.tell()
+        with open(text_path, 'ab') as f:
+            f.write(gzip.compress(''.join(json.dumps(text, ensure_ascii=False) + '\n' for _, text in records).encode('utf-8'),
+                                  compresslevel=config.TEXT_COMPRESSION_LEVEL))
+            text_size = f.tell()
+        metadata_name, text_name = self.shard_files(index)
+        return {metadata_name: metadata_size, text_name: text_size}
+
+    def _read_shard(self, index):
+        rows = list(_read_jsonl(self._paths(index)[0]))
+        return self._shard_fieldnames or self.fieldnames, rows
+
+    def _filter_shard(self, index, keep):
+        metadata_path, text_path = self._paths(index)
+        metadata_rows = list(_read_jsonl(metadata_path))
+        text_rows = list(_read_jsonl(text_path, compressed=True)) if os.path.exists(text_path) else []
+        kept_metadata = [row for position, row in enumerate(metadata_rows) if keep(position, row['unique_id'])]
+        kept_text = [row for position, row in enumerate(text_rows) if keep(position, row['unique_id'])]
+        sizes = {}
+        for path, rows, compressed in ((metadata_path, kept_metadata, False), (text_path, kept_text, True)):
+            temp_path = f"{path}.tmp"
+            data = ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+            with open(temp_path, 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=config.TEXT_COMPRESSION_LEVEL) if compressed else data)
+                sizes[os.path.basename(path)] = f.tell()
+            os.replace(temp_path, path)
+        return len(kept_metadata), sizes
+
+
+_WRITERS = {'csv': CategoryCsvWriter, 'jsonl': CategoryJsonlWriter}
+
+
+def get_writer(category_name, output_dir, fieldnames, buffer_size=None, output_format=None):
+    """Returns a writer for config.OUTPUT_FORMAT (or output_format)."""
+    output_format = output_format or config.OUTPUT_FORMAT
+    if output_format not in _WRITERS:
+        raise ValueError(f"Unknown output format '{output_format}'. Choose from: {', '.join(_WRITERS)}")
+    return _WRITERS[output_format](category_name, output_dir, fieldnames, buffer_size)
+
+
+# -- Reading --
+
+def _read_jsonl(path, compressed=False):
+    with (gzip.open(path, 'rt', encoding='utf-8') if compressed else open(path, 'r', encoding='utf-8')) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_manifest(category_dir):
+    """Returns a category folder's manifest as a dict (format defaults to 'csv'), or None if it has none."""
+    manifest_path = os.path.join(category_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest.setdefault('format', 'csv')
+    return manifest
+
+
+def read_id_log(category_dir, start=0, end=None):
+    """
+    Yields (unique_id, (shard, parser_version, html_hash)) for each line of a
+    category's manifest.ids between byte offsets start and end (default: the end
+    of the file). Lines from before rows were stamped have shard None and version 0.
+    """
+    ids_path = os.path.join(category_dir, MANIFEST_IDS_FILE)
+    if not os.path.exists(ids_path):
+        return
+    with open(ids_path, 'rb') as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(max(end - start, 0))
+    for line in data.decode('utf-8').splitlines():
+        fields = line.split()
+        if len(fields) == 4:
+            yield fields[0], (int(fields[1]), int(fields[2]), '' if fields[3] == '-' else fields[3])
+        elif fields:
+            yield fields[0], (None, 0, '')
+
+
+def iter_shard_rows(category_dir, output_format, index, with_text=True):
+    """Yields the rows of one shard as dicts; see iter_rows()."""
+    if output_format == 'csv':
+        path = os.path.join(category_dir, f"{EXTRACTED_CSV_BASENAME}_{index}.csv")
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                for field in LIST_FIELDS:
+                    if field in row:
+                        row[field] = json.loads(row[field]) if row[field] else []
+                if not with_text:
+                    for field in TEXT_FIELDS:
+                        row.pop(field, None)
+                yield row
+    else:
+        metadata_path = os.path.join(category_dir, f"metadata_{index}.jsonl")
+        text_path = os.path.join(category_dir, f"fulltext_{index}.jsonl.gz")
+        if not os.path.exists(metadata_path):
+            return
+        texts = {}
+        if with_text and os.path.exists(text_path):
+            texts = {row.pop('unique_id'): row for row in _read_jsonl(text_path, compressed=True)}
+        for row in _read_jsonl(metadata_path):
+            if with_text:
+                row.update(texts.get(row['unique_id'], {}))
+            yield row
+
+
+def read_rows_since(category_dir, manifest, start=0, with_text=True):
+    """
+    Returns {unique_id: row} with the current row of every post logged in a
+    category's manifest.ids from byte offset start up to the manifest's
+    checkpoint. Only the shards holding those rows are read, which is how the
+    indexes catch up with new output without rescanning a category.
+    """
+    # The last line for an ID names the shard holding its current row.
+    latest = dict(read_id_log(category_dir, start, manifest['ids_bytes']))
+    shards = {stamp[0] for stamp in latest.values()}
+    if None in shards: # Unstamped output: the row may be in any shard
+        shards = {int(index) for index in manifest['shards']}
+    rows = {}
+    for index in sorted(shards):
+        for row in iter_shard_rows(category_dir, manifest['format'], index, with_text):
+            stamp = latest.get(row.get('unique_id'))
+            if stamp and stamp[0] in (index, None):
+                rows[row['unique_id']] = row
+    return rows
+
+
+def iter_rows(category_dir, with_text=True):
+    """
+    Yields the extracted rows of one category folder as dicts, whichever format
+    wrote them. List fields come back as lists in both formats. With
+    with_text=False the TEXT_FIELDS are left out, and jsonl output never opens
+    its text shards.
+    """
+    manifest = read_manifest(category_dir)
+    if manifest is None:
+        return
+    for index in sorted(int(index) for index in manifest['shards']):
+        yield from iter_shard_rows(category_dir, manifest['format'], index, with_text)
+
+
+def iter_all_rows(output_dir=None, with_text=True):
+    """Yields (category, row) for every category folder under output_dir (default: config.OUTPUT_DIR)."""
+    output_dir = output_dir or config.OUTPUT_DIR
+    if not os.path.isdir(output_dir):
+        return
+    for category_name in sorted(os.listdir(output_dir)):
+        category_dir = os.path.join(output_dir, category_name)
+        if os.path.isdir(category_dir):
+            for row in iter_rows(category_dir, with_text):
+                yield category_name, row
@@ -0,0 +1,311 @@
+# shunyatax/pack_store.py
+
+import os
+import mmap
+import glob
+import zlib
+import struct
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows
+    fcntl = None
+
+import config
+
+# Pack files hold many compressed detail pages back to back, WARC-style:
+#
+#     [magic 'SHPK'][16-byte unique_id][payload length][zlib payload] ...
+#
+# so a pack can always be re-indexed by scanning it. Lookups go through an
+# offset index of fixed-size records (unique_id, pack number, payload offset,
+# payload length). index.bin is kept sorted by unique_id and is binary-searched
+# through an mmap; records appended since the last compaction live in
+# index.journal, which is small and read into a dict.
+#
+# Several processes (e.g. Phase 1 crawler processes) can append to one archive:
+# appends and compactions hold an exclusive flock on index.lock, catch up with
+# the journal records other processes wrote, and take a record's offset from
+# the end of the pack file as it is on disk. A compaction merges the whole
+# on-disk journal. Where fcntl is missing (Windows) only one process may write.
+
+RECORD_MAGIC = b'SHPK'
+RECORD_HEADER = struct.Struct('>4s16sI')
+INDEX_ENTRY = struct.Struct('>16sIQI')
+
+PACK_REF_PREFIX = 'pack://'
+
+
+def pack_ref(unique_id):
+    """Returns the ledger file_path used for a post stored in a pack."""
+    return f"{PACK_REF_PREFIX}{unique_id}"
+
+
+def is_pack_ref(file_path):
+    return file_path.startswith(PACK_REF_PREFIX)
+
+
+class PackStore:
+    """
+    Append-only pack archive of raw HTML keyed by unique_id.
+
+    Writes are serialised with a thread lock and, where fcntl is available, a
+    file lock, so threads and processes can append safely. A lookup that misses
+    first picks up records other processes appended.
+    Reads mmap the pack files and decompress straight from the mapped slice.
+    """
+
+    def __init__(self, pack_dir=None):
+        self.pack_dir = pack_dir or config.PACK_DIR
+        os.makedirs(self.pack_dir, exist_ok=True)
+        self.index_path = os.path.join(self.pack_dir, 'index.bin')
+        self.journal_path = os.path.join(self.pack_dir, 'index.journal')
+        self._lock_path = os.path.join(self.pack_dir, 'index.lock')
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._journal = {}
+        self._journal_bytes = 0 # How much of index.journal self._journal holds
+        self._index_stat = None # Identity of the index.bin self._index_map was loaded from
+        self._index_map = None
+        self._index_count = 0
+        self._pack_maps = {}
+        self._pack_file = None
+        self._pack_number = None
+        self._load_index()
+
+    # -- Index --
+
+    def _load_index(self):
+        self._close_maps()
+        self._index_stat = _file_identity(self.index_path)
+        if self._index_stat and self._index_stat[1] > 0:
+            with open(self.index_path, 'rb') as f:
+                self._index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index_count = len(self._index_map) // INDEX_ENTRY.size
+        self._journal = {}
+        self._journal_bytes = 0
+        self._read_journal()
+
+    def _read_journal(self):
+        """Adds the journal records written since self._journal_bytes."""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._journal_bytes)
+            data = f.read()
+        # A crash mid-append can leave a partial trailing record; ignore it.
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for key, pack_number, offset, length in INDEX_ENTRY.iter_unpack(data[:usable]):
+            self._journal[key] = (pack_number, offset, length)
+        self._journal_bytes += usable
+
+    def _refresh(self):
+        """Catches up with records other processes appended, or a compaction they ran, since the last look."""
+        journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if _file_identity(self.index_path) != self._index_stat or journal_size < self._journal_bytes:
+            self._load_index()
+        elif journal_size > self._journal_bytes:
+            self._read_journal()
+
+    @contextmanager
+    def _write_lock(self):
+        """Holds the thread lock and, where fcntl is available, the archive's file lock."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            if self._lock_file is None:
+                self._lock_file = open(self._lock_path, 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _search_index(self, key):
+        lo, hi = 0, self._index_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mid * INDEX_ENTRY.size
+            mid_key = self._index_map[start:start + 16]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                _, pack_number, offset, length = INDEX_ENTRY.unpack_from(self._index_map, start)
+                return pack_number, offset, length
+        return None
+
+    def _locate(self, key):
+        location = self._journal.get(key)
+        if location is None and self._index_map is not None:
+            location = self._search_index(key)
+        return location
+
+    def locate(self, unique_id):
+        """Returns (pack number, payload offset, payload length) or None."""
+        key = bytes.fromhex(unique_id)
+        location = self._locate(key)
+        if location is None:
+            # Another process may have stored it since.
+            with self._write_lock():
+                self._refresh()
+                location = self._locate(key)
+        return location
+
+    def __contains__(self, unique_id):
+        return self.locate(unique_id) is not None
+
+    def reload(self):
+        """Picks up records appended by another process since this store was opened."""
+        with self._lock:
+            self._load_index()
+
+    # -- Reading --
+
+    def _pack_path(self, pack_number):
+        return os.path.join(self.pack_dir, f'pack_{pack_number:05d}.pack')
+
+    def _pack_map(self, pack_number):
+        pack_map = self._pack_maps.get(pack_number)
+        if pack_map is None or len(pack_map) != os.path.getsize(self._pack_path(pack_number)):
+            if pack_map is not None:
+                pack_map.close() # The pack grew; map it again at its new size
+            with open(self._pack_path(pack_number), 'rb') as f:
+                pack_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._pack_maps[pack_number] = pack_map
+        return pack_map
+
+    def read_bytes(self, unique_id):
+        """Returns the raw (decompressed) HTML bytes for unique_id, or None."""
+        location = self.locate(unique_id)
+        if location is None:
+            return None
+        pack_number, offset, length = location
+        with self._lock:
+            if self._pack_file is not None:
+                self._pack_file.flush()
+        payload = memoryview(self._pack_map(pack_number))[offset:offset + length]
+        try:
+            return zlib.decompress(payload)
+        finally:
+            payload.release()
+
+    def read(self, unique_id):
+        """Returns the raw HTML for unique_id as text, or None."""
+        data = self.read_bytes(unique_id)
+        return data.decode('utf-8') if data is not None else None
+
+    # -- Writing --
+
+    def _open_pack_for_append(self):
+        if self._pack_file is not None:
+            self._pack_file.seek(0, os.SEEK_END) # Other processes may have appended since our last write
+            if self._pack_file.tell() < config.PACK_MAX_BYTES:
+                return
+            self._pack_file.close()
+        existing = sorted(glob.glob(os.path.join(self.pack_dir, 'pack_*.pack')))
+        pack_number = int(os.path.basename(existing[-1])[5:10]) if existing else 1
+        if existing and os.path.getsize(existing[-1]) >= config.PACK_MAX_BYTES:
+            pack_number += 1
+        self._pack_number = pack_number
+        self._pack_file = open(self._pack_path(pack_number), 'ab')
+
+    def append(self, unique_id, html):
+        """Compresses and appends a page unless unique_id is already stored. Returns its pack ref."""
+        key = bytes.fromhex(unique_id)
+        payload = zlib.compress(html.encode('utf-8'), config.PACK_COMPRESSION_LEVEL)
+        with self._write_lock():
+            self._refresh()
+            if self._locate(key) is None:
+                self._open_pack_for_append()
+                self._pack_file.write(RECORD_HEADER.pack(RECORD_MAGIC, key, len(payload)))
+                offset = self._pack_file.tell()
+                self._pack_file.write(payload)
+                self._pack_file.flush()
+                entry = (self._pack_number, offset, len(payload))
+                if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self._journal_bytes:
+                    # A partial record left by a crash; appending after it would misalign every later one.
+                    os.truncate(self.journal_path, self._journal_bytes)
+                with open(self.journal_path, 'ab') as journal:
+                    journal.write(INDEX_ENTRY.pack(key, *entry))
+                self._journal[key] = entry
+                self._journal_bytes += INDEX_ENTRY.size
+        return pack_ref(unique_id)
+
+    def _write_index(self, entries):
+        """Replaces index.bin with entries (atomically) and empties the journal; call with the write lock held."""
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            for key in sorted(entries):
+                f.write(INDEX_ENTRY.pack(key, *entries[key]))
+        self._close_maps()
+        os.replace(temp_path, self.index_path)
+        open(self.journal_path, 'wb').close()
+        self._load_index()
+
+    def compact(self):
+        """Merges the journal (every process's records) into the sorted index.bin and empties it."""
+        with self._write_lock():
+            self._refresh()
+            if not self._journal:
+                return
+            entries = {}
+            if self._index_map is not None:
+                for key, pack_number, offset, length in INDEX_ENTRY.iter_unpack(self._index_map):
+                    entries[key] = (pack_number, offset, length)
+            entries.update(self._journal)
+            self._write_index(entries)
+            logging.info(f"Compacted pack index: {len(entries)} entries.")
+
+    def rebuild_index(self):
+        """Re-creates the index from the pack files themselves (e.g. after losing index.bin)."""
+        with self._write_lock():
+            entries = {}
+            for path in sorted(glob.glob(os.path.join(self.pack_dir, 'pack_*.pack'))):
+                pack_number = int(os.path.basename(path)[5:10])
+                with open(path, 'rb') as f:
+                    data = f.read()
+                position = 0
+                while position + RECORD_HEADER.size <= len(data):
+                    magic, key, length = RECORD_HEADER.unpack_from(data, position)
+                    if magic != RECORD_MAGIC or position + RECORD_HEADER.size + length > len(data):
+                        logging.warning(f"Truncated or corrupt record in {path} at offset {position}; stopping scan.")
+                        break
+                    entries.setdefault(key, (pack_number, position + RECORD_HEADER.size, length))
+                    position += RECORD_HEADER.size + length
+            self._write_index(entries)
+            logging.info(f"Rebuilt pack index: {len(entries)} entries.")
+
+    def _close_maps(self):
+        for pack_map in self._pack_maps.values():
+            pack_map.close()
+        self._pack_maps = {}
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+            self._index_count = 0
+
+    def close(self):
+        # Only the process that appended compacts; readers just drop their maps.
+        if self._pack_file is not None:
+            self._pack_file.close()
+            self._pack_file = None
+            self.compact()
+        self._close_maps()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def _file_identity(path):
+    """(inode, size, mtime) of a file, or None if it doesn't exist; changes when the file is replaced."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
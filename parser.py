@@ -1,21 +1,54 @@
 # shunyatax/parser.py
 
-from bs4 import BeautifulSoup
 import json
 import re
+import time
 import logging # Import logging
 
-def extract_post_urls(category_page_html):
+import config
+import html_backends
+import raw_store
+import utils
+
+# Output fields, each with the parser version in which its extraction last changed.
+# When a parser change alters a field, set that field to the next version number;
+# Phase 2's re-extract mode then reprocesses only rows stamped with an older version.
+#   1 - original parser
+#   2 - category fallbacks matched to the post itself (dates and summary)
+#   3 - FILE cell read directly (File_Link was always empty)
+#   4 - adjacent text merged before Full_Text is joined
+FIELD_VERSIONS = {
+    'Case_Number': 1, 'Title': 1, 'Post_URL': 1, 'Date_Pronouncement': 2, 'Date_Publication': 1,
+    'Tribunal_Bench': 1, 'Coram': 1, 'Assessee_Name': 1, 'Tax_Year': 1, 'Section_Involved': 1, 'Genre': 1,
+    'Catch_Words': 1, 'Counsel': 1, 'File_Link': 3, 'Citation': 1, 'Issue_Summary': 2,
+    'Tribunal_Decision': 2, 'Tax_Amount': 1, 'Legal_Principle': 2,
+    'Full_Text': 4, 'Comments': 1, 'Related_Judgements': 1,
+}
+PARSER_VERSION = max(FIELD_VERSIONS.values())
+
+def required_version(fields=None):
+    """
+    Returns the parser version a row must be stamped with (at least) for the given
+    output fields (default: all of them) to be current.
+    """
+    return max(FIELD_VERSIONS[field] for field in (fields or FIELD_VERSIONS))
+
+def _parse(html, backend=None):
+    """Parses HTML with the given parser backend name, or config.PARSER_BACKEND."""
+    return html_backends.get_backend(backend).parse(html)
+
+def extract_post_urls(category_page_html, backend=None):
     """
     Parses the HTML of a category page to find all 'read more' links.
 
     Args:
         category_page_html (str): The raw HTML content of the category page.
+        backend (str, optional): Parser backend name; defaults to config.PARSER_BACKEND.
 
     Returns:
         list: A list of absolute URLs for the posts found on the page.
     """
-    soup = BeautifulSoup(category_page_html, 'html.parser')
+    soup = _parse(category_page_html, backend)
     
     # Find all <a> tags where the visible text contains "read more" (case-insensitive).
     read_more_elements = soup.find_all('a', string=lambda text: text and 'read more' in text.lower())
@@ -25,64 +58,249 @@ def extract_post_urls(category_page_html):
     logging.info(f"Found {len(post_urls)} post URLs.")
     return post_urls
 
-def extract_judgment_data(detail_html_path, category_html_path=None):
+def extract_post_entries(category_page_html, backend=None):
+    """
+    Parses the HTML of a category page into one record per listed post.
+
+    Args:
+        category_page_html (str): The raw HTML content of the category page.
+        backend (str, optional): Parser backend name; defaults to config.PARSER_BACKEND.
+
+    Returns:
+        list: Dicts with 'title' and 'url' for every post on the page, in page order.
+    """
+    soup = _parse(category_page_html, backend)
+    post_entries = soup.find_all('div', class_=lambda c: c and 'post-' in c and 'type-post' in c)
+
+    entries = []
+    for entry_div in post_entries:
+        title_tag = entry_div.find('h2', class_='entry-title')
+        title_link_tag = title_tag.find('a') if title_tag else None
+        if title_link_tag and title_link_tag.has_attr('href'):
+            entries.append({'title': title_link_tag.text.strip(), 'url': title_link_tag['href']})
+    return entries
+
+def extract_last_page_number(category_page_html, backend=None):
+    """
+    Reads the number of the last listing page from a category page's pagination block.
+
+    Args:
+        category_page_html (str): The raw HTML content of any page of the category.
+        backend (str, optional): Parser backend name; defaults to config.PARSER_BACKEND.
+
+    Returns:
+        int or None: The last page number, or None if the page has no pagination links.
+    """
+    soup = _parse(category_page_html, backend)
+    pagination = soup.find('div', class_='pagination')
+    if not pagination:
+        return None
+
+    # The block starts with "Page X of N"; fall back to the highest numbered link.
+    page_of_match = re.search(r'Page\s+\d+\s+of\s+(\d+)', pagination.get_text(' '))
+    if page_of_match:
+        return int(page_of_match.group(1))
+    page_numbers = [int(tag.text.strip()) for tag in pagination.find_all(['a', 'span']) if tag.text.strip().isdigit()]
+    return max(page_numbers) if page_numbers else None
+
+# --- Judgment metadata table ---
+# Each spec maps a row label of the judgment table (upper-case, without the
+# trailing colon) to an output field and says how its value cell is read:
+#   'text' - stripped cell text, '' if the row is missing
+#   'raw'  - stripped cell text, None if the row is missing
+#   'list' - JSON list of the cell's link texts (or of its text if it has no links)
+#   'link' - href of the first link in the cell, '' if there is none
+# The table is walked once per document; add a row here to extract a new label.
+TABLE_FIELD_SPECS = [
+    ('COURT', 'Tribunal_Bench', 'raw'),
+    ('CORAM', 'Coram', 'list'),
+    ('AY', 'Tax_Year', 'text'),
+    ('SECTION(S)', 'Section_Involved', 'list'),
+    ('GENRE', 'Genre', 'text'),
+    ('CATCH WORDS', 'Catch_Words', 'list'),
+    ('COUNSEL', 'Counsel', 'list'),
+    ('FILE', 'File_Link', 'link'),
+    ('CITATION', 'Citation', 'text'),
+]
+
+# The parts of a detail page extract_judgment_data reads, as (tag, attribute, value)
+# for html_backends.slice_regions. With config.SCOPED_PARSE only these elements are
+# parsed; the judgment table and body text live inside div.post-entry.
+DETAIL_REGIONS = [
+    ('link', 'rel', 'canonical'),
+    ('h1', 'class', 'entry-title'),
+    ('div', 'class', 'post-entry'),
+    ('div', 'class', 'yarpp-related'),
+    ('div', 'id', 'recent-comments-2'),
+]
+
+# The stages extract_judgment_data reports to a timings dict, in the order they run.
+# 'read' covers reading, hashing and (scoped) slicing the page; 'category' the listing-page fallback.
+EXTRACTION_STAGES = ['read', 'parse', 'category', 'table_fields', 'title', 'summary', 'full_text', 'comments', 'related']
+
+class _StageClock:
+    """Adds the seconds since the previous mark to timings[stage]; does nothing if timings is None."""
+
+    __slots__ = ('timings', 'last')
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter() if timings is not None else 0.0
+
+    def mark(self, stage):
+        if self.timings is not None:
+            now = time.perf_counter()
+            self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+            self.last = now
+
+def _find_judgment_table(soup_obj):
+    """Returns the judgment metadata table of a detail page, or None."""
+    table = soup_obj.find('table', border='1', cellpadding='5')
+    if not table: # Fallback for different table structure in some pages
+        judge_table_div = soup_obj.find('div', class_='judge_table')
+        if judge_table_div:
+            table = judge_table_div.find('table') # Get the actual table inside the div
+    return table
+
+def _build_label_map(table):
+    """
+    Walks the table's rows once and returns {LABEL: [value cells]}, in document
+    order. Labels such as DATE can appear on several rows.
+    """
+    label_map = {}
+    if not table:
+        return label_map
+    for row in table.find_all('tr'):
+        tds = row.find_all('td')
+        if len(tds) > 1:
+            label = tds[0].text.strip().upper()
+            if label.endswith(':'):
+                label_map.setdefault(label[:-1], []).append(tds[1])
+    return label_map
+
+def _read_cell(cell, kind):
+    if kind == 'list':
+        if cell is None:
+            return '[]'
+        # For multi-value fields like CORAM, SECTION(S), CATCH WORDS, COUNSEL,
+        # extract all text from <a> tags, or just the text if there are no links.
+        values = [a.text.strip() for a in cell.find_all('a')]
+        if not values and cell.text.strip():
+            values = [cell.text.strip()]
+        return json.dumps(values)
+    if kind == 'link':
+        link_tag = cell.find('a', href=True) if cell is not None else None
+        return link_tag['href'] if link_tag else ''
+    if cell is None:
+        return None if kind == 'raw' else ''
+    return cell.text.strip()
+
+def extract_table_fields(label_map):
+    """Fills every TABLE_FIELD_SPECS field from a label map built by _build_label_map."""
+    fields = {}
+    for label, field, kind in TABLE_FIELD_SPECS:
+        cells = label_map.get(label)
+        fields[field] = _read_cell(cells[0] if cells else None, kind)
+    return fields
+
+def extract_category_fallbacks(category_page_html, backend=None):
+    """
+    Parses a category listing page once into per-post fallback records for
+    extract_judgment_data.
+
+    Args:
+        category_page_html (str): The raw HTML content of the category page.
+        backend (str, optional): Parser backend name; defaults to config.PARSER_BACKEND.
+
+    Returns:
+        dict: {unique_id: {'date': str, 'summary': str}} for every post on the page,
+              each taken from that post's own 'type-post' div.
+    """
+    soup = _parse(category_page_html, backend)
+    fallbacks = {}
+    for entry_div in soup.find_all('div', class_=lambda c: c and 'post-' in c and 'type-post' in c):
+        title_tag = entry_div.find('h2', class_='entry-title')
+        title_link_tag = title_tag.find('a') if title_tag else None
+        if not title_link_tag or not title_link_tag.has_attr('href'):
+            continue
+
+        time_tag = entry_div.find('time', class_='timestamp updated')
+
+        summary_text = ''
+        post_entry_div = entry_div.find('div', class_='post-entry')
+        if post_entry_div:
+            summary_strong = post_entry_div.find('strong')
+            if summary_strong:
+                summary_text = summary_strong.text.strip()
+            else: # Fallback to first p tag after main table if strong not found
+                table = post_entry_div.find('table', border='1', cellpadding='5')
+                if table:
+                    next_p = table.find_next_sibling('p')
+                    if next_p and 'read-more' not in next_p.get('class', []):
+                        summary_text = next_p.text.strip()
+
+        fallbacks[utils.generate_unique_id(title_link_tag['href'])] = {
+            'date': time_tag.text.strip() if time_tag else '',
+            'summary': summary_text,
+        }
+    return fallbacks
+
+def extract_judgment_data(detail_html_path, category_html_path=None, category_fallback=None, backend=None, scoped=None, detail_html=None, timings=None):
     """
     Extracts all specified fields from a detailed judgment HTML file,
     with fallback to category HTML if necessary and guided by combination rules.
     
     Args:
-        detail_html_path (str): Path to the saved detail judgment HTML file.
+        detail_html_path (str): Path to the saved detail judgment HTML file, or a
+                                'pack://<unique_id>' reference into the pack archive.
         category_html_path (str, optional): Path to the saved category response HTML file
                                             for fallback data. Defaults to None.
+        category_fallback (dict, optional): This post's record from extract_category_fallbacks.
+                                            When given, category_html_path is not read.
+        backend (str, optional): Parser backend name ('bs4' or 'lxml'); defaults to
+                                 config.PARSER_BACKEND.
+        scoped (bool, optional): Parse only the DETAIL_REGIONS of the page; defaults to
+                                 config.SCOPED_PARSE.
+        detail_html (str, optional): The page's raw HTML, if the caller has already read it.
+        timings (dict, optional): If given, the seconds spent in each of EXTRACTION_STAGES
+                                  are added to it, so callers can total them over many pages.
     
     Returns:
-        dict: A dictionary containing all extracted judgment data.
+        dict: A dictionary containing all extracted judgment data, stamped with
+              parser_version and the html_hash of the source page.
     """
     extracted_data = {}
+    clock = _StageClock(timings)
     
     detail_soup = None
     try:
-        with open(detail_html_path, 'r', encoding='utf-8') as f:
-            detail_html = f.read()
-        detail_soup = BeautifulSoup(detail_html, 'html.parser')
+        if detail_html is None:
+            detail_html = raw_store.read_html(detail_html_path)
+        extracted_data['parser_version'] = PARSER_VERSION
+        extracted_data['html_hash'] = utils.hash_html(detail_html)
+        if config.SCOPED_PARSE if scoped is None else scoped:
+            detail_html = html_backends.slice_regions(detail_html, DETAIL_REGIONS) or detail_html
+        clock.mark('read')
+        detail_soup = _parse(detail_html, backend)
+        clock.mark('parse')
     except Exception as e:
         logging.error(f"Error reading detail HTML file {detail_html_path}: {e}", exc_info=True)
-        return extracted_data
+        return {}
 
-    category_soup = None
-    if category_html_path and category_html_path != detail_html_path:
+    category_fallbacks = None
+    if category_fallback is None and category_html_path and category_html_path != detail_html_path:
         try:
             with open(category_html_path, 'r', encoding='utf-8') as f:
                 category_html = f.read()
-            category_soup = BeautifulSoup(category_html, 'html.parser')
+            category_fallbacks = extract_category_fallbacks(category_html, backend)
         except Exception as e:
             logging.warning(f"Could not read category HTML file {category_html_path} for fallback: {e}")
+    clock.mark('category')
 
-    # --- Helper to extract from judgment table (common structure) ---
-    def _extract_from_table(soup_obj, label):
-        if not soup_obj:
-            return None
-        # Find the table, then its rows, then look for the label
-        table = soup_obj.find('table', border='1', cellpadding='5')
-        if not table: # Fallback for different table structure in some pages
-             table = soup_obj.find('div', class_='judge_table')
-             if table:
-                 table = table.find('table') # Get the actual table inside the div
-        
-        if table:
-            for row in table.find_all('tr'):
-                tds = row.find_all('td')
-                if len(tds) > 1 and tds[0].text.strip().upper() == f"{label.upper()}:":
-                    # For multi-value fields like CORAM, SECTION(S), CATCH WORDS, COUNSEL,
-                    # extract all text from <a> tags and join, or just text if no links.
-                    if label.upper() in ['CORAM', 'SECTION(S)', 'CATCH WORDS', 'COUNSEL']:
-                        values = [a.text.strip() for a in tds[1].find_all('a')]
-                        if not values and tds[1].text.strip(): # If no <a> tags, take direct text
-                            return [tds[1].text.strip()]
-                        return values
-                    else: # For single value fields
-                        return tds[1].text.strip()
-        return None
+    # Walk the judgment table once; every table-backed field below reads from this map.
+    label_map = _build_label_map(_find_judgment_table(detail_soup))
+    table_fields = extract_table_fields(label_map)
+    clock.mark('table_fields')
 
     # --- Extraction Logic for each field ---
 
@@ -93,10 +311,15 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
     # 2. Post_URL (Canonical URL of the detail page)
     canonical_link = detail_soup.find('link', rel='canonical')
     extracted_data['Post_URL'] = canonical_link['href'] if canonical_link else ''
+    clock.mark('title')
+
+    # Match this post to its own entry on the category page
+    if category_fallbacks and extracted_data['Post_URL']:
+        category_fallback = category_fallbacks.get(utils.generate_unique_id(extracted_data['Post_URL']))
     
     # 3. Date_Pronouncement and Date_Publication (from Date(s))
     # Collect all date strings first
-    all_dates_from_detail = [tds[1].text.strip() for row in detail_soup.find_all('tr') for tds in [row.find_all('td')] if len(tds) > 1 and tds[0].text.strip().upper() == 'DATE:']
+    all_dates_from_detail = [cell.text.strip() for cell in label_map.get('DATE', [])]
 
     pronouncement_date = ''
     publication_date = ''
@@ -113,17 +336,14 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
     extracted_data['Date_Publication'] = publication_date
 
     # Fallback for dates from category page if not found in detail page
-    if not extracted_data.get('Date_Pronouncement') and category_soup:
-        cat_time_tag = category_soup.find('time', class_='timestamp updated')
-        if cat_time_tag:
-            extracted_data['Date_Pronouncement'] = cat_time_tag.text.strip() # Assuming this is pronouncement date for simplicity
-
-    # 4. Tribunal_Bench (from Court)
-    extracted_data['Tribunal_Bench'] = _extract_from_table(detail_soup, 'COURT')
+    if not extracted_data.get('Date_Pronouncement') and category_fallback and category_fallback['date']:
+        extracted_data['Date_Pronouncement'] = category_fallback['date'] # Assuming this is pronouncement date for simplicity
 
-    # 5. Coram (Judges)
-    coram = _extract_from_table(detail_soup, 'CORAM')
-    extracted_data['Coram'] = json.dumps(coram) if coram is not None else '[]'
+    # 4. Tribunal_Bench (from Court), 5. Coram (Judges), 7. Tax_Year (from AY),
+    # 8. Section_Involved (from SECTION(S)), 9. Genre, 10. Catch_Words, 11. Counsel,
+    # 12. File_Link (direct PDF link), 13. Citation -- see TABLE_FIELD_SPECS
+    extracted_data.update(table_fields)
+    clock.mark('table_fields')
 
     # 6. Assessee_Name (Derived from Title)
     title_text = extracted_data['Title']
@@ -138,43 +358,7 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
             assessee_name = in_re_match.group(1).strip()
     
     extracted_data['Assessee_Name'] = assessee_name
-
-    # 7. Tax_Year (from AY)
-    tax_year = _extract_from_table(detail_soup, 'AY')
-    extracted_data['Tax_Year'] = tax_year if tax_year else ''
-
-    # 8. Section_Involved (from SECTION(S))
-    sections = _extract_from_table(detail_soup, 'SECTION(S)')
-    extracted_data['Section_Involved'] = json.dumps(sections) if sections is not None else '[]'
-
-    # 9. Genre
-    genre = _extract_from_table(detail_soup, 'GENRE')
-    extracted_data['Genre'] = genre if genre else ''
-
-    # 10. Catch_Words
-    catch_words = _extract_from_table(detail_soup, 'CATCH WORDS')
-    extracted_data['Catch_Words'] = json.dumps(catch_words) if catch_words is not None else '[]'
-
-    # 11. Counsel
-    counsel = _extract_from_table(detail_soup, 'COUNSEL')
-    extracted_data['Counsel'] = json.dumps(counsel) if counsel is not None else '[]'
-
-    # 12. File_Link (direct PDF link)
-    file_link_td_content = _extract_from_table(detail_soup, 'FILE')
-    if file_link_td_content:
-        # Use BeautifulSoup to parse the HTML string in file_link_td_content
-        link_soup = BeautifulSoup(file_link_td_content, 'html.parser')
-        link_tag = link_soup.find('a', href=True)
-        if link_tag:
-            extracted_data['File_Link'] = link_tag['href']
-        else:
-            extracted_data['File_Link'] = ''
-    else:
-        extracted_data['File_Link'] = ''
-
-    # 13. Citation
-    citation = _extract_from_table(detail_soup, 'CITATION')
-    extracted_data['Citation'] = citation if citation else ''
+    clock.mark('title')
 
     # 14. Issue_Summary (from Summary/Extract)
     detail_summary_text = ''
@@ -196,29 +380,13 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
                 if next_p:
                     detail_summary_text = next_p.text.strip()
 
-    category_summary_text = ''
-    if category_soup:
-        cat_post_entries = category_soup.find_all('div', class_=lambda c: c and 'post-' in c and 'type-post' in c)
-        # Find the specific post entry matching the detail_html_path URL if possible, or iterate
-        # For simplicity here, assuming the category_response.html contains a general summary section.
-        # A more robust solution would iterate through cat_post_entries to find the relevant one.
-        cat_summary_strong = category_soup.find('div', class_='post-entry').find('strong') if category_soup.find('div', class_='post-entry') else None
-        if cat_summary_strong:
-            category_summary_text = cat_summary_strong.text.strip()
-        else: # Fallback to first p tag after main table if strong not found in category
-            cat_post_entry_div = category_soup.find('div', class_='post-entry')
-            if cat_post_entry_div:
-                cat_table = cat_post_entry_div.find('table', border='1', cellpadding='5')
-                if cat_table:
-                    cat_next_p = cat_table.find_next_sibling('p')
-                    if cat_next_p and 'read-more' not in cat_next_p.get('class', []):
-                        category_summary_text = cat_next_p.text.strip()
-
+    category_summary_text = category_fallback['summary'] if category_fallback else ''
 
     if len(category_summary_text) > len(detail_summary_text):
         extracted_data['Issue_Summary'] = category_summary_text
     else:
         extracted_data['Issue_Summary'] = detail_summary_text
+    clock.mark('summary')
 
     # 15. Full_Text (from body of judgment)
     full_text_container = detail_soup.find('div', class_='post-entry')
@@ -228,8 +396,7 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
         start_element = full_text_container.find('div', class_='judge_table') or full_text_container.find('table', border='1', cellpadding='5')
         if start_element:
             # Skip the immediate next sibling if it's the summary strong tag or first p (already extracted as Issue_Summary)
-            current_node = start_element.next_sibling
-            while current_node:
+            for current_node in start_element.next_siblings:
                 if isinstance(current_node, str) and current_node.strip():
                     full_text_parts.append(current_node.strip())
                 elif hasattr(current_node, 'name'): # It's a tag
@@ -246,7 +413,6 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
                          table_text = current_node.get_text(strip=True, separator='\n')
                          if table_text:
                              full_text_parts.append(table_text)
-                current_node = current_node.next_sibling
         else: # If no initial table, just get all paragraph text
             for p_tag in full_text_container.find_all('p'):
                 if 'read-more' not in p_tag.get('class', []) and 'sharedaddy' not in p_tag.get('class', []):
@@ -255,6 +421,7 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
                         full_text_parts.append(text)
 
     extracted_data['Full_Text'] = '\n\n'.join(full_text_parts).strip()
+    clock.mark('full_text')
 
     # 16. Tribunal_Decision (Requires NLP, or derived from Issue_Summary initially)
     extracted_data['Tribunal_Decision'] = extracted_data['Issue_Summary']
@@ -281,6 +448,7 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
     # For now, leaving it as an empty string or the unique_id itself as the primary identifier for records.
     # We will keep it as blank since a specific format is not clear from example html.
     extracted_data['Case_Number'] = '' 
+    clock.mark('summary') # Decision and principle are copied from the summary
 
     # 20. Comments Section
     comments_section = detail_soup.find('div', id='recent-comments-2')
@@ -307,6 +475,7 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
                 'text': comment_body.strip()
             })
     extracted_data['Comments'] = json.dumps(comments_list) if comments_list else '[]'
+    clock.mark('comments')
 
     # 21. Related_Judgements
     related_judgements_section = detail_soup.find('div', class_='yarpp-related')
@@ -318,7 +487,13 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
                 title_tag = li.find('a', rel='bookmark')
                 # The small tag might contain other elements, get its direct text content
                 summary_tag = li.find('small')
-                summary_text = summary_tag.get_text(strip=True) if summary_tag else ''
+                summary_text = ''
+                if summary_tag:
+                    # The excerpt is <p> markup inside <small>, which libxml2 hoists out as
+                    # the small's following siblings; read those too so both backends agree.
+                    summary_text = summary_tag.get_text(strip=True) + ''.join(
+                        node.get_text(strip=True) for node in summary_tag.next_siblings if not isinstance(node, str)
+                    )
 
                 # Also remove the bracketed number if present e.g. "(7)"
                 summary_text = re.sub(r'\(\d+\)$', '', summary_text).strip()
@@ -329,6 +504,7 @@ def extract_judgment_data(detail_html_path, category_html_path=None):
                     'summary': summary_text
                 })
     extracted_data['Related_Judgements'] = json.dumps(related_list) if related_list else '[]'
+    clock.mark('related')
 
     # Ensure all defined fields have a value, even if empty, for CSV consistency
     # This loop is handled in main.py before writing now, but keeping for standalone robustness.
@@ -0,0 +1,97 @@
+# shunyatax/rate_limiter.py
+
+import asyncio
+import time
+import logging
+from email.utils import parsedate_to_datetime
+
+import config
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header value into a delay in seconds.
+    The header may be either a number of seconds or an HTTP date.
+    Returns None if the value is missing or unparseable.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every fetch, tuned with AIMD.
+
+    The bucket refills at `rate` tokens per second up to `burst` tokens and each
+    request takes one token. While the server keeps up, the rate grows additively
+    by RATE_LIMIT_INCREASE_STEP per successful request; a 429/503, a timeout or a
+    response slower than RATE_LIMIT_LATENCY_TARGET cuts it multiplicatively by
+    RATE_LIMIT_DECREASE_FACTOR. A Retry-After header pauses the whole bucket for
+    as long as the server asked.
+    """
+
+    def __init__(self, rate=None, burst=None, min_rate=None, max_rate=None):
+        self.rate = rate or config.RATE_LIMIT_INITIAL_RPS
+        self.burst = burst or config.RATE_LIMIT_BURST
+        self.min_rate = min_rate or config.RATE_LIMIT_MIN_RPS
+        self.max_rate = max_rate or config.RATE_LIMIT_MAX_RPS
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Waits until a token is available (and any Retry-After pause is over), then takes it."""
+        # Waiters queue on the lock, so tokens are handed out in arrival order.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def record_success(self, latency):
+        """Additive increase, unless the response was slow enough to signal server strain."""
+        if latency > config.RATE_LIMIT_LATENCY_TARGET:
+            self._decrease(f"slow response ({latency:.1f}s)")
+        else:
+            self.rate = min(self.max_rate, self.rate + config.RATE_LIMIT_INCREASE_STEP)
+
+    def record_throttle(self, retry_after=None):
+        """Multiplicative decrease on 429/503; honours Retry-After if the server sent one."""
+        self._decrease("throttled")
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._tokens = 0.0
+            logging.warning(f"Server asked to retry after {retry_after:.1f}s. Pausing all fetches.")
+
+    def record_timeout(self):
+        self._decrease("timeout")
+
+    def _decrease(self, reason):
+        # Requests already in flight report the same congestion event; only back
+        # off once per cooldown window so a burst of 429s doesn't collapse the rate.
+        now = time.monotonic()
+        if now - self._last_decrease < config.RATE_LIMIT_DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.rate = max(self.min_rate, self.rate * config.RATE_LIMIT_DECREASE_FACTOR)
+        logging.info(f"Rate limit lowered to {self.rate:.2f} req/s ({reason}).")
@@ -0,0 +1,94 @@
+# shunyatax/raw_store.py
+
+import os
+import atexit
+import logging
+
+import config
+from pack_store import PackStore, pack_ref, is_pack_ref, PACK_REF_PREFIX
+
+# Raw detail pages are stored once per post, keyed by unique_id (the MD5 of the
+# post URL), no matter how many categories or listing pages link to it. Which
+# categories/pages list a post is kept as metadata in the ledger.
+#
+# config.RAW_STORAGE_MODE picks where new pages go:
+#   'files' - one file per post: data/posts/<first two hex chars>/<unique_id>.html
+#   'pack'  - appended, compressed, to pack files in data/packs (see pack_store.py);
+#             the ledger then records the post's file_path as 'pack://<unique_id>'.
+# Pages already saved in either layout (or under data/<category>/page_N/ by older
+# crawls) stay readable whichever mode is active.
+
+_pack_store = None
+
+
+def _packs():
+    """Returns the process-wide PackStore, or None when no pack archive is in use."""
+    global _pack_store
+    if _pack_store is None:
+        if config.RAW_STORAGE_MODE != 'pack' and not os.path.isdir(config.PACK_DIR):
+            return None
+        _pack_store = PackStore()
+        atexit.register(_pack_store.close)
+    return _pack_store
+
+
+def raw_path(unique_id):
+    """Returns the path a post's raw HTML is stored at in 'files' mode."""
+    return os.path.join(config.RAW_STORE_DIR, unique_id[:2], f'{unique_id}.html')
+
+
+def locate(unique_id):
+    """Returns the file_path (file path or pack ref) a post is stored under, or None."""
+    path = raw_path(unique_id)
+    if os.path.exists(path):
+        return path
+    packs = _packs()
+    if packs is not None and unique_id in packs:
+        return pack_ref(unique_id)
+    return None
+
+
+def has(unique_id):
+    return locate(unique_id) is not None
+
+
+def save(unique_id, html):
+    """Stores a post's raw HTML and returns the file_path to record in the ledger."""
+    if config.RAW_STORAGE_MODE == 'pack':
+        return _packs().append(unique_id, html)
+
+    path = raw_path(unique_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file first so an interrupted crawl never leaves a truncated page behind.
+    temp_path = f"{path}.part"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(temp_path, path)
+    logging.debug(f"Saved raw HTML for {unique_id} to {path}")
+    return path
+
+
+def read_html(file_path):
+    """
+    Returns the raw HTML behind a ledger file_path, which may be a plain file
+    (any layout) or a 'pack://<unique_id>' reference.
+    """
+    if is_pack_ref(file_path):
+        unique_id = file_path[len(PACK_REF_PREFIX):]
+        packs = _packs()
+        html = packs.read(unique_id) if packs is not None else None
+        if html is None and packs is not None:
+            # The page may have been appended by another process after we opened the index.
+            packs.reload()
+            html = packs.read(unique_id)
+        if html is None:
+            raise FileNotFoundError(f"{unique_id} is not in the pack archive at {config.PACK_DIR}")
+        return html
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def load(unique_id):
+    """Returns a post's raw HTML, or None if it isn't in the store."""
+    file_path = locate(unique_id)
+    return read_html(file_path) if file_path else None
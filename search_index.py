@@ -0,0 +1,278 @@
+# shunyatax/search_index.py
+
+import os
+import re
+import math
+import sqlite3
+import logging
+
+import config
+import output_writers
+
+# Full-text search over the Phase 2 output, kept in one SQLite file
+# (config.SEARCH_INDEX_FILE):
+#
+#   docs      - one row per indexed post: unique_id, category, title and its
+#               length in tokens
+#   postings  - (term, doc_id) -> term frequency and the term's positions in the
+#               post, delta-encoded as varints; clustered by term, so a query
+#               reads each of its terms' postings in one range scan
+#   sources   - per category, how much of manifest.ids has been indexed
+#
+# A post's indexed text is INDEXED_FIELDS in that order, with a gap of
+# FIELD_GAP positions between fields so a phrase never matches across two of them.
+# update() reads only the part of each category's manifest.ids written since the
+# last update and re-indexes just those posts, from just the shards they are in.
+
+INDEXED_FIELDS = ['Title', 'Catch_Words', 'Issue_Summary', 'Full_Text']
+FIELD_GAP = 100
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+_QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    """Lower-cased word tokens; '14A' and '80-IA' become ['14a'] and ['80', 'ia']."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def _encode_positions(positions):
+    data = bytearray()
+    previous = 0
+    for position in positions:
+        delta = position - previous
+        previous = position
+        while delta >= 0x80:
+            data.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return bytes(data)
+
+
+def _decode_positions(data):
+    positions = []
+    position = value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        position += value
+        positions.append(position)
+        value = shift = 0
+    return positions
+
+
+def _document_terms(row):
+    """Returns ({term: [positions]}, length in tokens) for one extracted row."""
+    terms = {}
+    position = 0
+    for field in INDEXED_FIELDS:
+        value = row.get(field) or ''
+        if isinstance(value, list):
+            value = ' '.join(str(item) for item in value)
+        for token in tokenize(value):
+            terms.setdefault(token, []).append(position)
+            position += 1
+        position += FIELD_GAP
+    length = sum(len(positions) for positions in terms.values())
+    return terms, length
+
+
+class SearchIndex:
+    """
+    Positional inverted index over the extracted judgments, ranked with BM25.
+
+    Args:
+        db_path (str, optional): Defaults to config.SEARCH_INDEX_FILE.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or config.SEARCH_INDEX_FILE
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id INTEGER PRIMARY KEY,
+                unique_id TEXT NOT NULL UNIQUE,
+                category TEXT,
+                title TEXT,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                positions BLOB NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+            CREATE TABLE IF NOT EXISTS sources (
+                category TEXT PRIMARY KEY,
+                format TEXT NOT NULL,
+                ids_bytes INTEGER NOT NULL
+            );
+        """)
+
+    def __len__(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()
+        return count
+
+    # -- Building --
+
+    def update(self, output_dir=None, rebuild=False):
+        """
+        Indexes every post written to output_dir (default: config.OUTPUT_DIR) since
+        the last update. A category whose output was reset or rewritten in another
+        format is re-indexed from scratch, as is everything with rebuild=True.
+        Returns the number of posts (re-)indexed.
+        """
+        output_dir = output_dir or config.OUTPUT_DIR
+        if rebuild:
+            with self._conn:
+                self._conn.executescript("DELETE FROM postings; DELETE FROM docs; DELETE FROM sources;")
+        if not os.path.isdir(output_dir):
+            return 0
+        indexed = 0
+        for category_name in sorted(os.listdir(output_dir)):
+            category_dir = os.path.join(output_dir, category_name)
+            if os.path.isdir(category_dir):
+                indexed += self._update_category(category_name, category_dir)
+        if indexed:
+            logging.info(f"Search index updated: {indexed} posts indexed, {len(self)} in total.")
+        return indexed
+
+    def _update_category(self, category_name, category_dir):
+        manifest = output_writers.read_manifest(category_dir)
+        if manifest is None:
+            return 0
+        source = self._conn.execute("SELECT format, ids_bytes FROM sources WHERE category = ?", (category_name,)).fetchone()
+        start = 0
+        if source and source[0] == manifest['format'] and source[1] <= manifest['ids_bytes']:
+            start = source[1]
+        elif source:
+            logging.info(f"Output of {category_name} was reset since it was indexed; re-indexing the whole category.")
+            self._delete_category(category_name)
+        if start == manifest['ids_bytes']:
+            return 0
+
+        rows = output_writers.read_rows_since(category_dir, manifest, start)
+        with self._conn:
+            for row in rows.values():
+                self._index_row(category_name, row)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (category, format, ids_bytes) VALUES (?, ?, ?)",
+                (category_name, manifest['format'], manifest['ids_bytes']),
+            )
+        logging.debug(f"Indexed {len(rows)} posts from {category_name}.")
+        return len(rows)
+
+    def _index_row(self, category_name, row):
+        terms, length = _document_terms(row)
+        existing = self._conn.execute("SELECT doc_id FROM docs WHERE unique_id = ?", (row['unique_id'],)).fetchone()
+        if existing:
+            doc_id = existing[0]
+            self._conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            self._conn.execute(
+                "UPDATE docs SET category = ?, title = ?, length = ? WHERE doc_id = ?",
+                (category_name, row.get('Title', ''), length, doc_id),
+            )
+        else:
+            doc_id = self._conn.execute(
+                "INSERT INTO docs (unique_id, category, title, length) VALUES (?, ?, ?, ?)",
+                (row['unique_id'], category_name, row.get('Title', ''), length),
+            ).lastrowid
+        self._conn.executemany(
+            "INSERT INTO postings (term, doc_id, tf, positions) VALUES (?, ?, ?, ?)",
+            [(term, doc_id, len(positions), _encode_positions(positions)) for term, positions in terms.items()],
+        )
+
+    def _delete_category(self, category_name):
+        with self._conn:
+            self._conn.execute("DELETE FROM postings WHERE doc_id IN (SELECT doc_id FROM docs WHERE category = ?)", (category_name,))
+            self._conn.execute("DELETE FROM docs WHERE category = ?", (category_name,))
+            self._conn.execute("DELETE FROM sources WHERE category = ?", (category_name,))
+
+    # -- Searching --
+
+    def search(self, query, limit=None, category=None):
+        """
+        Ranks posts against query with BM25 (config.BM25_K1, config.BM25_B).
+
+        Bare words are optional and add to the score; a "quoted phrase" must
+        appear in the post word for word, and its words score like bare ones.
+
+        Returns:
+            list: Up to limit (default config.SEARCH_RESULTS_LIMIT) dicts with
+                  unique_id, category, title and score, best first.
+        """
+        limit = limit or config.SEARCH_RESULTS_LIMIT
+        phrases = []
+        words = []
+        for phrase, word in _QUERY_PATTERN.findall(query):
+            tokens = tokenize(phrase if phrase else word)
+            if phrase and len(tokens) > 1:
+                phrases.append(tokens)
+            words.extend(tokens)
+        if not words:
+            return []
+
+        doc_count, total_length = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+        if not doc_count:
+            return []
+        average_length = total_length / doc_count
+        k1, b = config.BM25_K1, config.BM25_B
+
+        scores = {}
+        positions = {} # term -> {doc_id: encoded positions}, only for phrase words
+        phrase_terms = {term for phrase in phrases for term in phrase}
+        for term in set(words):
+            rows = self._conn.execute(
+                "SELECT p.doc_id, p.tf, d.length, p.positions FROM postings p JOIN docs d ON d.doc_id = p.doc_id WHERE p.term = ?",
+                (term,),
+            ).fetchall()
+            if not rows:
+                continue
+            idf = math.log(1 + (doc_count - len(rows) + 0.5) / (len(rows) + 0.5))
+            for doc_id, tf, length, encoded in rows:
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average_length))
+            if term in phrase_terms:
+                positions[term] = {row[0]: row[3] for row in rows}
+
+        candidates = set(scores)
+        for phrase in phrases:
+            candidates = {doc_id for doc_id in candidates if self._contains_phrase(doc_id, phrase, positions)}
+
+        if category is not None:
+            in_category = set()
+            candidate_list = list(candidates)
+            for start in range(0, len(candidate_list), 500): # Stay under SQLite's bound-parameter limit
+                batch = candidate_list[start:start + 500]
+                in_category.update(row[0] for row in self._conn.execute(
+                    f"SELECT doc_id FROM docs WHERE category = ? AND doc_id IN ({','.join('?' * len(batch))})", (category, *batch)))
+            candidates = in_category
+
+        ranked = sorted(candidates, key=lambda doc_id: -scores[doc_id])[:limit]
+        results = []
+        for doc_id in ranked:
+            unique_id, category_name, title = self._conn.execute(
+                "SELECT unique_id, category, title FROM docs WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+            results.append({'unique_id': unique_id, 'category': category_name, 'title': title, 'score': round(scores[doc_id], 4)})
+        return results
+
+    @staticmethod
+    def _contains_phrase(doc_id, phrase, positions):
+        if any(doc_id not in positions.get(term, {}) for term in phrase):
+            return False
+        # Shift each word's positions back by its offset in the phrase; a shared start is a match.
+        starts = set(_decode_positions(positions[phrase[0]][doc_id]))
+        for offset, term in enumerate(phrase[1:], 1):
+            starts &= {position - offset for position in _decode_positions(positions[term][doc_id])}
+            if not starts:
+                return False
+        return True
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,231 @@
+# shunyatax/standin_server.py
+
+import os
+import re
+import glob
+import random
+import asyncio
+import argparse
+import logging
+import threading
+from urllib.parse import urlsplit, unquote
+
+from aiohttp import web
+
+import config
+import utils
+
+# A local stand-in for itatonline.org, for load-testing Phase 1 offline.
+#
+# It serves saved pages under the live site's URL layout: every
+# data/<category>/page_N/category_response.html at the path
+# config.CATEGORY_URL_TEMPLATE / CATEGORY_PAGINATION_URL_TEMPLATE give for it,
+# and every post those listings link to (from data/posts/ or the listing's own
+# folder) at its own path. Links to the live site are rewritten to the stand-in,
+# so a crawl pointed at it never leaves it. Unknown paths are a 404, which is how
+# a crawl finds the end of a category.
+#
+# Posts are found by the canonical URL in their own HTML, since posts saved by
+# older crawls aren't always named after the hash of the URL they are listed under.
+#
+# Faults are injected per request with a seeded random generator, so a run can
+# be repeated: extra latency, 429 (with Retry-After) and 5xx responses, and a
+# per-response bandwidth cap.
+
+_CANONICAL_LINK_PATTERN = re.compile(r'<link\b[^>]*\brel=["\']canonical["\'][^>]*>', re.IGNORECASE)
+_HREF_PATTERN = re.compile(r'\bhref=["\']([^"\']+)["\']', re.IGNORECASE)
+
+
+def _url_path(url):
+    """The decoded path of a URL, as aiohttp reports request.path."""
+    return unquote(urlsplit(url).path)
+
+
+class StandinSite:
+    """
+    The pages a stand-in serves, keyed by URL path, built from a Phase 1 data folder.
+
+    Args:
+        data_dir (str, optional): Folder laid out like config.DATA_DIR; defaults to it.
+        live_url (str, optional): The live site's base URL the saved pages link to; defaults to config.BASE_URL.
+    """
+
+    def __init__(self, data_dir=None, live_url=None):
+        self.data_dir = data_dir or config.DATA_DIR
+        live = urlsplit(live_url or config.BASE_URL)
+        self.live_origin = f"{live.scheme}://{live.netloc}"
+        self.pages = {} # Decoded URL path -> file holding the page
+        self.categories = set()
+        for listing_path in sorted(glob.glob(os.path.join(self.data_dir, '*', 'page_*', 'category_response.html'))):
+            page_folder = os.path.dirname(listing_path)
+            category_name = os.path.basename(os.path.dirname(page_folder))
+            page = int(os.path.basename(page_folder)[len('page_'):])
+            self.categories.add(category_name)
+            self.pages[_url_path(utils.category_page_url(category_name, page))] = listing_path
+        post_paths = glob.glob(os.path.join(self.data_dir, 'posts', '*', '*.html'))
+        post_paths += [path for path in glob.glob(os.path.join(self.data_dir, '*', 'page_*', '*.html'))
+                       if os.path.basename(path) != 'category_response.html']
+        for post_path in sorted(post_paths):
+            with open(post_path, 'r', encoding='utf-8') as f:
+                head = f.read(65536) # The canonical link is in <head>
+            link = _CANONICAL_LINK_PATTERN.search(head)
+            href = _HREF_PATTERN.search(link.group(0)) if link else None
+            if href:
+                self.pages.setdefault(_url_path(href.group(1)), post_path)
+        logging.info(f"Stand-in site: {len(self.pages)} pages from {self.data_dir}.")
+
+    def read(self, path, origin):
+        """The page at a URL path with live links pointing at origin, or None if there isn't one."""
+        file_path = self.pages.get(path)
+        if file_path is None:
+            return None
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read().replace(self.live_origin, origin)
+
+
+class StandinServer:
+    """
+    Serves a StandinSite over HTTP with injected faults.
+
+    Args:
+        site (StandinSite): The pages to serve.
+        host, port: Where to listen; port 0 picks a free port.
+        latency (float): Seconds added to every response.
+        jitter (float): Up to this many extra seconds, drawn per request.
+        throttle_rate (float): Fraction of requests answered 429 with Retry-After: retry_after.
+        error_rate (float): Fraction of requests answered with a 500, 502, 503 or 504.
+        bandwidth (int): Bytes per second each response body is sent at; 0 means unlimited.
+        seed (int): Seed for the fault generator, so runs are repeatable.
+    """
+
+    def __init__(self, site, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, throttle_rate=0.0,
+                 error_rate=0.0, bandwidth=0, retry_after=1, seed=0):
+        self.site = site
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.retry_after = retry_after
+        self.seed = seed
+        self._random = random.Random(seed)
+        self.statuses = {} # Status -> responses sent
+        self._runner = None
+        self._loop = None
+
+    @property
+    def origin(self):
+        return f"http://{self.host}:{self.port}"
+
+    def url_for(self, live_url):
+        """Maps a live-site URL (e.g. config.BASE_URL) onto the stand-in."""
+        return live_url.replace(self.site.live_origin, self.origin)
+
+    async def _handle(self, request):
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        draw = self._random.random()
+        if delay:
+            await asyncio.sleep(delay)
+        if draw < self.throttle_rate:
+            return self._respond(web.Response(status=429, headers={'Retry-After': str(self.retry_after)}))
+        if draw < self.throttle_rate + self.error_rate:
+            return self._respond(web.Response(status=self._random.choice([500, 502, 503, 504])))
+        body = self.site.read(request.path, self.origin)
+        if body is None:
+            return self._respond(web.Response(status=404, text="404 Not Found"))
+        if not self.bandwidth:
+            return self._respond(web.Response(text=body, content_type='text/html'))
+
+        data = body.encode('utf-8')
+        response = web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8', 'Content-Length': str(len(data))})
+        await response.prepare(request)
+        chunk_size = max(1024, self.bandwidth // 10) # About ten writes a second
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            await response.write(chunk)
+            await asyncio.sleep(len(chunk) / self.bandwidth)
+        await response.write_eof()
+        return self._respond(response)
+
+    def _respond(self, response):
+        self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/{path:.*}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logging.info(f"Stand-in server listening on {self.origin}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self):
+        """Runs the server on its own event loop in a daemon thread; returns once it is listening."""
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        threading.Thread(target=serve, name='standin-server', daemon=True).start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def add_fault_arguments(argument_parser):
+    """Adds the stand-in's fault-injection options to an ArgumentParser (shared with load_test.py)."""
+    argument_parser.add_argument('--data-dir', help="Saved pages to serve (default: config.DATA_DIR).")
+    argument_parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response.")
+    argument_parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many random extra seconds per response.")
+    argument_parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered 429.")
+    argument_parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered 5xx.")
+    argument_parser.add_argument('--bandwidth', type=int, default=0, help="Per-response bandwidth cap in bytes/s (0: none).")
+    argument_parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with a 429.")
+    argument_parser.add_argument('--seed', type=int, default=0, help="Seed for fault injection.")
+
+
+def server_from_arguments(args, port=0):
+    site = StandinSite(args.data_dir)
+    return StandinServer(site, port=port, latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                         error_rate=args.error_rate, bandwidth=args.bandwidth, retry_after=args.retry_after, seed=args.seed)
+
+
+def main():
+    utils.setup_logging()
+    argument_parser = argparse.ArgumentParser(description="Serve saved pages as a local stand-in for itatonline.org.")
+    argument_parser.add_argument('--port', type=int, default=8767, help="Port to listen on.")
+    add_fault_arguments(argument_parser)
+    args = argument_parser.parse_args()
+
+    server = server_from_arguments(args, port=args.port)
+
+    async def serve():
+        await server.start()
+        print(f"Point config.BASE_URL at {server.url_for(config.BASE_URL)} to crawl the stand-in. Ctrl+C to stop.")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# shunyatax/tests/conftest.py
+
+import os
+import sys
+
+import pytest
+
+# The project is a flat set of modules at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+@pytest.fixture(autouse=True)
+def no_metrics_file(monkeypatch):
+    """Keeps tests from writing metrics snapshots into the working directory."""
+    monkeypatch.setattr(config, 'METRICS_FILE', None)
+
+
+@pytest.fixture
+def write_category():
+    """Returns a function writing rows (dicts of extracted fields) to output_dir/<category> through a CategoryWriter."""
+    import main
+    import output_writers
+
+    def write(output_dir, category_name, rows, output_format='csv'):
+        writer = output_writers.get_writer(category_name, os.path.join(str(output_dir), category_name),
+                                           main.EXTRACTED_FIELDNAMES, output_format=output_format)
+        writer.write_many(rows)
+        writer.close()
+
+    return write
+
+
+@pytest.fixture
+def extracted_row():
+    """Returns a function making a small extracted row (dict) for unique_id, by default from the current parser version."""
+    import parser
+
+    def row(unique_id, title='', version=None, html_hash='h'):
+        return {'unique_id': unique_id, 'Title': title or f"Title {unique_id}", 'Full_Text': f"text of {unique_id}",
+                'parser_version': parser.PARSER_VERSION if version is None else version, 'html_hash': html_hash}
+
+    return row
+
+
+@pytest.fixture
+def open_writer():
+    """Returns a function opening the CategoryWriter of category 'aar' on category_dir."""
+    import main
+    import output_writers
+
+    def open_(category_dir, output_format='csv', buffer_size=100):
+        return output_writers.get_writer('aar', str(category_dir), main.EXTRACTED_FIELDNAMES,
+                                         buffer_size=buffer_size, output_format=output_format)
+
+    return open_
@@ -0,0 +1,44 @@
+# shunyatax/tests/test_benchmark.py
+
+import os
+
+import benchmark
+import config
+import raw_store
+import utils
+
+
+def _report(docs_per_second, full_text_ms, rss_growth_mb):
+    return {
+        'docs_per_second': docs_per_second,
+        'stages_ms_per_doc': {'full_text': full_text_ms, 'category': 0.001},
+        'worker_memory': {'workers': 2, 'rss_growth_mb_max': rss_growth_mb, 'rss_growth_mb_mean': rss_growth_mb},
+        'phase2': {'2': {'seconds': 1.0, 'docs_per_second': 100.0}},
+    }
+
+
+def test_compare_to_baseline_flags_only_real_regressions():
+    baseline = _report(300.0, 0.2, 10.0)
+    assert benchmark.compare_to_baseline(_report(290.0, 0.21, 11.0), baseline, threshold=0.2) == []
+    regressions = benchmark.compare_to_baseline(_report(200.0, 0.3, 20.0), baseline, threshold=0.2)
+    assert [message.split(':')[0] for message in regressions] == [
+        'docs_per_second', 'stages_ms_per_doc.full_text', 'worker_memory.rss_growth_mb_max']
+
+
+def test_old_baseline_memory_metric_is_skipped():
+    baseline = _report(300.0, 0.2, 10.0)
+    baseline['worker_memory'] = {'workers': 2, 'peak_rss_mb_max': 1.0, 'peak_rss_mb_mean': 1.0}
+    assert benchmark.compare_to_baseline(_report(300.0, 0.2, 50.0), baseline, threshold=0.2) == []
+
+
+def test_benchmark_phase2_restores_process_wide_stores(tmp_path, monkeypatch):
+    entries = benchmark.load_corpus()[:5]
+    assert entries, "needs the saved pages in config.DATA_DIR"
+    monkeypatch.setattr(utils, '_ledger_store', None)
+    monkeypatch.setattr(raw_store, '_pack_store', None)
+    work_dir = tmp_path / 'bench'
+    results = benchmark.benchmark_phase2(entries, [1], work_dir=str(work_dir))
+    assert results['1']['docs_per_second'] > 0
+    assert utils._ledger_store is None
+    assert raw_store._pack_store is None
+    assert config.OUTPUT_DIR != str(work_dir) and not config.OUTPUT_DIR.startswith(str(work_dir))
@@ -0,0 +1,79 @@
+# shunyatax/tests/test_facet_index.py
+
+import os
+import sys
+import json
+import subprocess
+from array import array
+
+import pytest
+
+from facet_index import FacetIndex, intersect, union, normalize_section, normalize_name, normalize_tax_years
+
+
+ROWS = [
+    {'unique_id': 'p1', 'Section_Involved': json.dumps(['Section 14A', '80-IA']), 'Tax_Year': '2004-05 to 2006-07',
+     'Coram': json.dumps(['V. S. Sirpurkar J'])},
+    {'unique_id': 'p2', 'Section_Involved': json.dumps(['sec. 14 A']), 'Tax_Year': '2005-06', 'Coram': json.dumps(['v s sirpurkar j'])},
+    {'unique_id': 'p3', 'Section_Involved': json.dumps(['80-IA']), 'Tax_Year': '2010-11', 'Coram': json.dumps(['A. K. Patnaik J'])},
+    {'unique_id': 'p4', 'Section_Involved': json.dumps(['14A']), 'Tax_Year': 'N/A'},
+]
+
+
+@pytest.fixture
+def index(tmp_path, write_category):
+    write_category(tmp_path / 'output', 'aar', ROWS)
+    index = FacetIndex(str(tmp_path / 'facets.db'))
+    index.update(str(tmp_path / 'output'))
+    yield index
+    index.close()
+
+
+def _ids(index, doc_ids):
+    return sorted(unique_id for unique_id, _ in index.unique_ids(doc_ids))
+
+
+def test_intersect_and_union():
+    assert list(intersect(array('I', [1, 3, 5, 7, 9]), array('I', [3, 4, 9, 12]))) == [3, 9]
+    assert list(intersect(array('I', [2]), array('I', []))) == []
+    assert list(union([array('I', [1, 5]), array('I', [2, 5, 8])])) == [1, 2, 5, 8]
+
+
+def test_normalizers():
+    assert normalize_section('Section 14A') == normalize_section('sec. 14 A') == '14a'
+    assert normalize_name('V. S. Sirpurkar J') == normalize_name('v s  sirpurkar j')
+    assert normalize_tax_years('2004-05 to 2006-07') == ['2004-05', '2005-06', '2006-07']
+
+
+def test_filter_intersects_facets(index):
+    assert _ids(index, index.filter({'Section_Involved': '14A'})) == ['p1', 'p2', 'p4']
+    assert _ids(index, index.filter({'Section_Involved': '14A', 'Tax_Year': '2005-06'})) == ['p1', 'p2']
+    assert _ids(index, index.filter({'Section_Involved': '14A', 'Coram': 'V.S. Sirpurkar J', 'Tax_Year': '2006-07'})) == ['p1']
+    assert _ids(index, index.filter({'Section_Involved': '14A', 'Tax_Year': '2010-11'})) == []
+
+
+def test_repeated_facet_matches_any_value(index):
+    assert _ids(index, index.filter({'Tax_Year': ['2010-11', '2004-05']})) == ['p1', 'p3']
+    assert _ids(index, index.filter({'Tax_Year': '2004-05 to 2005-06'})) == ['p1', 'p2']
+
+
+def test_counts(index):
+    assert dict(index.counts('Section_Involved')) == {'Section 14A': 3, '80-IA': 2}
+    assert dict(index.counts('Tax_Year', index.filter({'Section_Involved': '14A'}))) == {
+        '2004-05': 1, '2005-06': 2, '2006-07': 1}
+    with pytest.raises(ValueError):
+        index.counts('Unknown_Facet')
+
+
+@pytest.mark.parametrize('arguments, message', [
+    ([], 'give at least one --where filter, or --counts'),
+    (['--where', 'Section_Involved'], "--where 'Section_Involved' should look like FACET=VALUE"),
+    (['--where', 'Foo=x'], "unknown facet 'Foo'; choose from: Section_Involved, "),
+    (['--where', 'Coram=A. Judge', '--counts', 'Foo'], "unknown facet 'Foo'"),
+])
+def test_facets_usage_errors(tmp_path, arguments, message):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, os.path.join(root, 'main.py'), 'facets', *arguments], capture_output=True, text=True, cwd=tmp_path)
+    assert result.returncode == 2
+    assert message in result.stderr
+    assert 'Traceback' not in result.stderr
@@ -0,0 +1,59 @@
+# shunyatax/tests/test_fetcher.py
+
+import time
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import config
+import fetcher
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(config, 'MAX_RETRIES', 2)
+    monkeypatch.setattr(config, 'RETRY_DELAY_SECONDS', 0)
+    monkeypatch.setattr(config, 'RATE_LIMIT_INITIAL_RPS', 100.0)
+    monkeypatch.setattr(config, 'RATE_LIMIT_MAX_RPS', 100.0)
+
+
+async def _get_with_responses(responses):
+    """Serves the given (status, headers) responses in turn, then 200s; returns (result, seconds taken)."""
+    remaining = list(responses)
+
+    async def handle(request):
+        if remaining:
+            status, headers = remaining.pop(0)
+            return web.Response(status=status, headers=headers)
+        return web.Response(text='ok')
+
+    app = web.Application()
+    app.router.add_get('/', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        async with fetcher.FetchEngine() as engine:
+            started = time.monotonic()
+            result = await engine.get(f'http://127.0.0.1:{port}/')
+            return result, time.monotonic() - started
+    finally:
+        await runner.cleanup()
+
+
+def test_retry_after_on_server_error_is_waited_out(fast_retries):
+    # A 500 doesn't pause the rate limiter, so its Retry-After must be honoured by the retry itself.
+    (status, text), elapsed = asyncio.run(_get_with_responses([(500, {'Retry-After': '1'})]))
+    assert (status, text) == (200, 'ok')
+    assert elapsed >= 0.9
+
+
+def test_retry_after_on_throttle_pauses_once(fast_retries, monkeypatch):
+    # A 503 pauses the limiter for Retry-After; the backoff isn't added on top.
+    monkeypatch.setattr(config, 'RETRY_DELAY_SECONDS', 5)
+    (status, text), elapsed = asyncio.run(_get_with_responses([(503, {'Retry-After': '1'})]))
+    assert (status, text) == (200, 'ok')
+    assert 0.9 <= elapsed < 4
@@ -0,0 +1,172 @@
+# shunyatax/tests/test_frontier.py
+
+import json
+import sqlite3
+
+import pytest
+
+import config
+from frontier import CrawlFrontier
+
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DEAD_LETTER_FILE', str(tmp_path / 'dead_letters.jsonl'))
+    monkeypatch.setattr(config, 'FRONTIER_MAX_ATTEMPTS', 3)
+    monkeypatch.setattr(config, 'FRONTIER_RETRY_BASE_SECONDS', 0)
+
+
+@pytest.fixture
+def crawl_frontier(tmp_path, settings):
+    crawl_frontier = CrawlFrontier(str(tmp_path / 'frontier.db'), owner='crawler-a')
+    yield crawl_frontier
+    crawl_frontier.close()
+
+
+def _listing(page, category='aar'):
+    return (f"https://example.org/{category}/page/{page}/", 'listing', category, page, None)
+
+
+def test_claims_lowest_page_first_and_completes(crawl_frontier):
+    assert crawl_frontier.add_many([_listing(3), _listing(1), _listing(2)]) == 3
+    assert crawl_frontier.add_many([_listing(1)]) == 0 # Known URLs aren't queued twice
+    claimed = crawl_frontier.claim(2)
+    assert [item['page'] for item in claimed] == [1, 2]
+    assert all(item['state'] == 'in_flight' for item in claimed)
+    assert crawl_frontier.claim(5, kinds=['post']) == []
+    crawl_frontier.complete(claimed[0]['url'])
+    assert crawl_frontier.counts() == {'pending': 1, 'in_flight': 1, 'done': 1, 'failed': 0, 'dead': 0}
+
+
+def test_reset_done_requeues_only_done_items(crawl_frontier):
+    crawl_frontier.add_many([_listing(1), _listing(2)])
+    crawl_frontier.complete(crawl_frontier.claim(1)[0]['url'])
+    assert crawl_frontier.add_many([_listing(1), _listing(2)], reset_done=True) == 1
+    assert crawl_frontier.get(_listing(1)[0])['state'] == 'pending'
+
+
+def test_failure_backs_off_then_dead_letters(tmp_path, crawl_frontier, monkeypatch):
+    url = _listing(1)[0]
+    crawl_frontier.add(*_listing(1))
+    monkeypatch.setattr(config, 'FRONTIER_RETRY_BASE_SECONDS', 3600)
+    crawl_frontier.claim(1)
+    assert crawl_frontier.fail(url, 'HTTP 500') == 'failed'
+    assert crawl_frontier.claim(1) == [] # Still backing off
+    item = crawl_frontier.get(url)
+    assert item['attempts'] == 1 and item['last_error'] == 'HTTP 500'
+
+    monkeypatch.setattr(config, 'FRONTIER_RETRY_BASE_SECONDS', 0)
+    crawl_frontier._conn.execute("UPDATE frontier SET next_attempt_at = 0")
+    crawl_frontier._conn.commit()
+    assert crawl_frontier.claim(1)[0]['url'] == url
+    assert crawl_frontier.fail(url, 'HTTP 502') == 'failed'
+    crawl_frontier.claim(1)
+    assert crawl_frontier.fail(url, 'no response') == 'dead'
+    assert crawl_frontier.claim(1) == []
+
+    with open(config.DEAD_LETTER_FILE, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert [(record['url'], record['attempts'], record['last_error']) for record in records] == [(url, 3, 'no response')]
+
+
+def test_listing_watermark_stops_at_first_open_page(crawl_frontier):
+    crawl_frontier.add_many([_listing(page) for page in (1, 2, 3, 4)] + [_listing(1, 'others')])
+    claimed = {item['page']: item['url'] for item in crawl_frontier.claim(5) if item['category'] == 'aar'}
+    assert crawl_frontier.listing_watermark('aar') == 0
+    crawl_frontier.complete(claimed[1])
+    crawl_frontier.complete(claimed[3])
+    assert crawl_frontier.listing_watermark('aar') == 1
+    crawl_frontier.fail(claimed[2], 'HTTP 500')
+    assert crawl_frontier.listing_watermark('aar') == 1
+    crawl_frontier.complete(claimed[4])
+    assert crawl_frontier.listing_watermark('others') == 0
+    assert crawl_frontier.listing_watermark('missing') == 0
+
+
+def test_state_survives_reopening(tmp_path, crawl_frontier):
+    crawl_frontier.add_many([_listing(1), _listing(2)])
+    crawl_frontier.complete(crawl_frontier.claim(1)[0]['url'])
+    crawl_frontier.close()
+    reopened = CrawlFrontier(str(tmp_path / 'frontier.db'))
+    assert reopened.states([_listing(1)[0], _listing(2)[0], 'unknown']) == {_listing(1)[0]: 'done', _listing(2)[0]: 'pending'}
+    reopened.close()
+
+
+@pytest.fixture
+def other_crawler(tmp_path, crawl_frontier):
+    other_crawler = CrawlFrontier(str(tmp_path / 'frontier.db'), owner='crawler-b')
+    yield other_crawler
+    other_crawler.close()
+
+
+def test_expired_lease_is_reclaimed_by_another_crawler(crawl_frontier, other_crawler, monkeypatch):
+    url = _listing(1)[0]
+    crawl_frontier.add(*_listing(1))
+    monkeypatch.setattr(config, 'FRONTIER_LEASE_SECONDS', 3600)
+    assert [item['url'] for item in crawl_frontier.claim(1)] == [url]
+    assert other_crawler.claim(1) == [] # Still leased to crawler-a
+    assert other_crawler.active_leases() == 1
+
+    crawl_frontier._conn.execute("UPDATE frontier SET lease_expires_at = 0") # crawler-a died
+    crawl_frontier._conn.commit()
+    claimed = other_crawler.claim(1)
+    assert [(item['url'], item['lease_owner']) for item in claimed] == [(url, 'crawler-b')]
+
+    # The lease is fenced: crawler-a can no longer settle the item.
+    assert crawl_frontier.complete(url) is False
+    assert crawl_frontier.fail(url, 'HTTP 500') is None
+    assert other_crawler.get(url)['attempts'] == 0
+    assert other_crawler.complete(url) is True
+    assert other_crawler.get(url)['state'] == 'done'
+
+
+def test_heartbeat_extends_only_own_leases(crawl_frontier, other_crawler, monkeypatch):
+    crawl_frontier.add_many([_listing(1), _listing(2)])
+    monkeypatch.setattr(config, 'FRONTIER_LEASE_SECONDS', 3600)
+    mine, = crawl_frontier.claim(1)
+    theirs, = other_crawler.claim(1)
+    crawl_frontier._conn.execute("UPDATE frontier SET lease_expires_at = 1") # Both about to run out
+    crawl_frontier._conn.commit()
+    assert crawl_frontier.active_leases() == 0
+
+    assert crawl_frontier.heartbeat() == 1
+    assert crawl_frontier.active_leases() == 1
+    assert crawl_frontier.get(theirs['url'])['lease_expires_at'] == 1
+    assert crawl_frontier.reclaim_expired() == 1 # crawler-b's lease
+    assert crawl_frontier.states([mine['url'], theirs['url']]) == {mine['url']: 'in_flight', theirs['url']: 'pending'}
+
+
+def test_lease_many_skips_settled_and_live_leased_items(crawl_frontier, other_crawler, monkeypatch):
+    monkeypatch.setattr(config, 'FRONTIER_LEASE_SECONDS', 3600)
+    done, dead, taken, pending = (_listing(page) for page in (1, 2, 3, 4))
+    crawl_frontier.add_many([done, dead, taken, pending])
+    crawl_frontier._conn.execute("UPDATE frontier SET state = 'done' WHERE url = ?", (done[0],))
+    crawl_frontier._conn.execute("UPDATE frontier SET state = 'dead' WHERE url = ?", (dead[0],))
+    crawl_frontier._conn.commit()
+    assert other_crawler.lease_many([taken]) == {taken[0]}
+
+    new = _listing(5)
+    assert crawl_frontier.lease_many([done, dead, taken, pending, new]) == {pending[0], new[0]}
+    assert crawl_frontier.get(new[0])['lease_owner'] == 'crawler-a'
+    assert crawl_frontier.get(taken[0])['lease_owner'] == 'crawler-b'
+
+
+def test_frontier_without_lease_columns_is_migrated(tmp_path, settings):
+    db_path = str(tmp_path / 'old_frontier.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE frontier (
+            seq INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, category TEXT NOT NULL,
+            page INTEGER NOT NULL, unique_id TEXT, priority INTEGER NOT NULL, state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT, updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("INSERT INTO frontier (url, kind, category, page, priority, state, updated_at) VALUES (?, 'listing', 'aar', 1, 1, 'pending', 0)",
+                 (_listing(1)[0],))
+    conn.commit()
+    conn.close()
+
+    migrated = CrawlFrontier(db_path, owner='crawler-a')
+    assert [item['lease_owner'] for item in migrated.claim(1)] == ['crawler-a']
+    migrated.close()
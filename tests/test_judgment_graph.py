@@ -0,0 +1,95 @@
+# shunyatax/tests/test_judgment_graph.py
+
+import json
+
+import pytest
+
+from judgment_graph import JudgmentGraph, link_id
+
+BASE = 'https://itatonline.org/archives/'
+
+
+def _post(slug, related=(), comments=(), unique_id=None):
+    return {
+        'unique_id': unique_id or link_id(BASE + slug),
+        'Post_URL': BASE + slug,
+        'Title': slug,
+        'Related_Judgements': json.dumps([{'url': BASE + target, 'title': target} for target in related]),
+        'Comments': json.dumps([{'target_judgment_url': BASE + target + '#comment-1', 'target_judgment_title': target}
+                                for target in comments]),
+    }
+
+
+@pytest.fixture
+def graph(tmp_path, write_category):
+    # a -> b, a -> c, b -> c (related); c -> a (comment); d -> c and d -> e, where e is never extracted
+    write_category(tmp_path / 'output', 'aar', [_post('a', related=['b', 'c']), _post('b', related=['c', 'b'])])
+    write_category(tmp_path / 'output', 'others', [_post('c', comments=['a']), _post('d', related=['c', 'e'])])
+    graph = JudgmentGraph(str(tmp_path / 'graph.bin'))
+    assert graph.update(str(tmp_path / 'output')) == 4
+    return graph
+
+
+def _slugs(nodes):
+    return sorted(node['url'][len(BASE):] for node in nodes)
+
+
+def test_csr_arrays(graph):
+    assert len(graph) == 5
+    assert graph.edge_count == 6 # b's link to itself is dropped
+    assert len(graph.offsets) == len(graph.in_offsets) == 6
+    assert graph.offsets[-1] == graph.in_offsets[-1] == 6
+
+
+def test_adjacency(graph):
+    assert _slugs(graph.neighbours(BASE + 'a')) == ['b', 'c']
+    assert _slugs(graph.neighbours(BASE + 'c', direction='in')) == ['a', 'b', 'd']
+    assert _slugs(graph.neighbours(BASE + 'c', direction='in', kinds=['related'])) == ['a', 'b', 'd']
+    assert _slugs(graph.neighbours(BASE + 'a', direction='in', kinds=['comment'])) == ['c']
+    assert _slugs(graph.neighbours(BASE + 'e')) == []
+    assert graph.nodes[graph.node_id(BASE + 'e')]['category'] is None
+    assert graph.nodes[graph.node_id(link_id(BASE + 'd'))]['category'] == 'others'
+
+
+def test_k_hop_and_most_referenced(graph):
+    assert sorted((node['title'], hops) for node, hops in graph.k_hop(BASE + 'd', k=2)) == [('a', 2), ('c', 1), ('e', 1)]
+    assert [(node['title'], count) for node, count in graph.most_referenced(limit=2)] == [('c', 3), ('a', 1)]
+
+
+def test_save_load_and_incremental_update(tmp_path, graph, write_category):
+    reloaded = JudgmentGraph(str(tmp_path / 'graph.bin'))
+    assert list(reloaded.targets) == list(graph.targets)
+    assert reloaded.update(str(tmp_path / 'output')) == 0
+
+    # Re-extracting a replaces its links.
+    write_category(tmp_path / 'output', 'aar', [_post('a', related=['e'])])
+    assert reloaded.update(str(tmp_path / 'output')) == 1
+    assert _slugs(reloaded.neighbours(BASE + 'a')) == ['e']
+    assert _slugs(reloaded.neighbours(BASE + 'c', direction='in')) == ['b', 'd']
+
+
+def test_post_with_legacy_unique_id_gets_its_in_links(tmp_path, write_category):
+    # Legacy ledger IDs aren't the hash of the post URL.
+    write_category(tmp_path / 'output', 'aar', [_post('a', related=['c']), _post('b', comments=['c'])])
+    write_category(tmp_path / 'output', 'others', [_post('c', related=['a'], unique_id='legacy-c')])
+    graph = JudgmentGraph(str(tmp_path / 'graph.bin'))
+    graph.update(str(tmp_path / 'output'))
+
+    assert len(graph) == 3
+    assert graph.node_id('legacy-c') == graph.node_id(BASE + 'c') == graph.node_id(link_id(BASE + 'c'))
+    assert _slugs(graph.neighbours('legacy-c', direction='in')) == ['a', 'b']
+    assert [(node['unique_id'], node['category'], count) for node, count in graph.most_referenced(limit=1)] == [('legacy-c', 'others', 2)]
+    assert sorted((node['title'], hops) for node, hops in graph.k_hop(BASE + 'b', k=2)) == [('a', 2), ('c', 1)]
+
+    reloaded = JudgmentGraph(str(tmp_path / 'graph.bin'))
+    assert reloaded.node_id('legacy-c') == reloaded.node_id(BASE + 'c')
+    assert _slugs(reloaded.neighbours('legacy-c', direction='in')) == ['a', 'b']
+
+
+def test_graph_file_from_an_older_version_is_rebuilt(tmp_path, graph):
+    with open(graph.path, 'wb') as f:
+        f.write(json.dumps({'nodes': [], 'sources': {}, 'sizes': {}}).encode('utf-8') + b'\n')
+    stale = JudgmentGraph(graph.path)
+    assert len(stale) == 0
+    assert stale.update(str(tmp_path / 'output')) == 4
+    assert len(stale) == 5
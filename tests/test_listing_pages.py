@@ -0,0 +1,40 @@
+# shunyatax/tests/test_listing_pages.py
+
+import os
+
+import pytest
+
+import config
+import main
+from ledger_store import LedgerStore, url_id
+
+URL = 'https://itatonline.org/archives/moved/'
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DATA_DIR', str(tmp_path / 'data'))
+    ledger = LedgerStore(str(tmp_path / 'ledger.db'))
+    # A legacy row: its unique_id isn't the hash of its URL.
+    ledger.add('legacy-1', os.path.join(config.DATA_DIR, 'aar', 'page_1', 'legacy-1.html'), URL, 'aar', 1)
+    ledger.add('fresh-1', os.path.join(config.DATA_DIR, 'aar', 'page_1', 'fresh-1.html'), URL + 'fresh/', 'aar', 1)
+    yield ledger
+    ledger.close()
+
+
+def _pages(page_tasks):
+    return {entry['unique_id']: os.path.relpath(os.path.dirname(task['category_response_path']), config.DATA_DIR)
+            for task in page_tasks for entry in task['entries']}
+
+
+def test_post_moved_to_another_page_is_grouped_with_its_current_listing(ledger):
+    ledger.add_membership(url_id(URL), 'aar', 2) # A re-crawl found it on page 2
+    ledger.add_membership('fresh-1', 'others', 5) # Listings of other categories don't matter
+    pages = _pages(main._group_entries_by_listing_page(ledger.entries(), ledger))
+    assert pages == {'legacy-1': os.path.join('aar', 'page_2'), 'fresh-1': os.path.join('aar', 'page_1')}
+
+
+def test_without_a_ledger_the_row_page_is_used(ledger):
+    ledger.add_membership(url_id(URL), 'aar', 2)
+    pages = _pages(main._group_entries_by_listing_page(ledger.entries()))
+    assert pages == {'legacy-1': os.path.join('aar', 'page_1'), 'fresh-1': os.path.join('aar', 'page_1')}
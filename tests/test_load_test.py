@@ -0,0 +1,38 @@
+# shunyatax/tests/test_load_test.py
+
+import os
+
+import pytest
+
+import config
+import load_test
+import raw_store
+import standin_server
+import utils
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(config, 'RATE_LIMIT_INITIAL_RPS', 1000)
+    monkeypatch.setattr(config, 'RATE_LIMIT_MAX_RPS', 1000)
+    server = standin_server.StandinServer(standin_server.StandinSite()).start_in_thread()
+    yield server
+    server.stop_thread()
+
+
+def test_run_restores_the_process_wide_stores(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(utils, '_ledger_store', None)
+    monkeypatch.setattr(raw_store, '_pack_store', None)
+    assert server.site.categories, "needs the saved pages in config.DATA_DIR"
+    category = sorted(server.site.categories)[0]
+
+    first = load_test.run_load_test(server, categories=[category])
+    assert first['posts'] > 0 and first['failures'] == 0
+    assert utils._ledger_store is None and raw_store._pack_store is None
+
+    # A second run gets its own ledger, not the one in the removed first folder.
+    work_dir = tmp_path / 'second'
+    second = load_test.run_load_test(server, categories=[category], work_dir=str(work_dir))
+    assert second['posts'] == first['posts']
+    assert os.path.exists(work_dir / 'ledger.db')
+    assert utils._ledger_store is None
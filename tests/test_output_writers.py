@@ -0,0 +1,102 @@
+# shunyatax/tests/test_output_writers.py
+
+import os
+import csv
+
+import pytest
+
+import main
+import output_writers
+import parser
+from output_writers import read_manifest, iter_rows, read_id_log, MANIFEST_FILE
+
+
+def _ids(category_dir):
+    return [row['unique_id'] for row in iter_rows(str(category_dir))]
+
+
+class _Crash(Exception):
+    pass
+
+
+@pytest.fixture(params=['csv', 'jsonl'])
+def output_format(request):
+    return request.param
+
+
+def test_rows_roll_over_into_shards(tmp_path, monkeypatch, output_format, open_writer, extracted_row):
+    monkeypatch.setattr(output_writers.config, 'MAX_ENTRIES_PER_CSV', 2)
+    writer = open_writer(tmp_path / 'aar', output_format)
+    writer.write_many([extracted_row(f"p{number}") for number in range(5)])
+    writer.close()
+    manifest = read_manifest(str(tmp_path / 'aar'))
+    assert manifest['format'] == output_format
+    assert {index: shard['rows'] for index, shard in manifest['shards'].items()} == {'1': 2, '2': 2, '3': 1}
+    assert _ids(tmp_path / 'aar') == ['p0', 'p1', 'p2', 'p3', 'p4']
+    assert next(iter_rows(str(tmp_path / 'aar')))['Full_Text'] == 'text of p0'
+
+
+def test_crash_between_shard_write_and_manifest_is_cut_back_on_resume(tmp_path, monkeypatch, output_format, open_writer, extracted_row):
+    category_dir = tmp_path / 'aar'
+    writer = open_writer(category_dir, output_format)
+    writer.write_many([extracted_row('p1'), extracted_row('p2')])
+    writer.flush()
+    checkpoint = read_manifest(str(category_dir))
+
+    # The process dies after appending the next rows to the shard and the id log, before the manifest is replaced.
+    def crash():
+        raise _Crash()
+    monkeypatch.setattr(writer, '_write_manifest', crash)
+    writer.write_many([extracted_row('p3'), extracted_row('p4')])
+    with pytest.raises(_Crash):
+        writer.flush()
+    shard_file = os.path.join(category_dir, writer.shard_files(1)[0])
+    assert os.path.getsize(shard_file) > checkpoint['shards']['1']['bytes'][writer.shard_files(1)[0]]
+    # ...and it had already started a shard the manifest doesn't know about.
+    stray = os.path.join(category_dir, writer.shard_files(7)[0])
+    with open(stray, 'w', encoding='utf-8') as f:
+        f.write('partial')
+
+    resumed = open_writer(category_dir, output_format)
+    assert set(resumed.processed) == {'p1', 'p2'}
+    assert not os.path.exists(stray)
+    assert _ids(category_dir) == ['p1', 'p2']
+    assert [unique_id for unique_id, _ in read_id_log(str(category_dir))] == ['p1', 'p2']
+
+    # The lost rows are simply written again.
+    resumed.write_many([extracted_row('p3'), extracted_row('p4')])
+    resumed.close()
+    assert _ids(category_dir) == ['p1', 'p2', 'p3', 'p4']
+
+
+def test_checkpoint_is_rebuilt_from_output_without_a_manifest(tmp_path, open_writer, extracted_row):
+    category_dir = tmp_path / 'aar'
+    writer = open_writer(category_dir, 'csv')
+    writer.write_many([extracted_row('p1', version=2), extracted_row('p2')])
+    writer.close()
+    os.remove(os.path.join(category_dir, MANIFEST_FILE))
+    os.remove(os.path.join(category_dir, output_writers.MANIFEST_IDS_FILE))
+
+    rebuilt = open_writer(category_dir, 'csv')
+    assert rebuilt.processed == {'p1': (1, 2, 'h'), 'p2': (1, parser.PARSER_VERSION, 'h')}
+    assert read_manifest(str(category_dir))['shards']['1']['rows'] == 2
+
+
+def test_manifest_of_another_format_is_refused(tmp_path, open_writer, extracted_row):
+    writer = open_writer(tmp_path / 'aar', 'csv')
+    writer.write(extracted_row('p1'))
+    writer.close()
+    with pytest.raises(ValueError):
+        open_writer(tmp_path / 'aar', 'jsonl')
+
+
+def test_csv_shard_keeps_header_after_resume(tmp_path, open_writer, extracted_row):
+    category_dir = tmp_path / 'aar'
+    for unique_id in ('p1', 'p2'):
+        writer = open_writer(category_dir, 'csv')
+        writer.write(extracted_row(unique_id))
+        writer.close()
+    with open(os.path.join(category_dir, 'extracted_1.csv'), newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == main.EXTRACTED_FIELDNAMES
+    assert [row[0] for row in rows[1:]] == ['p1', 'p2']
@@ -0,0 +1,87 @@
+# shunyatax/tests/test_pack_store.py
+
+import hashlib
+import multiprocessing
+
+import pytest
+
+import config
+from pack_store import PackStore
+
+
+def _id(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PackStore(str(tmp_path / 'packs'))
+    yield store
+    store.close()
+
+
+def test_append_read_and_reopen(tmp_path, store):
+    store.append(_id('a'), '<html>a</html>')
+    store.append(_id('b'), '<html>b</html>')
+    assert store.read(_id('a')) == '<html>a</html>'
+    store.close() # Compacts the journal into index.bin
+
+    reopened = PackStore(str(tmp_path / 'packs'))
+    assert reopened.read(_id('b')) == '<html>b</html>'
+    assert _id('c') not in reopened
+    reopened.close()
+
+
+def test_reading_while_appending_remaps_the_grown_pack(store):
+    store.append(_id('a'), 'first')
+    assert store.read(_id('a')) == 'first'
+    old_map = store._pack_maps[1]
+    store.append(_id('b'), 'second')
+    assert store.read(_id('b')) == 'second'
+    assert old_map.closed
+    assert len(store._pack_maps) == 1
+
+
+def test_rebuild_index_from_packs(tmp_path, store):
+    store.append(_id('a'), 'first')
+    store.close()
+    (tmp_path / 'packs' / 'index.bin').unlink()
+    rebuilt = PackStore(str(tmp_path / 'packs'))
+    assert _id('a') not in rebuilt
+    rebuilt.rebuild_index()
+    assert rebuilt.read(_id('a')) == 'first'
+    rebuilt.close()
+
+
+def _append_range(pack_dir, worker, count):
+    store = PackStore(pack_dir)
+    for i in range(count):
+        store.append(_id(f"{worker}-{i}"), f"<html>{worker}-{i}</html>")
+    store.close()
+
+
+def test_several_processes_append_to_one_archive(tmp_path, monkeypatch):
+    pack_dir = str(tmp_path / 'packs')
+    monkeypatch.setattr(config, 'PACK_MAX_BYTES', 4096) # Roll over packs while processes race
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_append_range, args=(pack_dir, worker, 200)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 4
+    assert not list((tmp_path / 'packs').glob('*.tmp'))
+
+    store = PackStore(pack_dir)
+    assert all(store.read(_id(f"{worker}-{i}")) == f"<html>{worker}-{i}</html>" for worker in range(4) for i in range(200))
+    store.close()
+
+
+def test_lookup_sees_records_another_store_appended(tmp_path, store):
+    store.append(_id('a'), 'first')
+    writer = PackStore(str(tmp_path / 'packs'))
+    writer.append(_id('b'), 'second')
+    assert store.read(_id('b')) == 'second'
+    writer.close() # Compacts, replacing index.bin under the other store
+    assert store.read(_id('a')) == 'first'
+    assert store.read(_id('b')) == 'second'
@@ -0,0 +1,71 @@
+# shunyatax/tests/test_reextract.py
+
+import os
+
+import pytest
+
+import benchmark
+import main
+import parser
+import utils
+from output_writers import iter_rows, read_manifest
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'jsonl'])
+def test_rewritten_row_replaces_the_old_one(tmp_path, monkeypatch, output_format, open_writer, extracted_row):
+    monkeypatch.setattr(main.config, 'MAX_ENTRIES_PER_CSV', 2)
+    category_dir = tmp_path / 'aar'
+    writer = open_writer(category_dir, output_format)
+    writer.write_many([extracted_row('p1', 'old one', version=1), extracted_row('p2', 'two'), extracted_row('p3', 'three')])
+    writer.close()
+
+    writer = open_writer(category_dir, output_format)
+    writer.write(extracted_row('p1', 'new one'))
+    writer.close()
+    rows = {row['unique_id']: row for row in iter_rows(str(category_dir))}
+    assert len(list(iter_rows(str(category_dir)))) == 3
+    assert rows['p1']['Title'] == 'new one'
+    assert writer.processed['p1'] == (2, parser.PARSER_VERSION, 'h')
+    assert read_manifest(str(category_dir))['superseded'] == {}
+
+
+def test_superseded_rows_are_dropped_when_a_crashed_writer_resumes(tmp_path, open_writer, extracted_row):
+    category_dir = tmp_path / 'aar'
+    writer = open_writer(category_dir)
+    writer.write_many([extracted_row('p1', 'old one', version=1), extracted_row('p2', 'two')])
+    writer.close()
+
+    writer = open_writer(category_dir)
+    writer.write(extracted_row('p1', 'new one'))
+    writer.flush() # Checkpointed with p1's old row marked superseded, then the process dies before close()
+    assert read_manifest(str(category_dir))['superseded'] == {'1': ['p1']}
+
+    open_writer(category_dir).close()
+    assert [(row['unique_id'], row['Title']) for row in iter_rows(str(category_dir))] == [('p2', 'two'), ('p1', 'new one')]
+
+
+def test_select_entries_to_process():
+    current = parser.required_version()
+    entries = [{'unique_id': unique_id} for unique_id in ('new', 'old_parser', 'no_hash', 'current')]
+    processed = {'old_parser': (1, current - 1, 'a'), 'no_hash': (1, current, ''), 'current': (1, current, 'abc')}
+
+    assert main._select_entries_to_process(entries, processed, reextract=False) == [{'unique_id': 'new'}]
+    assert main._select_entries_to_process(entries, processed, reextract=True) == [
+        {'unique_id': 'new'}, {'unique_id': 'old_parser'}, {'unique_id': 'no_hash'},
+        {'unique_id': 'current', 'html_hash': 'abc'},
+    ]
+
+
+def test_current_row_is_only_reextracted_if_its_page_changed():
+    entries = benchmark.load_corpus()[:2]
+    assert len(entries) == 2, "needs the saved pages in config.DATA_DIR"
+    with open(entries[0]['file_path'], 'r', encoding='utf-8') as f:
+        unchanged_hash = utils.hash_html(f.read())
+    task_entries = [dict(entries[0], html_hash=unchanged_hash), dict(entries[1], html_hash='stale')]
+    page_task = {'category_response_path': os.path.join(os.path.dirname(entries[0]['file_path']), 'category_response.html'),
+                 'entries': task_entries}
+
+    results = dict(main._process_listing_page_for_extraction(page_task))
+    assert results[entries[0]['unique_id']] == main.UNCHANGED
+    assert results[entries[1]['unique_id']]['parser_version'] == parser.PARSER_VERSION
+    assert results[entries[1]['unique_id']]['html_hash'] != 'stale'
@@ -0,0 +1,82 @@
+# shunyatax/tests/test_search_index.py
+
+import json
+import sqlite3
+
+import pytest
+
+from search_index import SearchIndex, tokenize, _encode_positions, _decode_positions
+
+
+ROWS = {
+    'aar': [
+        {'unique_id': 'a1', 'Title': 'Disallowance under section 14A', 'Full_Text': 'section 14A disallowance of expenditure on exempt income'},
+        {'unique_id': 'a2', 'Title': 'Penalty appeal', 'Full_Text': 'penalty for concealment; disallowance mentioned once'},
+        {'unique_id': 'a3', 'Title': 'Transfer pricing', 'Full_Text': 'arm length price of exempt services, section 92'},
+    ],
+    'others': [
+        {'unique_id': 'o1', 'Title': '14A appeal', 'Full_Text': '14A section disallowance disallowance disallowance',
+         'Catch_Words': json.dumps(['14A'])},
+    ],
+}
+
+
+@pytest.fixture
+def index(tmp_path, write_category):
+    for category_name, rows in ROWS.items():
+        write_category(tmp_path / 'output', category_name, rows)
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    assert index.update(str(tmp_path / 'output')) == 4
+    yield index
+    index.close()
+
+
+def test_tokenize_and_position_encoding():
+    assert tokenize('Sec. 80-IA and 14A') == ['sec', '80', 'ia', 'and', '14a']
+    positions = [0, 3, 130, 100000]
+    assert _decode_positions(_encode_positions(positions)) == positions
+
+
+def test_bm25_ranks_by_term_frequency(index):
+    results = index.search('disallowance')
+    assert [result['unique_id'] for result in results] == ['o1', 'a1', 'a2']
+    assert results[0]['score'] > results[1]['score'] > results[2]['score']
+
+
+def test_phrase_must_match_in_order(index):
+    assert [result['unique_id'] for result in index.search('"section 14A"')] == ['a1']
+    # o1 has both words, but only as '14A section'
+    assert index.search('"14A section"')[0]['unique_id'] == 'o1'
+    assert index.search('"14a disallowance expenditure"') == []
+
+
+def test_category_filter(index):
+    assert [result['unique_id'] for result in index.search('disallowance', category='aar')] == ['a1', 'a2']
+    assert index.search('disallowance', category='missing') == []
+
+
+def test_category_filter_over_many_candidates(tmp_path, write_category):
+    # More candidates than SQLite's bound-parameter limit (999 in older builds) allows in one IN list
+    rows = [{'unique_id': f'd{number}', 'Title': 'common word'} for number in range(1200)]
+    write_category(tmp_path / 'output', 'aar', rows)
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    index.update(str(tmp_path / 'output'))
+    index._conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    assert len(index.search('common', limit=2000, category='aar')) == 1200
+    index.close()
+
+
+def test_incremental_update_and_reset(tmp_path, index, write_category):
+    output_dir = tmp_path / 'output'
+    assert index.update(str(output_dir)) == 0
+    write_category(output_dir, 'aar', [{'unique_id': 'a4', 'Title': 'Fresh disallowance ruling'}])
+    assert index.update(str(output_dir)) == 1
+    assert len(index) == 5
+
+    # Output written again from scratch (here as jsonl) is re-indexed as a whole.
+    for path in (output_dir / 'others').iterdir():
+        path.unlink()
+    write_category(output_dir, 'others', [{'unique_id': 'o2', 'Title': 'Replacement'}], output_format='jsonl')
+    assert index.update(str(output_dir)) == 1
+    assert index.search('replacement')[0]['unique_id'] == 'o2'
+    assert all(result['unique_id'] != 'o1' for result in index.search('disallowance'))
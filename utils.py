@@ -3,16 +3,21 @@
 import os
 import csv
 import time
-import random
+import atexit
 import hashlib
 import json
 import logging # Import the logging module
 
+import config
+from ledger_store import LedgerStore
+
+_ledger_store = None
+
 # Configure logging
-def setup_logging():
+def setup_logging(clear=True):
     log_file = 'project.log'
-    # Clear log file from previous run for cleaner output, or change to 'a' to append
-    if os.path.exists(log_file):
+    # Clear log file from previous run for cleaner output; crawler processes pass clear=False to append to their parent's
+    if clear and os.path.exists(log_file):
         open(log_file, 'w').close() 
         
     logging.basicConfig(
@@ -29,22 +34,44 @@ def generate_unique_id(url):
     """Generates a unique ID based on the URL."""
     return hashlib.md5(url.encode('utf-8')).hexdigest()
 
-def load_ledger():
-    """Loads all entries from ledger.csv."""
-    ledger_file = 'ledger.csv'
-    entries = []
-    if os.path.exists(ledger_file) and os.path.getsize(ledger_file) > 0:
-        with open(ledger_file, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            # Check if 'unique_id' is in the fieldnames to avoid KeyError later
-            if 'unique_id' not in reader.fieldnames:
-                logging.error(f"Ledger file '{ledger_file}' is missing 'unique_id' column in header. Please ensure it's correctly formatted.")
-                return [] # Return empty list if header is bad
-            for row in reader:
-                entries.append(row)
+def category_page_url(category_name, page):
+    """URL of a category's listing page (page 1 has no /page/N/ suffix)."""
+    if page > 1:
+        return config.CATEGORY_PAGINATION_URL_TEMPLATE.format(category=category_name, page=page)
+    return config.CATEGORY_URL_TEMPLATE.format(category=category_name)
+
+def hash_html(html):
+    """Fingerprint of a page's raw HTML, stamped on extracted rows to spot changed pages."""
+    return hashlib.md5(html.encode('utf-8')).hexdigest()
+
+def get_ledger_store():
+    """
+    Returns the process-wide LedgerStore. If the ledger database doesn't exist
+    yet, it is created and seeded from ledger.csv.
+    """
+    global _ledger_store
+    if _ledger_store is None:
+        is_new = not os.path.exists(config.LEDGER_DB_FILE)
+        _ledger_store = LedgerStore()
+        if is_new and os.path.exists(config.LEDGER_FILE) and os.path.getsize(config.LEDGER_FILE) > 0:
+            _ledger_store.import_csv(config.LEDGER_FILE)
+        atexit.register(_ledger_store.close)
+    return _ledger_store
+
+def load_ledger(category=None):
+    """Loads all ledger entries, or only those of one category."""
+    entries = get_ledger_store().entries(category)
     logging.info(f"Loaded {len(entries)} entries from ledger.")
     return entries
 
+def load_ledger_index():
+    """Returns the set of unique_ids already in the ledger, for O(1) membership checks."""
+    return get_ledger_store().ids()
+
+def flush_ledger():
+    """Commits any ledger entries still waiting for their batch."""
+    get_ledger_store().flush()
+
 def load_progress():
     """Loads progress from progress_tracker.csv."""
     progress_file = 'progress_tracker.csv'
@@ -65,29 +92,20 @@ def update_progress(category_name, page_number):
     progress_file = 'progress_tracker.csv'
     progress = load_progress()
     progress[category_name] = page_number
-    
-    with open(progress_file, 'w', newline='', encoding='utf-8') as f:
+
+    # Written aside and swapped in, so crawler processes never read a half-written file
+    temp_file = f"{progress_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
         writer.writerow(['category', 'last_page'])
         for cat, page in progress.items():
             writer.writerow([cat, page])
-    logging.info(f"Updated progress for {category_name} to page {page_number}")
+    os.replace(temp_file, progress_file)
+    logging.debug(f"Updated progress for {category_name} to page {page_number}")
 
 # Removed log_error functions, use logging.error directly
 
-def get_random_sleep_interval():
-    """Returns a random sleep interval between 2 and 8 seconds."""
-    interval = random.uniform(2, 8)
-    logging.debug(f"Sleeping for {interval:.2f} seconds.")
-    return interval
-
-def add_to_ledger(unique_id, file_path, post_url):
-    """Appends an entry to the ledger CSV."""
-    ledger_file = 'ledger.csv'
-    mode = 'a' if os.path.exists(ledger_file) and os.path.getsize(ledger_file) > 0 else 'w' # Check if file has content
-    with open(ledger_file, mode, newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        if mode == 'w':
-            writer.writerow(['unique_id', 'file_path', 'post_url'])
-        writer.writerow([unique_id, file_path, post_url])
+def add_to_ledger(unique_id, file_path, post_url, category=None, page=None):
+    """Adds an entry to the ledger. Entries are committed in batches; see flush_ledger()."""
+    get_ledger_store().add(unique_id, file_path, post_url, category, page)
     logging.debug(f"Added to ledger: {unique_id}") # Use logging.debug for less critical info